@@ -0,0 +1,376 @@
+"""Declarative aggregation queries (POST /analytics/query).
+
+A spec names measures (`count`, `distinct_users`), dimensions (`event_type`,
+`user_id`, `time` bucketed by `granularity`, `metadata.<key>`), filters, a
+half-open window [start_date, end_date), ordering and a limit. It is compiled
+into one GROUP BY statement with bound parameters, run on every shard, and the
+groups are summed; distinct users can be summed too because a user's events
+never span shards.
+
+Specs that only need per-user daily counts (dimensions `user_id` and `time` by
+day or longer, filters on `user_id`, whole UTC days within the last
+PROFILE_DAYS_KEPT days) are answered from the `user_activity_days` rollup
+instead of the events table. Rollup days are the ingest day, which can differ
+from `created_at` for events stored around midnight.
+
+Compiled statements are cached by spec shape: everything except filter values,
+the window and the limit, which are bound parameters (lists through expanding
+parameters), so dashboards re-running a query with new values skip compilation.
+ORDER BY and LIMIT are pushed into SQL when the groups of different shards are
+disjoint (one shard, or grouped by user) and SQL orders the same way as the
+merge; otherwise shards return up to QUERY_MAX_GROUPS groups each and the
+merged groups are sorted and cut here.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter
+from sqlalchemy import DateTime, bindparam, case, cast, distinct, func, literal_column, select
+from sqlalchemy.orm import Session
+
+from . import models, profiles, schemas
+from .event_types import event_types
+from .timebuckets import as_utc_naive
+
+QUERY_PLAN_CACHE_SIZE = int(os.getenv("QUERY_PLAN_CACHE_SIZE", "256"))
+# Groups a shard may return when ordering and limit cannot be pushed into SQL
+QUERY_MAX_GROUPS = int(os.getenv("QUERY_MAX_GROUPS", "100000"))
+QUERY_DEFAULT_DAYS = 7
+
+MEASURES = ("count", "distinct_users")
+METADATA_PREFIX = "metadata."
+METADATA_KEY = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+LIST_OPERATORS = ("in", "not_in")
+EQUALITY_OPERATORS = ("eq", "ne", *LIST_OPERATORS)
+
+EVENTS = "events"
+ROLLUP = "user_activity_days"
+
+PLAN_CACHE = Counter("analytics_query_plan_cache_total", "Aggregation query plan lookups", ["outcome"])
+QUERY_SOURCES = Counter("analytics_query_source_total", "Aggregation queries by table answering them", ["source"])
+
+class QueryError(ValueError):
+    """A spec that cannot be answered (reported as 400)"""
+
+@dataclass
+class Prepared:
+    """A compiled spec with the parameters of one run"""
+    spec: schemas.QuerySpec
+    source: str
+    start: datetime
+    end: datetime
+    statement: Any
+    params: Dict[str, Any]
+    pushed_down: bool
+
+class PlanCache:
+    """LRU map of spec shape -> compiled statement"""
+
+    def __init__(self, size: int = QUERY_PLAN_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.plans: "OrderedDict[tuple, Any]" = OrderedDict()
+
+    def get(self, shape: tuple, build):
+        with self._lock:
+            statement = self.plans.get(shape)
+            if statement is not None:
+                self.plans.move_to_end(shape)
+        PLAN_CACHE.labels(outcome="hit" if statement is not None else "miss").inc()
+        if statement is None:
+            statement = build()
+            with self._lock:
+                self.plans[shape] = statement
+                while len(self.plans) > self.size:
+                    self.plans.popitem(last=False)
+        return statement
+
+plans = PlanCache()
+
+def _value_kind(value) -> str:
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    raise QueryError(f"unsupported filter value {value!r}")
+
+def _filter_kind(query_filter: schemas.QueryFilter) -> str:
+    """Type of a filter's value(s), checking they fit its field and operator"""
+    values = query_filter.value
+    if query_filter.op in LIST_OPERATORS:
+        if not isinstance(values, list) or not values:
+            raise QueryError(f"'{query_filter.op}' on {query_filter.field} needs a non-empty list")
+    elif isinstance(values, list):
+        raise QueryError(f"'{query_filter.op}' on {query_filter.field} needs a single value")
+    else:
+        values = [values]
+    kinds = {_value_kind(value) for value in values}
+    if len(kinds) > 1:
+        raise QueryError(f"mixed value types for {query_filter.field}")
+    kind = kinds.pop()
+
+    if query_filter.field == "event_type":
+        if kind != "string" or query_filter.op not in EQUALITY_OPERATORS:
+            raise QueryError("event_type filters compare names with eq, ne, in or not_in")
+    elif query_filter.field == "user_id":
+        if kind != "number" or any(not isinstance(value, int) for value in values):
+            raise QueryError("user_id filters need integer values")
+    elif kind == "boolean" and query_filter.op not in EQUALITY_OPERATORS:
+        raise QueryError(f"'{query_filter.op}' does not apply to boolean values")
+    return kind
+
+def _check_field(name: str, allowed: Tuple[str, ...]):
+    if name in allowed:
+        return
+    if name.startswith(METADATA_PREFIX) and METADATA_KEY.match(name[len(METADATA_PREFIX):]):
+        return
+    raise QueryError(f"unknown field '{name}'")
+
+def _orderings(spec: schemas.QuerySpec) -> List[Tuple[str, str]]:
+    """(column, direction) sort keys: the spec's, then the remaining dimensions ascending"""
+    orderings = [(order.field, order.direction) for order in spec.order_by]
+    ordered = {field for field, _ in orderings}
+    return orderings + [(dimension, "asc") for dimension in spec.dimensions if dimension not in ordered]
+
+def validate(spec: schemas.QuerySpec) -> List[str]:
+    """Check field names and filter values; returns the kind of each filter's value"""
+    for measure in spec.measures:
+        if measure not in MEASURES:
+            raise QueryError(f"unknown measure '{measure}'")
+    if len(set(spec.measures)) != len(spec.measures) or len(set(spec.dimensions)) != len(spec.dimensions):
+        raise QueryError("measures and dimensions must not repeat")
+    for dimension in spec.dimensions:
+        _check_field(dimension, ("event_type", "user_id", "time"))
+    for query_filter in spec.filters:
+        _check_field(query_filter.field, ("event_type", "user_id"))
+    for order in spec.order_by:
+        if order.field not in spec.measures and order.field not in spec.dimensions:
+            raise QueryError(f"cannot order by '{order.field}': not a measure or dimension of the query")
+    return [_filter_kind(query_filter) for query_filter in spec.filters]
+
+def window(spec: schemas.QuerySpec, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    """[start, end) in naive UTC, defaulting to the QUERY_DEFAULT_DAYS before `end`"""
+    end = as_utc_naive(spec.end_date) if spec.end_date else (now or datetime.utcnow())
+    start = as_utc_naive(spec.start_date) if spec.start_date else end - timedelta(days=QUERY_DEFAULT_DAYS)
+    if start >= end:
+        raise QueryError("start_date must be before end_date")
+    return start, end
+
+def _midnight(value: datetime) -> bool:
+    return value.time() == time()
+
+def use_rollup(spec: schemas.QuerySpec, start: datetime, end: datetime, today: date) -> bool:
+    """Whether the per-user daily rollup holds everything the spec needs"""
+    return (
+        spec.source == "auto"
+        and set(spec.dimensions) <= {"user_id", "time"}
+        and ("time" not in spec.dimensions or spec.granularity != "hour")
+        and all(query_filter.field == "user_id" for query_filter in spec.filters)
+        and _midnight(start) and _midnight(end)
+        # The oldest kept day may already be partly pruned
+        and start.date() > today - timedelta(days=profiles.PROFILE_DAYS_KEPT)
+    )
+
+def _bucket(column, granularity: str, dialect: str, is_date: bool = False):
+    """Start of the `granularity` bucket holding `column` (UTC; weeks start on Monday)"""
+    if dialect == "postgresql":
+        naive = cast(column, DateTime) if is_date else func.timezone("UTC", column)
+        return func.date_trunc(granularity, naive)
+    # SQLite stores datetimes and dates as ISO text
+    if granularity == "week":
+        return func.date(column, "weekday 0", "-6 days").concat(" 00:00:00")
+    formats = {"hour": "%Y-%m-%d %H:00:00", "day": "%Y-%m-%d 00:00:00", "month": "%Y-%m-01 00:00:00"}
+    return func.strftime(formats[granularity], column)
+
+def _metadata_value(key: str, kind: str, dialect: str):
+    """Metadata value at `key` as SQL of `kind`, NULL if it is missing or of another JSON type"""
+    field = models.Event.event_metadata[key]
+    if kind == "string":
+        return field.as_string()
+    value = field.as_float() if kind == "number" else field.as_boolean()
+    if dialect == "postgresql":
+        json_type, types = func.json_typeof(field), ["number"] if kind == "number" else ["boolean"]
+    else:
+        json_type = func.json_type(models.Event.event_metadata, f'$."{key}"')
+        types = ["integer", "real"] if kind == "number" else ["true", "false"]
+    return case((json_type.in_(types), value))
+
+def _compare(column, op: str, name: str):
+    parameter = bindparam(name, expanding=op in LIST_OPERATORS)
+    return {
+        "eq": lambda: column == parameter,
+        "ne": lambda: column != parameter,
+        "in": lambda: column.in_(parameter),
+        "not_in": lambda: column.not_in(parameter),
+        "gt": lambda: column > parameter,
+        "gte": lambda: column >= parameter,
+        "lt": lambda: column < parameter,
+        "lte": lambda: column <= parameter,
+    }[op]()
+
+def _dimension_column(name: str, spec: schemas.QuerySpec, source: str, dialect: str):
+    if source == ROLLUP:
+        table = models.UserActivityDay
+        return table.user_id if name == "user_id" else _bucket(table.day, spec.granularity, dialect, is_date=True)
+    if name == "event_type":
+        return models.Event.event_type_id
+    if name == "user_id":
+        return models.Event.user_id
+    if name == "time":
+        return _bucket(models.Event.created_at, spec.granularity, dialect)
+    return _metadata_value(name[len(METADATA_PREFIX):], "string", dialect)
+
+def _filter_column(field: str, kind: str, source: str, dialect: str):
+    if field == "user_id":
+        return models.UserActivityDay.user_id if source == ROLLUP else models.Event.user_id
+    if field == "event_type":
+        return models.Event.event_type_id
+    return _metadata_value(field[len(METADATA_PREFIX):], kind, dialect)
+
+def build(spec: schemas.QuerySpec, kinds: List[str], source: str, dialect: str, pushed_down: bool):
+    """SELECT dimensions, measures ... GROUP BY dimensions with named parameters
+    `start`, `end`, `f<i>` (the i-th filter's value) and `limit`"""
+    if source == ROLLUP:
+        table, created = models.UserActivityDay, models.UserActivityDay.day
+        measures = {"count": func.coalesce(func.sum(table.count), 0),
+                    "distinct_users": func.count(distinct(table.user_id))}
+    else:
+        table, created = models.Event, models.Event.created_at
+        measures = {"count": func.count(), "distinct_users": func.count(distinct(models.Event.user_id))}
+
+    labels = {}
+    for index, dimension in enumerate(spec.dimensions):
+        labels[dimension] = _dimension_column(dimension, spec, source, dialect).label(f"d{index}")
+    for measure in spec.measures:
+        labels[measure] = measures[measure].label(measure)
+
+    statement = select(*labels.values()).select_from(table).where(
+        created >= bindparam("start"),
+        created < bindparam("end"),
+        *(
+            _compare(_filter_column(query_filter.field, kind, source, dialect), query_filter.op, f"f{index}")
+            for index, (query_filter, kind) in enumerate(zip(spec.filters, kinds))
+        )
+    )
+    if spec.dimensions:
+        # By position: the bucket and metadata expressions carry their own parameters
+        statement = statement.group_by(*(
+            literal_column(str(position)) for position in range(1, len(spec.dimensions) + 1)
+        ))
+    if pushed_down:
+        statement = statement.order_by(*(
+            labels[field].desc() if direction == "desc" else labels[field].asc()
+            for field, direction in _orderings(spec)
+        ))
+    return statement.limit(bindparam("limit"))
+
+def _pushed_down(spec: schemas.QuerySpec, shard_count: int) -> bool:
+    """Whether each shard can apply ORDER BY and LIMIT itself.
+
+    Needs groups that no other shard has, and sort keys SQL orders like the merge:
+    event type codes and collated metadata text do not.
+    """
+    disjoint = shard_count == 1 or "user_id" in spec.dimensions
+    return disjoint and all(field in (*MEASURES, "user_id", "time") for field, _ in _orderings(spec))
+
+def _code(db: Session, name: str) -> int:
+    # Names never ingested match no event
+    code = event_types.lookup(db, name)
+    return -1 if code is None else code
+
+def _parameters(db: Session, spec: schemas.QuerySpec, source: str, start: datetime, end: datetime,
+                pushed_down: bool) -> Dict[str, Any]:
+    params = {
+        "start": start.date() if source == ROLLUP else start,
+        "end": end.date() if source == ROLLUP else end,
+        "limit": spec.limit if pushed_down else QUERY_MAX_GROUPS + 1,
+    }
+    for index, query_filter in enumerate(spec.filters):
+        value = query_filter.value
+        if query_filter.field == "event_type":
+            value = [_code(db, name) for name in value] if isinstance(value, list) else _code(db, value)
+        params[f"f{index}"] = value
+    return params
+
+def prepare(db: Session, spec: schemas.QuerySpec, shard_count: int, now: Optional[datetime] = None) -> Prepared:
+    """Validate `spec`, choose the table answering it and fetch or compile its statement"""
+    kinds = validate(spec)
+    start, end = window(spec, now)
+    source = ROLLUP if use_rollup(spec, start, end, (now or datetime.utcnow()).date()) else EVENTS
+    dialect = db.get_bind().dialect.name
+    pushed_down = _pushed_down(spec, shard_count)
+
+    shape = (
+        source,
+        dialect,
+        tuple(spec.measures),
+        tuple(spec.dimensions),
+        spec.granularity if "time" in spec.dimensions else None,
+        tuple((query_filter.field, query_filter.op, kind) for query_filter, kind in zip(spec.filters, kinds)),
+        tuple(_orderings(spec)) if pushed_down else None,
+    )
+    statement = plans.get(shape, lambda: build(spec, kinds, source, dialect, pushed_down))
+    QUERY_SOURCES.labels(source=source).inc()
+    return Prepared(spec, source, start, end, statement, _parameters(db, spec, source, start, end, pushed_down),
+                    pushed_down)
+
+def execute(db: Session, prepared: Prepared) -> list:
+    """One shard's (dimensions..., measures...) rows"""
+    rows = db.execute(prepared.statement, prepared.params).all()
+    if not prepared.pushed_down and len(rows) > QUERY_MAX_GROUPS:
+        raise QueryError(f"more than {QUERY_MAX_GROUPS} groups; add filters or narrow the window")
+    return rows
+
+def _bucket_value(value) -> datetime:
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+def _sort_key(value):
+    """Numbers before strings before missing values (metadata values can be any of them)"""
+    if value is None:
+        return (2, 0)
+    return (1, value) if isinstance(value, str) else (0, value)
+
+def merge(db: Session, prepared: Prepared, per_shard: List[list]) -> schemas.QueryResult:
+    """Sum the shards' groups, decode them and apply the spec's ordering and limit"""
+    spec = prepared.spec
+    width = len(spec.dimensions)
+    totals: Dict[tuple, List[int]] = {}
+    for rows in per_shard:
+        for row in rows:
+            sums = totals.setdefault(tuple(row[:width]), [0] * len(spec.measures))
+            for index, value in enumerate(row[width:]):
+                sums[index] += value or 0
+
+    rows = []
+    for key, sums in totals.items():
+        row = {}
+        for dimension, value in zip(spec.dimensions, key):
+            if dimension == "event_type":
+                value = event_types.decode(db, value)
+            elif dimension == "time":
+                value = _bucket_value(value)
+            row[dimension] = value
+        row.update(zip(spec.measures, sums))
+        rows.append(row)
+    # Stable sorts from the last key to the first
+    for field, direction in reversed(_orderings(spec)):
+        rows.sort(key=lambda row: _sort_key(row[field]), reverse=direction == "desc")
+
+    return schemas.QueryResult(
+        columns=[*spec.dimensions, *spec.measures],
+        rows=rows[:spec.limit],
+        source=prepared.source,
+        start_date=prepared.start,
+        end_date=prepared.end
+    )
@@ -0,0 +1,259 @@
+"""Cold-tier archiving of old events to Parquet.
+
+The archiver moves events older than ARCHIVE_AFTER_DAYS out of the `events` table
+into zstd-compressed Parquet files under ARCHIVE_DIR, one directory per UTC day.
+Each file is recorded in the `archive_files` manifest with its min/max
+`created_at` in the same transaction that deletes its rows, so every event is in
+exactly one tier. Readers use the manifest to pick only the files overlapping a
+window and read just the columns they need. The same transaction adds the moved
+events to `archive_daily_counts`, which all-time totals read instead of the files.
+
+Run it periodically (a single instance at a time):
+    python -m app.archive [--older-than-days N]
+Files archived before the daily counts existed are counted once with:
+    python -m app.archive --recount
+"""
+import argparse
+import heapq
+import json
+import logging
+import os
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+from .event_types import event_types
+from .sharding import shard_sessionmakers
+from .timebuckets import as_utc_naive
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./archive")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+# Upper bound on rows per Parquet file (and per archiving transaction)
+ARCHIVE_FILE_ROWS = int(os.getenv("ARCHIVE_FILE_ROWS", "500000"))
+
+SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("event_type", pa.string()),
+    ("user_id", pa.int64()),
+    ("event_metadata", pa.string()),
+    ("client_event_id", pa.string()),
+    ("created_at", pa.timestamp("us", tz="UTC")),
+])
+
+def _utc(value: datetime) -> datetime:
+    return as_utc_naive(value).replace(tzinfo=timezone.utc)
+
+def _write_file(db: Session, rows, archive_dir: str, prefix: str) -> models.ArchiveFile:
+    """Write one day's rows to Parquet and return its (unsaved) manifest entry"""
+    created = [as_utc_naive(row.created_at) for row in rows]
+    table = pa.table({
+        "id": [row.id for row in rows],
+        "event_type": [event_types.decode(db, row.event_type_id) for row in rows],
+        "user_id": [row.user_id for row in rows],
+        "event_metadata": [json.dumps(row.event_metadata or {}) for row in rows],
+        "client_event_id": [row.client_event_id for row in rows],
+        "created_at": [_utc(value) for value in created],
+    }, schema=SCHEMA)
+
+    path = os.path.join(prefix, f"date={min(created):%Y-%m-%d}", f"events-{rows[0].id}-{rows[-1].id}.parquet")
+    full_path = os.path.join(archive_dir, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    pq.write_table(table, full_path + ".tmp", compression="zstd")
+    os.replace(full_path + ".tmp", full_path)
+
+    return models.ArchiveFile(
+        path=path,
+        min_created_at=min(created),
+        max_created_at=max(created),
+        row_count=len(rows),
+        size_bytes=os.path.getsize(full_path),
+    )
+
+def archive_events(db: Session, before: datetime, archive_dir: Optional[str] = None,
+                   file_rows: Optional[int] = None, prefix: str = "") -> int:
+    """Move events created before `before` to Parquet; returns the number archived.
+
+    `prefix` is a subdirectory keeping each shard's files apart (event ids are per shard).
+    """
+    archive_dir = archive_dir or ARCHIVE_DIR
+    file_rows = file_rows or ARCHIVE_FILE_ROWS
+    before = as_utc_naive(before)
+    archived = 0
+
+    while True:
+        oldest = db.query(func.min(models.Event.created_at)).filter(
+            models.Event.created_at < before
+        ).scalar()
+        if oldest is None:
+            return archived
+
+        day = as_utc_naive(oldest).replace(hour=0, minute=0, second=0, microsecond=0)
+        rows = db.query(
+            models.Event.id, models.Event.event_type_id, models.Event.user_id,
+            models.Event.event_metadata, models.Event.client_event_id, models.Event.created_at
+        ).filter(
+            models.Event.created_at >= day,
+            models.Event.created_at < min(day + timedelta(days=1), before)
+        ).order_by(models.Event.id).limit(file_rows).all()
+
+        entry = _write_file(db, rows, archive_dir, prefix)
+        try:
+            db.add(entry)
+            _add_daily_counts(db, day.date(), Counter(row.event_type_id for row in rows))
+            ids = [row.id for row in rows]
+            for offset in range(0, len(ids), 5000):
+                db.query(models.Event).filter(
+                    models.Event.id.in_(ids[offset:offset + 5000])
+                ).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            os.remove(os.path.join(archive_dir, entry.path))
+            raise
+        archived += len(rows)
+        logging.info(f"Archived {len(rows)} events to {entry.path}")
+
+def _add_daily_counts(db: Session, day: date, counts: Dict[int, int]):
+    for code, count in counts.items():
+        entry = db.get(models.ArchiveDailyCount, (day, code))
+        if entry:
+            entry.count += count
+        else:
+            db.add(models.ArchiveDailyCount(day=day, event_type_id=code, count=count))
+
+def archived_counts(db: Session) -> List[Tuple[int, int]]:
+    """(event_type_id, count) of every archived event, from the daily counts"""
+    return db.query(
+        models.ArchiveDailyCount.event_type_id, func.sum(models.ArchiveDailyCount.count)
+    ).group_by(models.ArchiveDailyCount.event_type_id).all()
+
+def recount(db: Session, archive_dir: Optional[str] = None) -> int:
+    """Rebuild the daily counts from the archived files; returns the number of events counted.
+
+    Only needed for files archived before the counts were kept.
+    """
+    db.query(models.ArchiveDailyCount).delete(synchronize_session=False)
+    counted = 0
+    for entry in files_for_range(db, None, None):
+        table = read_file(entry, None, None, ["event_type"], archive_dir)
+        names = {row["event_type"]: row["event_type_count"]
+                 for row in table.group_by("event_type").aggregate([("event_type", "count")]).to_pylist()}
+        codes = event_types.encode(db, names)
+        # Each file holds a single UTC day
+        _add_daily_counts(db, entry.min_created_at.date(), {codes[name]: count for name, count in names.items()})
+        db.flush()
+        counted += table.num_rows
+    db.commit()
+    return counted
+
+def files_for_range(db: Session, start: Optional[datetime], end: Optional[datetime]) -> List[models.ArchiveFile]:
+    """Manifest entries whose time span overlaps [start, end], oldest first"""
+    query = db.query(models.ArchiveFile)
+    if start:
+        query = query.filter(models.ArchiveFile.max_created_at >= as_utc_naive(start))
+    if end:
+        query = query.filter(models.ArchiveFile.min_created_at <= as_utc_naive(end))
+    return query.order_by(models.ArchiveFile.min_created_at, models.ArchiveFile.id).all()
+
+def read_file(entry: models.ArchiveFile, start: Optional[datetime], end: Optional[datetime],
+              columns: List[str], archive_dir: Optional[str] = None) -> pa.Table:
+    """Read `columns` of one archived file, restricted to [start, end]"""
+    filters = []
+    # Files entirely inside the window need no row filtering
+    if start and as_utc_naive(start) > entry.min_created_at:
+        filters.append(("created_at", ">=", _utc(start)))
+    if end and as_utc_naive(end) < entry.max_created_at:
+        filters.append(("created_at", "<=", _utc(end)))
+    return pq.read_table(
+        os.path.join(archive_dir or ARCHIVE_DIR, entry.path),
+        columns=columns,
+        filters=filters or None
+    )
+
+def range_stats(db: Session, start: Optional[datetime],
+                end: Optional[datetime]) -> Optional[Tuple[int, Dict[str, int], Set[int]]]:
+    """(event count, counts by type, distinct user ids) of archived events in a window.
+
+    Returns None when no archived file overlaps the window.
+    """
+    entries = files_for_range(db, start, end)
+    if not entries:
+        return None
+
+    total, breakdown, users = 0, {}, set()
+    for entry in entries:
+        table = read_file(entry, start, end, ["event_type", "user_id"])
+        total += table.num_rows
+        for row in table.group_by("event_type").aggregate([("event_type", "count")]).to_pylist():
+            breakdown[row["event_type"]] = breakdown.get(row["event_type"], 0) + row["event_type_count"]
+        users.update(pc.unique(table["user_id"]).to_pylist())
+    return total, breakdown, users
+
+def _overlapping_runs(entries: List[models.ArchiveFile]) -> Iterator[List[models.ArchiveFile]]:
+    """Group manifest entries (oldest first) into runs whose time spans overlap.
+
+    Files of one day are chunked by id, so their spans can interleave; runs do not.
+    """
+    run, run_end = [], None
+    for entry in entries:
+        if run and entry.min_created_at > run_end:
+            yield run
+            run = []
+        run_end = entry.max_created_at if not run else max(run_end, entry.max_created_at)
+        run.append(entry)
+    if run:
+        yield run
+
+def _file_events(entry: models.ArchiveFile, start: Optional[datetime], end: Optional[datetime],
+                 chunk_rows: int) -> Iterator[dict]:
+    table = read_file(entry, start, end, SCHEMA.names).sort_by([("created_at", "ascending"), ("id", "ascending")])
+    for batch in table.to_batches(max_chunksize=chunk_rows):
+        for row in batch.to_pylist():
+            yield {
+                "id": row["id"],
+                "event_type": row["event_type"],
+                "user_id": row["user_id"],
+                "event_metadata": json.loads(row["event_metadata"]),
+                "event_id": row["client_event_id"],
+                "created_at": as_utc_naive(row["created_at"]),
+            }
+
+def iter_events(db: Session, start: Optional[datetime], end: Optional[datetime],
+                chunk_rows: int = 1000) -> Iterator[dict]:
+    """Archived events in a window as API-shaped dicts, ordered by (created_at, id)"""
+    for run in _overlapping_runs(files_for_range(db, start, end)):
+        yield from heapq.merge(
+            *(_file_events(entry, start, end, chunk_rows) for entry in run),
+            key=lambda row: (row["created_at"], row["id"])
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old events to the Parquet cold tier")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--recount", action="store_true",
+                        help="rebuild the archived event counts from the files instead of archiving")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.recount:
+        for index, make_session in enumerate(shard_sessionmakers):
+            with make_session() as db:
+                print(f"Counted {recount(db)} archived events on shard {index}")
+        return
+    before = datetime.utcnow() - timedelta(days=args.older_than_days)
+    for index, make_session in enumerate(shard_sessionmakers):
+        prefix = f"shard={index}" if len(shard_sessionmakers) > 1 else ""
+        with make_session() as db:
+            archived = archive_events(db, before, prefix=prefix)
+        target = os.path.join(ARCHIVE_DIR, prefix) if prefix else ARCHIVE_DIR
+        print(f"Archived {archived} events created before {before:%Y-%m-%d %H:%M} to {target}")
+
+if __name__ == "__main__":
+    main()
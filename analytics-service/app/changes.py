@@ -0,0 +1,134 @@
+"""Change feed of stored events, keyed on the inserting transaction.
+
+Consumers call /analytics/events/changes with the cursor from their previous
+response and get the events stored since, per shard in the order of
+(inserting transaction id, event id). The cursor holds the last delivered
+position of every shard (`"<txid>:<id>"`, joined by `.` with several shards), so
+it is resumable and never skips or repeats rows the way offset pagination does
+while events arrive.
+
+Ids are allocated when a row is inserted, not when it commits, so an id cursor
+could pass a row that becomes visible later. Instead, on Postgres each row
+records pg_current_xact_id() and the feed only returns rows of transactions
+older than the oldest one still running (pg_snapshot_xmin of the statement's
+own snapshot). Those transactions have all ended, so no row can appear behind
+the cursor, and what has settled is decided by the database alone, with no
+clock involved; a long-running writing transaction holds the feed back until
+it ends. SQLite lets one transaction write at a time, so its rows
+become visible in id order and all have txid 0.
+
+An empty read waits up to `wait` seconds for new events. Ingest in this process
+wakes waiters at once; events stored by other workers are picked up by
+re-reading every CHANGES_POLL_SECONDS. Rows moved to the archive are not in the
+feed, and `python -m app.sharding rebalance` copies events in new transactions
+under new per-shard ids, so moved events are delivered again.
+"""
+import asyncio
+import heapq
+import os
+from collections import Counter
+from itertools import islice
+from typing import List, Optional, Tuple
+
+from prometheus_client import Gauge
+from sqlalchemy import literal_column, tuple_
+from sqlalchemy.orm import Session
+
+from . import models
+from .timebuckets import as_utc_naive
+
+CHANGES_MAX_WAIT_SECONDS = float(os.getenv("CHANGES_MAX_WAIT_SECONDS", "30"))
+CHANGES_POLL_SECONDS = float(os.getenv("CHANGES_POLL_SECONDS", "1"))
+
+# Transactions below this id have all committed or rolled back, as of the statement's snapshot
+SETTLED_TXID = literal_column("pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+
+WAITING = Gauge(
+    "event_changes_waiting", "Change feed requests waiting for new events", multiprocess_mode="livesum"
+)
+
+COLUMNS = (
+    models.Event.id,
+    models.Event.event_type_id,
+    models.Event.user_id,
+    models.Event.event_metadata,
+    models.Event.client_event_id,
+    models.Event.created_at,
+    models.Event.txid,
+)
+
+Position = Tuple[int, int]
+
+def parse_cursor(cursor: str, shard_count: int) -> List[Position]:
+    """Last delivered (txid, id) per shard; ValueError if the cursor does not fit this deployment"""
+    if cursor == "0":
+        return [(0, 0)] * shard_count
+    positions = [tuple(int(part) for part in position.split(":")) for position in cursor.split(".")]
+    if len(positions) != shard_count or any(len(position) != 2 or min(position) < 0 for position in positions):
+        raise ValueError(f"expected {shard_count} non-negative '<txid>:<id>' shard position(s)")
+    return positions
+
+def format_cursor(positions: List[Position]) -> str:
+    return ".".join(f"{txid}:{event_id}" for txid, event_id in positions)
+
+def read(db: Session, after: Position, limit: int) -> Tuple[list, bool]:
+    """Up to `limit` settled events after the `after` position, in (txid, id) order.
+
+    Returns (rows, whether more rows were available).
+    """
+    query = db.query(*COLUMNS).filter(tuple_(models.Event.txid, models.Event.id) > tuple_(*after))
+    if db.get_bind().dialect.name == "postgresql":
+        query = query.filter(models.Event.txid < SETTLED_TXID)
+    rows = query.order_by(models.Event.txid, models.Event.id).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+def merge(per_shard: List[list], limit: int) -> Tuple[list, List[Optional[Position]]]:
+    """Up to `limit` events over all shards by a k-way merge on each shard's next row.
+
+    Each shard's rows stay in feed order and are taken as a prefix, so its cursor
+    position can move to the last one taken; created_at only picks which shard
+    goes next, so rows whose feed order and timestamps disagree (long
+    transactions, clock skew between workers) still make progress. Returns
+    (rows, last taken position per shard or None).
+    """
+    streams = [[(index, row) for row in rows] for index, rows in enumerate(per_shard)]
+    merged = list(islice(heapq.merge(*streams, key=lambda item: as_utc_naive(item[1].created_at)), limit))
+    taken = Counter(index for index, _ in merged)
+    last_positions = [
+        (rows[taken[index] - 1].txid, rows[taken[index] - 1].id) if taken[index] else None
+        for index, rows in enumerate(per_shard)
+    ]
+    return [row for _, row in merged], last_positions
+
+class ChangeNotifier:
+    """Wakes change feed requests of this process when events are stored"""
+
+    def __init__(self):
+        self._event: Optional[asyncio.Event] = None
+
+    def clear(self):
+        self._event = None
+
+    def subscribe(self) -> asyncio.Event:
+        """Event set by the next `notify`; take it before reading so no wake-up is missed"""
+        if self._event is None:
+            self._event = asyncio.Event()
+        return self._event
+
+    def notify(self):
+        if self._event is not None:
+            self._event.set()
+            self._event = None
+
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        """Wait until `event` is set or `timeout` passes; True if woken"""
+        WAITING.inc()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            WAITING.dec()
+
+notifier = ChangeNotifier()
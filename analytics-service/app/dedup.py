@@ -0,0 +1,94 @@
+"""In-memory duplicate detection for client-supplied event ids.
+
+A rotating Bloom filter answers "definitely new" for most keys without touching the
+database, and an LRU of recent keys resolves most duplicates to the original event
+id. Only Bloom positives that miss the LRU need a lookup; the unique constraint on
+`events.client_event_id` remains the backstop across workers and restarts.
+"""
+import hashlib
+import math
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from prometheus_client import Counter
+
+DEDUP_BLOOM_CAPACITY = int(os.getenv("DEDUP_BLOOM_CAPACITY", "1000000"))
+DEDUP_BLOOM_ERROR_RATE = float(os.getenv("DEDUP_BLOOM_ERROR_RATE", "0.001"))
+DEDUP_LRU_SIZE = int(os.getenv("DEDUP_LRU_SIZE", "100000"))
+
+# duplicate_cached / duplicate_db / duplicate_constraint are dedup hits;
+# new_unchecked skipped the database, new_checked was a Bloom false positive
+DEDUP_OUTCOMES = Counter("event_dedup_total", "Idempotency key checks by outcome", ["outcome"])
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over one blake2b digest"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        first, second = struct.unpack("<QQ", hashlib.blake2b(key.encode(), digest_size=16).digest())
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class Deduplicator:
+    """Bloom filter (two generations of `capacity` keys) plus an LRU of key -> event id"""
+
+    def __init__(self, capacity: int = DEDUP_BLOOM_CAPACITY, error_rate: float = DEDUP_BLOOM_ERROR_RATE,
+                 lru_size: int = DEDUP_LRU_SIZE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.lru_size = lru_size
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.current = BloomFilter(self.capacity, self.error_rate)
+            self.previous: Optional[BloomFilter] = None
+            self.added = 0
+            self.recent: "OrderedDict[str, int]" = OrderedDict()
+
+    def cached(self, key: str) -> Optional[int]:
+        """Event id for a recently seen key, if it is still in the LRU"""
+        with self._lock:
+            event_id = self.recent.get(key)
+            if event_id is not None:
+                self.recent.move_to_end(key)
+            return event_id
+
+    def might_contain(self, key: str) -> bool:
+        with self._lock:
+            return key in self.current or (self.previous is not None and key in self.previous)
+
+    def remember(self, key: str, event_id: int):
+        with self._lock:
+            if self.added >= self.capacity:
+                # Keep the last generation so recent keys stay covered after rotation
+                self.previous, self.current = self.current, BloomFilter(self.capacity, self.error_rate)
+                self.added = 0
+            self.current.add(key)
+            self.added += 1
+            self.recent[key] = event_id
+            self.recent.move_to_end(key)
+            if len(self.recent) > self.lru_size:
+                self.recent.popitem(last=False)
+
+    def forget(self, key: str):
+        """Drop a cached event id that no longer points at the stored event"""
+        with self._lock:
+            self.recent.pop(key, None)
+
+deduplicator = Deduplicator()
@@ -0,0 +1,105 @@
+"""Content negotiation for event listings.
+
+JSON stays the default. Clients sending `Accept: application/vnd.apache.arrow.stream`
+get an Arrow IPC stream, and `Accept: application/msgpack` a MessagePack map of
+column name -> values; both are built directly from the query's result columns
+without going through Pydantic models. Compression is negotiated separately via
+`Accept-Encoding` (GZipMiddleware).
+"""
+import io
+import json
+from datetime import timezone
+from typing import Dict, Iterable, Iterator
+
+import msgpack
+import pyarrow as pa
+from fastapi import Request, Response
+
+from .timebuckets import as_utc_naive
+
+JSON = "application/json"
+ARROW = "application/vnd.apache.arrow.stream"
+MSGPACK = "application/msgpack"
+
+EVENT_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("event_type", pa.string()),
+    ("user_id", pa.int64()),
+    # Metadata maps have no fixed shape, so Arrow carries them as JSON text
+    ("event_metadata", pa.string()),
+    ("event_id", pa.string()),
+    ("created_at", pa.timestamp("us", tz="UTC")),
+])
+
+def negotiate(request: Request, supported=(JSON, ARROW, MSGPACK)) -> str:
+    """Pick the supported media type with the highest q-value in Accept (JSON if none match)"""
+    best, best_q = JSON, 0.0
+    for part in request.headers.get("accept", "").split(","):
+        media_type, *params = [piece.strip() for piece in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type in supported and q > best_q:
+            best, best_q = media_type, q
+    return best
+
+def event_columns(rows, decode) -> Dict[str, list]:
+    """Column lists for event rows; `decode` maps an event type code to its name"""
+    return {
+        "id": [row.id for row in rows],
+        "event_type": [decode(row.event_type_id) for row in rows],
+        "user_id": [row.user_id for row in rows],
+        "event_metadata": [row.event_metadata for row in rows],
+        "event_id": [row.client_event_id for row in rows],
+        "created_at": [as_utc_naive(row.created_at).replace(tzinfo=timezone.utc) for row in rows],
+    }
+
+def response_columns(events) -> Dict[str, list]:
+    """Column lists for already-decoded `EventResponse` objects"""
+    return {
+        "id": [event.id for event in events],
+        "event_type": [event.event_type for event in events],
+        "user_id": [event.user_id for event in events],
+        "event_metadata": [event.event_metadata for event in events],
+        "event_id": [event.event_id for event in events],
+        "created_at": [as_utc_naive(event.created_at).replace(tzinfo=timezone.utc) for event in events],
+    }
+
+def _record_batch(columns: Dict[str, list]) -> pa.RecordBatch:
+    columns = dict(columns, event_metadata=[json.dumps(value or {}) for value in columns["event_metadata"]])
+    return pa.RecordBatch.from_pydict(columns, schema=EVENT_SCHEMA)
+
+def _drain(buffer: io.BytesIO) -> bytes:
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+def _arrow_stream(chunks: Iterable[Dict[str, list]]) -> Iterator[bytes]:
+    buffer = io.BytesIO()
+    with pa.ipc.new_stream(buffer, EVENT_SCHEMA) as writer:
+        for columns in chunks:
+            writer.write_batch(_record_batch(columns))
+            # Hand each batch to the client as soon as it is written
+            yield _drain(buffer)
+    yield _drain(buffer)
+
+def encode_events(media_type: str, columns: Dict[str, list]) -> Response:
+    """Binary response for one set of event columns"""
+    if media_type == ARROW:
+        body = b"".join(_arrow_stream([columns]))
+    else:
+        body = msgpack.packb(columns, datetime=True)
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
+
+def encode_event_chunks(media_type: str, chunks: Iterable[Dict[str, list]]) -> Iterator[bytes]:
+    """Streamed body: one Arrow stream of many batches, or one MessagePack map per chunk"""
+    if media_type == ARROW:
+        yield from _arrow_stream(chunks)
+    else:
+        for columns in chunks:
+            yield msgpack.packb(columns, datetime=True)
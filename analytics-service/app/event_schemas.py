@@ -0,0 +1,409 @@
+"""Per-event-type metadata schemas.
+
+An event type may register a JSON Schema for its `event_metadata`. The supported
+subset is `type`, `properties`, `required`, `additionalProperties` (boolean),
+`enum`, `minimum`/`maximum`, `minLength`/`maxLength`, `pattern`, `items` and
+`minItems`/`maxItems`; annotations such as `title` and `description` are
+ignored, and any other keyword is rejected so a schema is never silently looser
+than written. Each schema is compiled once into nested closures (exact-class
+checks, dict lookups, precompiled regexes and prebuilt messages; nodes that
+constrain nothing are dropped), and every worker caches the compiled validators
+by event type name. Enum members match by JSON value, so `true` is not `1`.
+
+Workers compare (row count, max version) of the `event_schemas` table at most
+every SCHEMA_RELOAD_SECONDS and recompile only the rows that changed, so a new
+schema reaches every worker within that delay. Events of types without a schema
+are accepted unless SCHEMA_ALLOW_UNKNOWN_TYPES is turned off.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from service_common.startup import register_warmer
+
+from . import models
+from .event_types import event_types
+
+SCHEMA_RELOAD_SECONDS = float(os.getenv("SCHEMA_RELOAD_SECONDS", "5"))
+SCHEMA_ALLOW_UNKNOWN_TYPES = os.getenv("SCHEMA_ALLOW_UNKNOWN_TYPES", "true").lower() == "true"
+SCHEMA_SAVE_ATTEMPTS = 5
+
+SCHEMA_REJECTIONS = Counter(
+    "event_schema_rejections_total", "Events rejected by metadata schema validation", ["reason"]
+)
+
+# Exact classes, as produced by JSON parsing: bool is not an integer here
+TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "object": (dict,),
+    "array": (list,),
+    "null": (type(None),),
+}
+ANNOTATIONS = {"$schema", "$id", "title", "description", "default", "examples"}
+KEYWORDS = {
+    "type", "properties", "required", "additionalProperties", "enum", "minimum", "maximum",
+    "minLength", "maxLength", "pattern", "items", "minItems", "maxItems",
+} | ANNOTATIONS
+
+NUMBERS = TYPES["number"]
+MISSING = object()
+
+# keyword: message when the bound is violated
+BOUNDS = {
+    "minimum": "must be >=",
+    "maximum": "must be <=",
+    "minLength": "length must be >=",
+    "maxLength": "length must be <=",
+    "minItems": "item count must be >=",
+    "maxItems": "item count must be <=",
+}
+
+ROOT_PATH = "event_metadata"
+
+# A check appends "<path>: <problem>" to errors for each violation of one schema node.
+# The path is passed as the parent's path and this node's own segment, and only
+# joined when an error is reported or the check descends into the value.
+Check = Callable[[Any, str, str, List[str]], None]
+
+class SchemaError(ValueError):
+    """A metadata schema uses an unsupported keyword or an invalid value"""
+
+class SchemaConflict(RuntimeError):
+    """A schema could not be saved because concurrent saves kept winning"""
+
+def json_equal(a, b) -> bool:
+    """Equality of JSON values: 1 == 1.0, but booleans only equal booleans"""
+    if a.__class__ is bool or b.__class__ is bool:
+        return a.__class__ is b.__class__ and a == b
+    if a.__class__ in NUMBERS and b.__class__ in NUMBERS:
+        return a == b
+    if a.__class__ is not b.__class__:
+        return False
+    if a.__class__ is list:
+        return len(a) == len(b) and all(json_equal(x, y) for x, y in zip(a, b))
+    if a.__class__ is dict:
+        return a.keys() == b.keys() and all(json_equal(a[key], b[key]) for key in a)
+    return a == b
+
+def _type_check(allowed: tuple, type_message: str) -> Check:
+    def check(value, parent, name, errors):
+        if value.__class__ not in allowed:
+            errors.append(parent + name + type_message)
+    return check
+
+# Checks for one keyword family each, optionally with the node's type check folded
+# in: a node usually constrains a single family, and one small closure per node is
+# what keeps validation fast
+
+def _enum_check(allowed: Optional[tuple], type_message: str, options: list, message: str) -> Check:
+    # Strings are the usual enum members and can be matched by hash
+    strings = frozenset(option for option in options if option.__class__ is str)
+    others = [option for option in options if option.__class__ is not str]
+
+    def check(value, parent, name, errors):
+        cls = value.__class__
+        if allowed is not None and cls not in allowed:
+            errors.append(parent + name + type_message)
+        if not (value in strings if cls is str else any(json_equal(value, option) for option in others)):
+            errors.append(parent + name + message)
+    return check
+
+def _number_check(allowed: Optional[tuple], type_message: str, bounds: Dict[str, Tuple[float, str]]) -> Check:
+    minimum, minimum_message = bounds.get("minimum", (None, ""))
+    maximum, maximum_message = bounds.get("maximum", (None, ""))
+
+    def check(value, parent, name, errors):
+        cls = value.__class__
+        if allowed is not None and cls not in allowed:
+            errors.append(parent + name + type_message)
+        if cls in NUMBERS:
+            if minimum is not None and value < minimum:
+                errors.append(parent + name + minimum_message)
+            if maximum is not None and value > maximum:
+                errors.append(parent + name + maximum_message)
+    return check
+
+def _string_check(allowed: Optional[tuple], type_message: str, bounds: Dict[str, Tuple[float, str]],
+                  pattern: Optional[re.Pattern], pattern_message: str) -> Check:
+    min_length, min_length_message = bounds.get("minLength", (None, ""))
+    max_length, max_length_message = bounds.get("maxLength", (None, ""))
+
+    def check(value, parent, name, errors):
+        cls = value.__class__
+        if allowed is not None and cls not in allowed:
+            errors.append(parent + name + type_message)
+        if cls is not str:
+            return
+        if min_length is not None and len(value) < min_length:
+            errors.append(parent + name + min_length_message)
+        if max_length is not None and len(value) > max_length:
+            errors.append(parent + name + max_length_message)
+        if pattern is not None and not pattern.search(value):
+            errors.append(parent + name + pattern_message)
+    return check
+
+def _array_check(allowed: Optional[tuple], type_message: str, bounds: Dict[str, Tuple[float, str]],
+                 item: Optional[Check]) -> Check:
+    min_items, min_items_message = bounds.get("minItems", (None, ""))
+    max_items, max_items_message = bounds.get("maxItems", (None, ""))
+
+    def check(value, parent, name, errors):
+        cls = value.__class__
+        if allowed is not None and cls not in allowed:
+            errors.append(parent + name + type_message)
+        if cls is not list:
+            return
+        if min_items is not None and len(value) < min_items:
+            errors.append(parent + name + min_items_message)
+        if max_items is not None and len(value) > max_items:
+            errors.append(parent + name + max_items_message)
+        if item is not None:
+            path = parent + name
+            for index, element in enumerate(value):
+                item(element, path, f"[{index}]", errors)
+    return check
+
+def _object_check(allowed: Optional[tuple], type_message: str, required: List[Tuple[str, str]],
+                  properties: List[Tuple[str, str, Check]], closed: Optional[frozenset]) -> Check:
+    def check(value, parent, name, errors):
+        cls = value.__class__
+        if allowed is not None and cls not in allowed:
+            errors.append(parent + name + type_message)
+        if cls is not dict:
+            return
+        path = parent + name
+        for key, message in required:
+            if key not in value:
+                errors.append(path + message)
+        for key, child_name, child in properties:
+            child_value = value.get(key, MISSING)
+            if child_value is not MISSING:
+                child(child_value, path, child_name, errors)
+        if closed is not None and not closed.issuperset(value):
+            for key in value:
+                if key not in closed:
+                    errors.append(f"{path}: unexpected field {key!r}")
+    return check
+
+def _all_of(checks: List[Check]) -> Check:
+    def check(value, parent, name, errors):
+        for part in checks:
+            part(value, parent, name, errors)
+    return check
+
+def _compile_node(schema, label: str) -> Optional[Check]:
+    """Check for one schema node, or None if it constrains nothing; `label` names it in SchemaErrors"""
+    if not isinstance(schema, dict):
+        raise SchemaError(f"{label}: schema must be an object")
+    unsupported = schema.keys() - KEYWORDS
+    if unsupported:
+        raise SchemaError(f"{label}: unsupported keywords {sorted(unsupported)}")
+
+    allowed, type_message = None, ""
+    if "type" in schema:
+        names = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+        if not names or not all(isinstance(name, str) and name in TYPES for name in names):
+            raise SchemaError(f"{label}: unknown type {schema['type']!r}")
+        allowed = tuple(python_type for name in names for python_type in TYPES[name])
+        type_message = f": expected {' or '.join(names)}"
+    options, enum_message = None, ""
+    if "enum" in schema:
+        options = schema["enum"]
+        if not isinstance(options, list) or not options:
+            raise SchemaError(f"{label}: enum must be a non-empty list")
+        enum_message = f": must be one of {options}"
+    bounds = {}
+    for keyword, text in BOUNDS.items():
+        if keyword not in schema:
+            continue
+        bound = schema[keyword]
+        if not isinstance(bound, (int, float)) or isinstance(bound, bool):
+            raise SchemaError(f"{label}: {keyword} must be a number")
+        bounds[keyword] = (bound, f": {text} {bound}")
+    pattern, pattern_message = None, ""
+    if "pattern" in schema:
+        try:
+            pattern = re.compile(schema["pattern"])
+        except (re.error, TypeError):
+            raise SchemaError(f"{label}: invalid pattern")
+        pattern_message = f": must match {pattern.pattern!r}"
+
+    required, children, closed = [], [], None
+    if {"properties", "required", "additionalProperties"} & schema.keys():
+        properties = schema.get("properties", {})
+        required = schema.get("required", [])
+        additional = schema.get("additionalProperties", True)
+        if not isinstance(properties, dict):
+            raise SchemaError(f"{label}: properties must be an object")
+        if not isinstance(required, list) or not all(isinstance(name, str) for name in required):
+            raise SchemaError(f"{label}: required must be a list of names")
+        if not isinstance(additional, bool):
+            raise SchemaError(f"{label}: only boolean additionalProperties is supported")
+        for name, subschema in properties.items():
+            child = _compile_node(subschema, f"{label}.{name}")
+            # Properties with nothing to check are not even looked up
+            if child is not None:
+                children.append((name, "." + name, child))
+        required = [(name, f".{name}: required") for name in required]
+        closed = None if additional else frozenset(properties)
+    item = _compile_node(schema["items"], f"{label}[]") if "items" in schema else None
+
+    families = []
+    if options is not None:
+        families.append(partial(_enum_check, options=options, message=enum_message))
+    if bounds.keys() & {"minimum", "maximum"}:
+        families.append(partial(_number_check, bounds=bounds))
+    if bounds.keys() & {"minLength", "maxLength"} or pattern is not None:
+        families.append(partial(_string_check, bounds=bounds, pattern=pattern, pattern_message=pattern_message))
+    if bounds.keys() & {"minItems", "maxItems"} or item is not None:
+        families.append(partial(_array_check, bounds=bounds, item=item))
+    if required or children or closed is not None:
+        families.append(partial(_object_check, required=required, properties=children, closed=closed))
+
+    if not families:
+        return None if allowed is None else _type_check(allowed, type_message)
+    if len(families) == 1:
+        return families[0](allowed, type_message)
+    type_check = [] if allowed is None else [_type_check(allowed, type_message)]
+    return _all_of(type_check + [family(None, "") for family in families])
+
+def compile_schema(schema: dict) -> Callable[[Optional[dict]], List[str]]:
+    """Validator returning the errors of an event's metadata (empty if valid).
+
+    Raises SchemaError if the schema is not an object schema in the supported subset.
+    """
+    if not isinstance(schema, dict) or schema.get("type", "object") != "object":
+        raise SchemaError("a metadata schema must have type 'object'")
+    root = _compile_node(schema, ROOT_PATH)
+
+    def validate(metadata):
+        errors = []
+        if root is not None:
+            root({} if metadata is None else metadata, ROOT_PATH, "", errors)
+        return errors
+    return validate
+
+class SchemaRegistry:
+    """Compiled metadata validators by event type name, reloaded when the table changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.validators: Dict[str, Tuple[int, Callable]] = {}
+            self.signature: Optional[Tuple[int, int]] = None
+            self.last_check: Optional[float] = None
+
+    def load(self, db: Session):
+        """Read every schema, recompiling only those whose version changed"""
+        rows = db.query(models.EventType.name, models.EventSchema.version, models.EventSchema.definition).join(
+            models.EventType, models.EventType.id == models.EventSchema.event_type_id
+        ).all()
+        validators = {}
+        for name, version, definition in rows:
+            cached = self.validators.get(name)
+            if cached and cached[0] == version:
+                validators[name] = cached
+                continue
+            try:
+                validators[name] = (version, compile_schema(definition))
+            except SchemaError as e:
+                logging.warning(f"Ignoring invalid metadata schema for {name}: {e}")
+        with self._lock:
+            self.validators = validators
+            self.signature = (len(rows), max((version for _, version, _ in rows), default=0))
+            self.last_check = time.monotonic()
+
+    def reload_if_due(self, db: Session):
+        if self.last_check is not None and time.monotonic() - self.last_check < SCHEMA_RELOAD_SECONDS:
+            return
+        count, version = db.query(func.count(models.EventSchema.event_type_id),
+                                  func.max(models.EventSchema.version)).one()
+        if (count, version or 0) != self.signature:
+            self.load(db)
+        else:
+            self.last_check = time.monotonic()
+
+    def validate(self, db: Session, events) -> List[dict]:
+        """{"index", "event_type", "errors"} for each event whose metadata is rejected"""
+        self.reload_if_due(db)
+        validators = self.validators
+        rejected = []
+        for index, event in enumerate(events):
+            entry = validators.get(event.event_type)
+            if entry is None:
+                if not SCHEMA_ALLOW_UNKNOWN_TYPES:
+                    SCHEMA_REJECTIONS.labels("unknown_type").inc()
+                    rejected.append({"index": index, "event_type": event.event_type,
+                                     "errors": ["no metadata schema is registered for this event type"]})
+                continue
+            errors = entry[1](event.event_metadata)
+            if errors:
+                SCHEMA_REJECTIONS.labels("invalid").inc()
+                rejected.append({"index": index, "event_type": event.event_type, "errors": errors})
+        return rejected
+
+registry = SchemaRegistry()
+
+def _next_version(db: Session) -> int:
+    # Versions increase over the whole table, so any change moves the (count, max version) signature
+    return (db.query(func.max(models.EventSchema.version)).scalar() or 0) + 1
+
+def save(db: Session, event_type: str, definition: dict) -> models.EventSchema:
+    """Register or replace the schema of an event type; raises SchemaError if it does not compile.
+
+    A concurrent save that takes the same version fails the unique constraint, and
+    one that replaced the row first fails the previous-version check; either way
+    the save is retried with a fresh version, up to SCHEMA_SAVE_ATTEMPTS times.
+    """
+    compile_schema(definition)
+    code = event_types.encode(db, [event_type])[event_type]
+    for _ in range(SCHEMA_SAVE_ATTEMPTS):
+        version = _next_version(db)
+        previous = db.query(models.EventSchema.version).filter(models.EventSchema.event_type_id == code).scalar()
+        try:
+            if previous is None:
+                db.add(models.EventSchema(event_type_id=code, definition=definition, version=version))
+                db.flush()
+            elif not db.query(models.EventSchema).filter(
+                models.EventSchema.event_type_id == code, models.EventSchema.version == previous
+            ).update({"definition": definition, "version": version}, synchronize_session=False):
+                db.rollback()
+                continue
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            continue
+        registry.load(db)
+        return db.get(models.EventSchema, code)
+    raise SchemaConflict(f"the schema of {event_type} kept changing concurrently, retry later")
+
+def delete(db: Session, event_type: str) -> bool:
+    """Drop the schema of an event type; False if it had none"""
+    code = event_types.lookup(db, event_type)
+    row = db.get(models.EventSchema, code) if code is not None else None
+    if row is None:
+        return False
+    db.delete(row)
+    db.commit()
+    registry.load(db)
+    return True
+
+@register_warmer
+def warm_event_schemas(db: Session):
+    """Compile the registered metadata schemas"""
+    registry.load(db)
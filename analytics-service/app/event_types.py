@@ -0,0 +1,82 @@
+"""Dictionary encoding of event type names.
+
+Events store a small integer code from the `event_types` table instead of the
+name. Codes never change once assigned, so every process keeps a bidirectional
+cache that only needs the database for names (or codes) it has not seen yet.
+"""
+import threading
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from service_common.startup import register_warmer
+
+from . import models
+
+class EventTypeCache:
+    """In-process name <-> code map for event types"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.codes: Dict[str, int] = {}
+            self.names: Dict[int, str] = {}
+
+    def _store(self, rows):
+        with self._lock:
+            for code, name in rows:
+                self.codes[name] = code
+                self.names[code] = name
+
+    def load(self, db: Session):
+        """Load the whole dictionary (it only has a few dozen rows)"""
+        self._store(db.query(models.EventType.id, models.EventType.name).all())
+
+    def lookup(self, db: Session, name: str) -> Optional[int]:
+        """Code for an existing event type, or None if it was never ingested"""
+        if name not in self.codes:
+            self._store(db.query(models.EventType.id, models.EventType.name).filter(
+                models.EventType.name == name
+            ).all())
+        return self.codes.get(name)
+
+    def encode(self, db: Session, names: Iterable[str]) -> Dict[str, int]:
+        """Codes for `names`, registering new event types.
+
+        New types are committed straight away, so call this before adding rows
+        to the session. A concurrent insert of the same name by another worker is
+        resolved by re-reading the dictionary.
+        """
+        names = set(names)
+        missing = names - self.codes.keys()
+        if missing:
+            self._store(db.query(models.EventType.id, models.EventType.name).filter(
+                models.EventType.name.in_(missing)
+            ).all())
+            missing -= self.codes.keys()
+        if missing:
+            db.add_all([models.EventType(name=name) for name in sorted(missing)])
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+            self._store(db.query(models.EventType.id, models.EventType.name).filter(
+                models.EventType.name.in_(missing)
+            ).all())
+        return {name: self.codes[name] for name in names}
+
+    def decode(self, db: Session, code: int) -> str:
+        if code not in self.names:
+            self.load(db)
+        return self.names[code]
+
+event_types = EventTypeCache()
+
+@register_warmer
+def warm_event_types(db: Session):
+    """Preload the event type dictionary"""
+    event_types.load(db)
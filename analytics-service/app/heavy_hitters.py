@@ -0,0 +1,156 @@
+"""Per-bucket heavy-hitter sketches for top-N users and event types.
+
+Each process keeps sketches for the buckets it has recently ingested into and
+periodically writes them to `sketch_buckets` under its own node id. Queries merge
+the stored rows for the requested buckets with this process's in-memory state, so
+multiple workers and pods coordinate through the database rather than shared memory.
+"""
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .sketches import HeavyHitterSketch
+from .timebuckets import as_utc_naive, bucket_start
+
+SKETCH_BUCKET_SECONDS = int(os.getenv("SKETCH_BUCKET_SECONDS", "3600"))
+SKETCH_CAPACITY = int(os.getenv("SKETCH_CAPACITY", "256"))
+SKETCH_FLUSH_SECONDS = float(os.getenv("SKETCH_FLUSH_SECONDS", "10"))
+
+NODE_ID = uuid.uuid4().hex
+
+USERS = "user_id"
+EVENT_TYPES = "event_type"
+
+class SketchStore:
+    """In-memory sketches for recent buckets, flushed to the database on ingest"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.buckets: Dict[Tuple[str, datetime], HeavyHitterSketch] = {}
+        self.dirty = set()
+        # Buckets dropped from memory after flushing, and those reopened by late events
+        self.evicted = set()
+        self.resumed = set()
+        self.last_flush = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self.buckets.clear()
+            self.dirty.clear()
+            self.evicted.clear()
+            self.resumed.clear()
+            self.last_flush = time.monotonic()
+
+    def _sketch(self, dimension: str, start: datetime) -> HeavyHitterSketch:
+        key = (dimension, start)
+        if key not in self.buckets:
+            self.buckets[key] = HeavyHitterSketch(SKETCH_CAPACITY)
+            if key in self.evicted:
+                self.evicted.discard(key)
+                self.resumed.add(key)
+        self.dirty.add(key)
+        return self.buckets[key]
+
+    def record(self, event_type: str, user_id: int, created_at: datetime):
+        start = bucket_start(created_at, SKETCH_BUCKET_SECONDS)
+        with self._lock:
+            self._sketch(USERS, start).add(str(user_id))
+            self._sketch(EVENT_TYPES, start).add(event_type)
+
+    def flush_if_due(self, db: Session):
+        if self.dirty and time.monotonic() - self.last_flush >= SKETCH_FLUSH_SECONDS:
+            self.flush(db)
+
+    def flush(self, db: Session):
+        """Write dirty buckets for this node and forget buckets that have closed"""
+        with self._lock:
+            pending = {key: self.buckets[key].to_dict() for key in self.dirty}
+            resumed = self.resumed & pending.keys()
+            self.dirty.clear()
+            self.last_flush = time.monotonic()
+
+        try:
+            restored = self._write(db, pending, resumed)
+        except Exception:
+            db.rollback()
+            with self._lock:
+                self.dirty |= pending.keys()
+            raise
+
+        current = bucket_start(datetime.utcnow(), SKETCH_BUCKET_SECONDS)
+        with self._lock:
+            for key, stored in restored.items():
+                self.buckets[key].merge(stored)
+            self.resumed -= resumed
+            for key in list(self.buckets):
+                if key[1] < current and key not in self.dirty:
+                    del self.buckets[key]
+                    self.evicted.add(key)
+
+    def _write(self, db: Session, pending: dict, resumed: set) -> dict:
+        """Upsert this node's rows; returns stored sketches merged into resumed buckets"""
+        restored = {}
+        for (dimension, start), payload in pending.items():
+            row = db.query(models.SketchBucket).filter(
+                models.SketchBucket.dimension == dimension,
+                models.SketchBucket.bucket_start == start,
+                models.SketchBucket.node_id == NODE_ID
+            ).first()
+            if row and (dimension, start) in resumed:
+                # A late event reopened a bucket that was already flushed and evicted
+                stored = HeavyHitterSketch.from_dict(row.payload)
+                restored[(dimension, start)] = stored
+                combined = HeavyHitterSketch.from_dict(payload)
+                combined.merge(stored)
+                row.payload = combined.to_dict()
+            elif row:
+                row.payload = payload
+            else:
+                db.add(models.SketchBucket(
+                    dimension=dimension, bucket_start=start, node_id=NODE_ID, payload=payload
+                ))
+        db.commit()
+        return restored
+
+    def merged(self, db: Session, dimension: str, start: datetime, end: datetime) -> HeavyHitterSketch:
+        """Merge all partial sketches for buckets overlapping [start, end]"""
+        first_bucket = bucket_start(start, SKETCH_BUCKET_SECONDS)
+        end = as_utc_naive(end)
+        result = HeavyHitterSketch(SKETCH_CAPACITY)
+
+        with self._lock:
+            local = [
+                key[1] for key in self.buckets
+                if key[0] == dimension and first_bucket <= key[1] <= end
+            ]
+            for start_of_bucket in local:
+                result.merge(self.buckets[(dimension, start_of_bucket)])
+
+        rows = db.query(models.SketchBucket.node_id, models.SketchBucket.bucket_start,
+                        models.SketchBucket.payload).filter(
+            models.SketchBucket.dimension == dimension,
+            models.SketchBucket.bucket_start >= first_bucket,
+            models.SketchBucket.bucket_start <= end
+        ).all()
+        for node_id, start_of_bucket, payload in rows:
+            if node_id == NODE_ID and start_of_bucket in local and \
+                    (dimension, start_of_bucket) not in self.resumed:
+                continue
+            result.merge(HeavyHitterSketch.from_dict(payload))
+        return result
+
+store = SketchStore()
+
+def _reset_after_fork():
+    """A forked worker must not share the parent's node id or unflushed sketches"""
+    global NODE_ID, store
+    NODE_ID = uuid.uuid4().hex
+    store = SketchStore()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
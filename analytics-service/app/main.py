@@ -1,11 +1,28 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from prometheus_fastapi_instrumentator import Instrumentator
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+import asyncio
 import logging
+import os
+from typing import Optional
 
-from . import models
-from .database import engine
+from service_common import startup
+from service_common.load_shedding import (
+    LOAD_SHED_LATENCY_TOLERANCE, LoadShedder, LoadSheddingMiddleware
+)
+
+from . import heavy_hitters, metrics, sessions
+from .database import DB_MAX_OVERFLOW, DB_POOL_SIZE, SessionLocal, engine
 from .routers import analytics
+from .sharding import Shards, get_shards, open_shards
+
+# Responses smaller than this are not worth compressing
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1000"))
+# Lower levels trade a little size for much less CPU on large listings
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "1"))
 
 app = FastAPI(
     title="Analytics Service API",
@@ -13,6 +30,42 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Total in-flight requests admitted; beyond the connection pool they would only queue
+LOAD_SHED_MAX_CONCURRENCY = int(os.getenv("LOAD_SHED_MAX_CONCURRENCY", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+
+# Load shedding (added before CORS so rejections still carry CORS headers):
+# the share of the global concurrency cap each route class may use
+HEAVY_AGGREGATE_PATHS = {
+    "/analytics/summary",
+    "/analytics/events/by-type",
+    "/analytics/events/date-range",
+    "/analytics/events/export",
+    "/analytics/sessions/stats",
+    "/analytics/metrics",
+    "/analytics/top-users",
+    "/analytics/top-event-types",
+    "/analytics/query",
+}
+
+# Long-polls hold no connection while waiting, and their duration is not latency
+UNLIMITED_PATHS = {"/analytics/events/changes"}
+
+def classify_request(method: str, path: str):
+    if not path.startswith("/analytics") or path in UNLIMITED_PATHS:
+        return None
+    if method == "POST" and path.startswith("/analytics/events"):
+        return "ingest"
+    if path in HEAVY_AGGREGATE_PATHS:
+        return "heavy"
+    return "reads"
+
+load_shedder = LoadShedder(
+    {"ingest": 1.0, "reads": 0.75, "heavy": 0.5},
+    max_concurrency=LOAD_SHED_MAX_CONCURRENCY,
+    tolerance=LOAD_SHED_LATENCY_TOLERANCE
+)
+app.add_middleware(LoadSheddingMiddleware, shedder=load_shedder, classify=classify_request)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -22,17 +75,44 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Response compression, negotiated via Accept-Encoding
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_BYTES, compresslevel=GZIP_LEVEL)
+
 # Prometheus instrumentation
 Instrumentator().instrument(app).expose(app)
 
 @app.on_event("startup")
 async def startup_event():
-    """Create database tables when the application starts"""
-    try:
-        models.Base.metadata.create_all(bind=engine)
-        logging.info("Database tables created successfully")
-    except Exception as e:
-        logging.error(f"Error creating database tables: {e}")
+    """Warm the connection pool and hot queries in the background.
+
+    Tables are created by the migration step (`alembic upgrade head`), not here.
+    """
+    app.state.warmup_task = asyncio.create_task(startup.warm_up_until_ready(engine))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.warmup_task.cancel()
+    if heavy_hitters.store.dirty:
+        try:
+            with SessionLocal() as db:
+                heavy_hitters.store.flush(db)
+        except Exception as e:
+            logging.warning(f"Failed to flush heavy-hitter sketches on shutdown: {e}")
+    if metrics.store.pending:
+        try:
+            with SessionLocal() as db:
+                metrics.store.flush(db)
+        except Exception as e:
+            logging.warning(f"Failed to flush metric sketches on shutdown: {e}")
+    # Open sessions would be lost with the process: close and write them all
+    if sessions.sessionizer.unwritten():
+        shards = open_shards()
+        try:
+            sessions.sessionizer.flush(shards, close_all=True)
+        except Exception as e:
+            logging.warning(f"Failed to flush sessions on shutdown: {e}")
+        finally:
+            shards.close()
 
 # Include routers
 app.include_router(analytics.router)
@@ -48,3 +128,26 @@ async def root():
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
+
+def _ping(db: Session) -> Optional[str]:
+    try:
+        db.execute(text("SELECT 1"))
+    except Exception as e:
+        return str(e)
+    return None
+
+@app.get("/ready")
+async def readiness_check(response: Response, shards: Shards = Depends(get_shards)):
+    """Readiness probe: warm-up finished and every shard's database answers"""
+    if not startup.readiness.ready:
+        response.status_code = 503
+        return {"status": "warming_up", "detail": startup.readiness.last_error}
+
+    # Any request may need any shard (summaries read them all), so one down shard means not ready
+    errors = await shards.gather(_ping)
+    failed = [f"shard {index}: {error}" for index, error in enumerate(errors) if error]
+    if failed:
+        response.status_code = 503
+        return {"status": "unavailable", "detail": "; ".join(failed)}
+
+    return {"status": "ready", "cold_start_seconds": startup.readiness.cold_start_seconds}
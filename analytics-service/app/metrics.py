@@ -0,0 +1,168 @@
+"""Per-bucket numeric sketches of event metadata fields.
+
+On ingest, every top-level numeric field of an event's metadata (up to
+METRIC_MAX_FIELDS per event) is added to a NumericSketch keyed by event type,
+field and time bucket. Each process accumulates the values it has not written
+yet and periodically merges them into its own `metric_buckets` rows, so rows are
+only ever touched by one process. Queries merge the stored rows for the requested
+buckets with this process's unwritten values; percentiles over long windows read
+one small sketch per bucket instead of every value.
+"""
+import math
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .sketches import NumericSketch
+from .timebuckets import as_utc_naive, bucket_start
+
+METRIC_BUCKET_SECONDS = int(os.getenv("METRIC_BUCKET_SECONDS", "3600"))
+METRIC_FLUSH_SECONDS = float(os.getenv("METRIC_FLUSH_SECONDS", "10"))
+METRIC_MAX_FIELDS = int(os.getenv("METRIC_MAX_FIELDS", "20"))
+METRIC_RELATIVE_ACCURACY = float(os.getenv("METRIC_RELATIVE_ACCURACY", "0.01"))
+
+# Longer keys are not sketched
+MAX_FIELD_LENGTH = 64
+
+NODE_ID = uuid.uuid4().hex
+
+Key = Tuple[int, str, datetime]
+
+def numeric_fields(metadata: Optional[dict]) -> List[Tuple[str, float]]:
+    """Top-level finite numeric metadata values (booleans excluded), in key order"""
+    if not metadata:
+        return []
+    fields = [
+        (field, float(value)) for field, value in metadata.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+        and len(field) <= MAX_FIELD_LENGTH and math.isfinite(value)
+    ]
+    return sorted(fields)[:METRIC_MAX_FIELDS]
+
+class MetricStore:
+    """Unwritten per-bucket sketches of this process, merged into the database on ingest"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.pending: Dict[Key, NumericSketch] = {}
+        self.last_flush = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self.pending.clear()
+            self.last_flush = time.monotonic()
+
+    def record(self, events: Iterable[Tuple[int, Optional[dict]]], created_at: datetime):
+        """Add the numeric fields of (event_type_id, metadata) pairs stored at `created_at`"""
+        start = bucket_start(created_at, METRIC_BUCKET_SECONDS)
+        with self._lock:
+            for code, metadata in events:
+                for field, value in numeric_fields(metadata):
+                    key = (code, field, start)
+                    if key not in self.pending:
+                        self.pending[key] = NumericSketch(METRIC_RELATIVE_ACCURACY)
+                    self.pending[key].add(value)
+
+    def flush_if_due(self, db: Session):
+        if self.pending and time.monotonic() - self.last_flush >= METRIC_FLUSH_SECONDS:
+            self.flush(db)
+
+    def flush(self, db: Session):
+        """Merge unwritten sketches into this node's rows"""
+        # One flush at a time per process: rows are read, merged and written back
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                pending, self.pending = self.pending, {}
+                self.last_flush = time.monotonic()
+            try:
+                self._write(db, pending)
+            except Exception:
+                db.rollback()
+                with self._lock:
+                    for key, sketch in pending.items():
+                        if key in self.pending:
+                            sketch.merge(self.pending[key])
+                        self.pending[key] = sketch
+                raise
+        finally:
+            self._flush_lock.release()
+
+    def _write(self, db: Session, pending: Dict[Key, NumericSketch]):
+        if not pending:
+            return
+        starts = {start for _, _, start in pending}
+        rows = {
+            (row.event_type_id, row.field, row.bucket_start): row
+            for row in db.query(models.MetricBucket).filter(
+                models.MetricBucket.node_id == NODE_ID,
+                models.MetricBucket.bucket_start >= min(starts),
+                models.MetricBucket.bucket_start <= max(starts)
+            )
+        }
+        for (code, field, start), sketch in pending.items():
+            row = rows.get((code, field, start))
+            if row:
+                stored = NumericSketch.from_dict(row.payload)
+                stored.merge(sketch)
+                row.payload = stored.to_dict()
+            else:
+                db.add(models.MetricBucket(
+                    event_type_id=code, field=field, bucket_start=start, node_id=NODE_ID, payload=sketch.to_dict()
+                ))
+        db.commit()
+
+    def merged(self, db: Session, field: str, start: datetime, end: datetime,
+               event_type_id: Optional[int] = None) -> Dict[Tuple[int, datetime], NumericSketch]:
+        """Sketches of `field` per (event type code, bucket) for buckets overlapping [start, end]"""
+        first_bucket = bucket_start(start, METRIC_BUCKET_SECONDS)
+        end = as_utc_naive(end)
+        result: Dict[Tuple[int, datetime], NumericSketch] = {}
+
+        def add(code: int, start_of_bucket: datetime, sketch: NumericSketch):
+            key = (code, start_of_bucket)
+            if key in result:
+                result[key].merge(sketch)
+            else:
+                result[key] = sketch
+
+        query = db.query(models.MetricBucket.event_type_id, models.MetricBucket.bucket_start,
+                         models.MetricBucket.payload).filter(
+            models.MetricBucket.field == field,
+            models.MetricBucket.bucket_start >= first_bucket,
+            models.MetricBucket.bucket_start <= end
+        )
+        if event_type_id is not None:
+            query = query.filter(models.MetricBucket.event_type_id == event_type_id)
+        for code, start_of_bucket, payload in query:
+            add(code, start_of_bucket, NumericSketch.from_dict(payload))
+
+        # Copied under the lock: merging into the result must not mutate pending sketches
+        with self._lock:
+            local = [
+                (code, start_of_bucket, NumericSketch.from_dict(sketch.to_dict()))
+                for (code, key_field, start_of_bucket), sketch in self.pending.items()
+                if key_field == field and first_bucket <= start_of_bucket <= end
+                and (event_type_id is None or code == event_type_id)
+            ]
+        for code, start_of_bucket, sketch in local:
+            add(code, start_of_bucket, sketch)
+        return result
+
+store = MetricStore()
+
+def _reset_after_fork():
+    """A forked worker must not share the parent's node id or unwritten values"""
+    global NODE_ID, store
+    NODE_ID = uuid.uuid4().hex
+    store = MetricStore()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
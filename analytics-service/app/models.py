@@ -1,12 +1,189 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON
-from sqlalchemy.sql import func
+from sqlalchemy import (
+    BigInteger, Column, Integer, SmallInteger, String, Date, DateTime, Float, JSON, ForeignKey, Index,
+    UniqueConstraint
+)
+from sqlalchemy.sql import func, text
 from .database import Base
 
+# 2-byte codes; SQLite only autoincrements INTEGER primary keys
+EventTypeCode = SmallInteger().with_variant(Integer, "sqlite")
+
+class EventType(Base):
+    """Dictionary of event type names; events store the code (see app/event_types.py)"""
+    __tablename__ = "event_types"
+
+    id = Column(EventTypeCode, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+
 class Event(Base):
     __tablename__ = "events"
+    __table_args__ = (
+        Index("ix_events_txid_id", "txid", "id"),
+        # Sampled distinct-user counts read one hash range per window (app/sampling.py)
+        Index("ix_events_user_hash", text("((user_id * 2654435761) % 4294967296)"), "created_at", "user_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    event_type = Column(String, index=True, nullable=False)
+    event_type_id = Column(EventTypeCode, ForeignKey("event_types.id"), index=True, nullable=False)
     user_id = Column(Integer, index=True, nullable=False)
     event_metadata = Column(JSON, default={})
     created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    # Optional client-supplied idempotency key; the unique index backs up in-memory dedup
+    client_event_id = Column(String, unique=True, index=True, nullable=True)
+    # Id of the inserting transaction, which orders the change feed (see app/changes.py). On
+    # Postgres migration 0012 defaults it to pg_current_xact_id(); SQLite commits in id order
+    txid = Column(BigInteger, nullable=False, server_default="0")
+
+class SketchBucket(Base):
+    """Serialized sketch for one (dimension, time bucket) as built by one process.
+
+    Rows written by different processes for the same bucket are merged at query time.
+    `bucket_start` is naive UTC.
+    """
+    __tablename__ = "sketch_buckets"
+    __table_args__ = (
+        UniqueConstraint("dimension", "bucket_start", "node_id", name="uq_sketch_buckets_node"),
+        Index("ix_sketch_buckets_dimension_bucket", "dimension", "bucket_start"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    dimension = Column(String, nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    node_id = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class MetricBucket(Base):
+    """Serialized numeric sketch of one metadata field per (event type, time bucket), per process.
+
+    Rows written by different processes for the same bucket are merged at query time
+    (see app/metrics.py). `bucket_start` is naive UTC.
+    """
+    __tablename__ = "metric_buckets"
+    __table_args__ = (
+        UniqueConstraint("event_type_id", "field", "bucket_start", "node_id", name="uq_metric_buckets_node"),
+        Index("ix_metric_buckets_field_bucket", "field", "bucket_start"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    event_type_id = Column(EventTypeCode, ForeignKey("event_types.id"), nullable=False)
+    field = Column(String, nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    node_id = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class EventSchema(Base):
+    """JSON Schema for the metadata of one event type (see app/event_schemas.py).
+
+    `version` increases across the whole table, so workers detect any change from
+    (row count, max version); it is unique so concurrent saves cannot share one.
+    """
+    __tablename__ = "event_schemas"
+    __table_args__ = (
+        UniqueConstraint("version", name="uq_event_schemas_version"),
+    )
+
+    event_type_id = Column(EventTypeCode, ForeignKey("event_types.id"), primary_key=True)
+    definition = Column(JSON, nullable=False)
+    version = Column(Integer, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class ArchiveFile(Base):
+    """Manifest entry for a Parquet file of archived events (see app/archive.py).
+
+    `path` is relative to ARCHIVE_DIR; timestamps are naive UTC.
+    """
+    __tablename__ = "archive_files"
+    __table_args__ = (
+        Index("ix_archive_files_range", "min_created_at", "max_created_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    path = Column(String, unique=True, nullable=False)
+    min_created_at = Column(DateTime, nullable=False)
+    max_created_at = Column(DateTime, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    size_bytes = Column(Integer, nullable=False)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ArchiveDailyCount(Base):
+    """Archived events per UTC day and event type (see app/archive.py).
+
+    Written in the archiving transaction, so all-time totals add the cold tier
+    without reading Parquet files.
+    """
+    __tablename__ = "archive_daily_counts"
+
+    day = Column(Date, primary_key=True)
+    event_type_id = Column(EventTypeCode, ForeignKey("event_types.id"), primary_key=True)
+    count = Column(Integer, nullable=False)
+
+class UserActivity(Base):
+    """Per-user activity profile, maintained incrementally on ingest (see app/profiles.py).
+
+    Timestamps are naive UTC.
+    """
+    __tablename__ = "user_activity"
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    first_seen = Column(DateTime, nullable=False)
+    last_seen = Column(DateTime, index=True, nullable=False)
+    total_events = Column(Integer, nullable=False)
+
+class UserActivityTypeCount(Base):
+    """Events per user and event type"""
+    __tablename__ = "user_activity_type_counts"
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    event_type_id = Column(EventTypeCode, ForeignKey("event_types.id"), primary_key=True, autoincrement=False)
+    count = Column(Integer, nullable=False)
+
+class UserActivityDay(Base):
+    """Events per user and UTC day, kept for the rolling 7/30-day counts"""
+    __tablename__ = "user_activity_days"
+    __table_args__ = (
+        Index("ix_user_activity_days_day", "day"),
+    )
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    day = Column(Date, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+class UserSession(Base):
+    """A closed gap-based session of one user's events (see app/sessions.py).
+
+    Timestamps are naive UTC.
+    """
+    __tablename__ = "user_sessions"
+    __table_args__ = (
+        Index("ix_user_sessions_user_ended", "user_id", "ended_at"),
+        # Covers the summed columns, so session stats over a window are an index-only scan
+        Index("ix_user_sessions_started_at", "started_at",
+              postgresql_include=["event_count", "duration_seconds"]),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    ended_at = Column(DateTime, nullable=False)
+    duration_seconds = Column(Float, nullable=False)
+    event_count = Column(Integer, nullable=False)
+
+class RebalanceMove(Base):
+    """A source event copied to this shard by the rebalancer but maybe not yet deleted there.
+
+    Written in the transaction that copies the event, so a re-run after an
+    interruption skips it instead of copying it twice (see app/sharding.py).
+    """
+    __tablename__ = "rebalance_moves"
+
+    source = Column(String, primary_key=True)
+    source_event_id = Column(Integer, primary_key=True, autoincrement=False)
+
+class RebalanceProfileMove(Base):
+    """A source user whose profile and sessions the rebalancer copied to this shard, like RebalanceMove"""
+    __tablename__ = "rebalance_profile_moves"
+
+    source = Column(String, primary_key=True)
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
@@ -0,0 +1,146 @@
+"""Incrementally maintained per-user activity profiles.
+
+Each ingest transaction folds its new events into `user_activity` (first/last
+seen, total), `user_activity_type_counts` and `user_activity_days` with one
+batched upsert per table, so reading a profile never scans the user's events.
+Rolling 7/30-day counts are summed from the per-day rows; days older than the
+longest window are pruned periodically.
+"""
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .database import dialect_insert
+from .event_types import event_types
+
+# Per-day rows are kept for the longest rolling window
+PROFILE_DAYS_KEPT = 30
+PROFILE_PRUNE_SECONDS = float(os.getenv("PROFILE_PRUNE_SECONDS", "3600"))
+# Rows per upsert statement: at 4 columns, 20,000 parameters (SQLite allows 32,766, asyncpg 32,767)
+UPSERT_CHUNK_ROWS = 5000
+
+_last_prune = 0.0
+
+def _upsert(db: Session, model, rows: List[dict], keys: List[str], set_):
+    """INSERT ... ON CONFLICT (keys) DO UPDATE, with `set_(excluded)` giving the new values.
+
+    Sent in statements of UPSERT_CHUNK_ROWS rows to stay under the drivers' bound parameter limits.
+    """
+    for offset in range(0, len(rows), UPSERT_CHUNK_ROWS):
+        stmt = dialect_insert(db, model).values(rows[offset:offset + UPSERT_CHUNK_ROWS])
+        db.execute(stmt.on_conflict_do_update(index_elements=keys, set_=set_(stmt.excluded)))
+
+def merge(db: Session, activity: List[dict], type_counts: List[dict], days: List[dict]):
+    """Upsert profile rows, combining them with existing ones (min/max seen, summed counts).
+
+    Rows are sorted by key so concurrent transactions lock profile rows in the same order.
+    """
+    _upsert(db, models.UserActivity, sorted(
+        activity, key=lambda row: row["user_id"]
+    ), ["user_id"], lambda excluded: {
+        "first_seen": case(
+            (excluded.first_seen < models.UserActivity.first_seen, excluded.first_seen),
+            else_=models.UserActivity.first_seen
+        ),
+        "last_seen": case(
+            (excluded.last_seen > models.UserActivity.last_seen, excluded.last_seen),
+            else_=models.UserActivity.last_seen
+        ),
+        "total_events": models.UserActivity.total_events + excluded.total_events,
+    })
+    _upsert(db, models.UserActivityTypeCount, sorted(
+        type_counts, key=lambda row: (row["user_id"], row["event_type_id"])
+    ), ["user_id", "event_type_id"], lambda excluded: {
+        "count": models.UserActivityTypeCount.count + excluded.count
+    })
+    _upsert(db, models.UserActivityDay, sorted(
+        days, key=lambda row: (row["user_id"], row["day"])
+    ), ["user_id", "day"], lambda excluded: {
+        "count": models.UserActivityDay.count + excluded.count
+    })
+
+def record_events(db: Session, rows: List[models.Event], seen_at: datetime):
+    """Fold newly stored events into their users' profiles (inside the ingest transaction)"""
+    totals = Counter(row.user_id for row in rows)
+    type_counts = Counter((row.user_id, row.event_type_id) for row in rows)
+    day = seen_at.date()
+    merge(db, [
+        {"user_id": user_id, "first_seen": seen_at, "last_seen": seen_at, "total_events": count}
+        for user_id, count in totals.items()
+    ], [
+        {"user_id": user_id, "event_type_id": code, "count": count}
+        for (user_id, code), count in type_counts.items()
+    ], [
+        {"user_id": user_id, "day": day, "count": count}
+        for user_id, count in totals.items()
+    ])
+
+def prune_due() -> bool:
+    """True at most once per PROFILE_PRUNE_SECONDS"""
+    global _last_prune
+    if time.monotonic() - _last_prune < PROFILE_PRUNE_SECONDS:
+        return False
+    _last_prune = time.monotonic()
+    return True
+
+def prune(db: Session):
+    """Drop per-day rows that have left every rolling window"""
+    cutoff = datetime.utcnow().date() - timedelta(days=PROFILE_DAYS_KEPT)
+    db.query(models.UserActivityDay).filter(models.UserActivityDay.day < cutoff).delete(synchronize_session=False)
+    db.commit()
+
+def known_users(db: Session) -> int:
+    """Users with any event, archived or not (one profile row each)"""
+    return db.query(func.count(models.UserActivity.user_id)).scalar()
+
+def active_users_since(db: Session, since: datetime) -> int:
+    """Users with any event since `since` (an index range scan on last_seen)"""
+    return db.query(func.count(models.UserActivity.user_id)).filter(
+        models.UserActivity.last_seen >= since
+    ).scalar()
+
+def load_profiles(db: Session, user_ids: List[int]) -> Dict[int, schemas.UserProfile]:
+    """Profiles for the given users that have any activity, keyed by user id"""
+    activity = db.query(models.UserActivity).filter(models.UserActivity.user_id.in_(user_ids)).all()
+    if not activity:
+        return {}
+
+    type_counts: Dict[int, Dict[str, int]] = {}
+    for user_id, code, count in db.query(
+        models.UserActivityTypeCount.user_id,
+        models.UserActivityTypeCount.event_type_id,
+        models.UserActivityTypeCount.count
+    ).filter(models.UserActivityTypeCount.user_id.in_(user_ids)):
+        type_counts.setdefault(user_id, {})[event_types.decode(db, code)] = count
+
+    # Rolling windows include today, so the 7-day window covers days after today - 7
+    today = datetime.utcnow().date()
+    events_7d, events_30d = Counter(), Counter()
+    for user_id, day, count in db.query(
+        models.UserActivityDay.user_id, models.UserActivityDay.day, models.UserActivityDay.count
+    ).filter(
+        models.UserActivityDay.user_id.in_(user_ids),
+        models.UserActivityDay.day > today - timedelta(days=30)
+    ):
+        events_30d[user_id] += count
+        if day > today - timedelta(days=7):
+            events_7d[user_id] += count
+
+    return {
+        row.user_id: schemas.UserProfile(
+            user_id=row.user_id,
+            first_seen=row.first_seen,
+            last_seen=row.last_seen,
+            total_events=row.total_events,
+            event_type_counts=type_counts.get(row.user_id, {}),
+            events_7d=events_7d[row.user_id],
+            events_30d=events_30d[row.user_id]
+        )
+        for row in activity
+    }
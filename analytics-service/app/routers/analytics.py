@@ -1,53 +1,434 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from sqlalchemy import func, distinct
-from typing import List, Optional
+from sqlalchemy import distinct, func, select
+from typing import Any, Dict, List, Optional, Tuple
+from collections import Counter
 from datetime import datetime, timedelta
+import heapq
 import httpx
+import logging
 import os
+import time
 
-from .. import models, schemas
-from ..database import get_db
+from service_common.startup import register_warmer
+
+from .. import (
+    aggregation, archive, changes, encoding, event_schemas, heavy_hitters, metrics, models, profiles, sampling,
+    schemas, sessions
+)
+from ..dedup import DEDUP_OUTCOMES, deduplicator
+from ..event_types import event_types
+from ..sharding import Shards, get_shards
+from ..timebuckets import as_utc_naive
 
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 
 USER_SERVICE_URL = os.getenv("USER_SERVICE_URL", "http://localhost:8000")
 
+# Client event ids from this far back are preloaded into the dedup cache on startup
+DEDUP_WARM_HOURS = float(os.getenv("DEDUP_WARM_HOURS", "1"))
+
+# Top-N windows up to this size are answered exactly from the events table
+TOPN_EXACT_MAX_HOURS = float(os.getenv("TOPN_EXACT_MAX_HOURS", "6"))
+
+# Columns selected for event listings (plain rows, no ORM objects)
+EVENT_COLUMNS = (
+    models.Event.id,
+    models.Event.event_type_id,
+    models.Event.user_id,
+    models.Event.event_metadata,
+    models.Event.client_event_id,
+    models.Event.created_at,
+)
+
+@register_warmer
+def warm_analytics_queries(db: Session):
+    """Run the hot aggregate query shapes over an empty window.
+
+    This compiles and caches the statements and pulls the index pages in, without
+    scanning the table.
+    """
+    window_start = datetime.utcnow() + timedelta(days=1)
+    recent = db.query(models.Event).filter(models.Event.created_at >= window_start)
+    recent.with_entities(func.count(distinct(models.Event.user_id))).scalar()
+    profiles.active_users_since(db, window_start)
+    recent.with_entities(
+        models.Event.event_type_id,
+        func.count(models.Event.id).label('count')
+    ).group_by(models.Event.event_type_id).all()
+    db.query(models.Event).filter(
+        models.Event.user_id == -1
+    ).order_by(models.Event.created_at.desc()).limit(1).all()
+
+def _known_event_ids(db: Session, keys: List[str]) -> Dict[str, int]:
+    """Map already-ingested client event ids to their stored event ids.
+
+    The LRU and Bloom filter answer most keys in memory; only Bloom positives that
+    are not cached are looked up, in a single query.
+    """
+    known, to_check = {}, []
+    for key in keys:
+        event_id = deduplicator.cached(key)
+        if event_id is not None:
+            known[key] = event_id
+            DEDUP_OUTCOMES.labels(outcome="duplicate_cached").inc()
+        elif deduplicator.might_contain(key):
+            to_check.append(key)
+        else:
+            DEDUP_OUTCOMES.labels(outcome="new_unchecked").inc()
+
+    if to_check:
+        found = dict(db.query(models.Event.client_event_id, models.Event.id).filter(
+            models.Event.client_event_id.in_(to_check)
+        ).all())
+        for key in to_check:
+            outcome = "duplicate_db" if key in found else "new_checked"
+            DEDUP_OUTCOMES.labels(outcome=outcome).inc()
+        known.update(found)
+    return known
+
+def _new_event_rows(
+    events: List[schemas.EventCreate], known: Dict[str, int], codes: Dict[str, int], now: datetime
+) -> List[models.Event]:
+    """Rows for events whose client event id is unknown (and first in the batch)"""
+    rows, seen = [], set()
+    for event in events:
+        if event.event_id:
+            if event.event_id in known or event.event_id in seen:
+                continue
+            seen.add(event.event_id)
+        rows.append(models.Event(
+            event_type_id=codes[event.event_type],
+            user_id=event.user_id,
+            event_metadata=event.event_metadata,
+            client_event_id=event.event_id,
+            created_at=as_utc_naive(event.created_at) if event.created_at else now
+        ))
+    return rows
+
+def _ingest_shard(db: Session, events: List[schemas.EventCreate], codes: Dict[str, int]):
+    """Store one shard's events, skipping any whose client event id was already ingested.
+
+    Returns (stored event id per input event, (event_type_id, user_id, metadata, created_at) of each
+    new row).
+    """
+    now = datetime.utcnow()
+    keys = list(dict.fromkeys(event.event_id for event in events if event.event_id))
+    known = _known_event_ids(db, keys)
+
+    rows = _new_event_rows(events, known, codes, now)
+    try:
+        db.add_all(rows)
+        db.flush()
+    except IntegrityError:
+        # Another worker stored some of these keys first: resolve them and retry once
+        db.rollback()
+        found = dict(db.query(models.Event.client_event_id, models.Event.id).filter(
+            models.Event.client_event_id.in_(keys)
+        ).all())
+        DEDUP_OUTCOMES.labels(outcome="duplicate_constraint").inc(len(found.keys() - known.keys()))
+        known.update(found)
+        rows = _new_event_rows(events, known, codes, now)
+        db.add_all(rows)
+        db.flush()
+
+    known.update({row.client_event_id: row.id for row in rows if row.client_event_id})
+    unkeyed = iter([row.id for row in rows if row.client_event_id is None])
+    stored_ids = [known[event.event_id] if event.event_id else next(unkeyed) for event in events]
+    created = [(row.event_type_id, row.user_id, row.event_metadata, row.created_at) for row in rows]
+    if rows:
+        profiles.record_events(db, rows, now)
+    db.commit()
+
+    for key, event_id in known.items():
+        deduplicator.remember(key, event_id)
+    return stored_ids, created
+
+def _ingest_events(shards: Shards, events: List[schemas.EventCreate]):
+    """Store events on the shards owning their users; each shard commits separately.
+
+    Returns (stored event id per input event, number of new events).
+    """
+    codes = event_types.encode(shards.primary, {event.event_type for event in events})
+    shards.replicate_event_types(codes)
+
+    positions: Dict[int, List[int]] = {}
+    for position, event in enumerate(events):
+        positions.setdefault(shards.index_for_user(event.user_id), []).append(position)
+
+    stored_ids: List[int] = [0] * len(events)
+    created = []
+    for index, shard_positions in positions.items():
+        ids, shard_created = _ingest_shard(shards.session(index), [events[p] for p in shard_positions], codes)
+        for position, event_id in zip(shard_positions, ids):
+            stored_ids[position] = event_id
+        created.extend(shard_created)
+
+    names = {code: name for name, code in codes.items()}
+    _record_sketches(shards.primary, [(names[code], user_id) for code, user_id, _, _ in created])
+    _record_metrics(shards.primary, [(code, metadata) for code, _, metadata, _ in created])
+    _record_sessions(shards, [(user_id, created_at) for _, user_id, _, created_at in created])
+    if created:
+        changes.notifier.notify()
+    if profiles.prune_due():
+        for db in shards.sessions():
+            profiles.prune(db)
+    return stored_ids, len(created)
+
+def _record_sketches(db: Session, created):
+    """Count newly stored (event_type, user_id) pairs in the heavy-hitter sketches"""
+    now = datetime.utcnow()
+    for event_type, user_id in created:
+        heavy_hitters.store.record(event_type, user_id, now)
+    try:
+        heavy_hitters.store.flush_if_due(db)
+    except Exception as e:
+        logging.warning(f"Failed to flush heavy-hitter sketches: {e}")
+
+def _record_metrics(db: Session, created):
+    """Add numeric metadata of newly stored (event_type_id, metadata) pairs to the bucket sketches"""
+    metrics.store.record(created, datetime.utcnow())
+    try:
+        metrics.store.flush_if_due(db)
+    except Exception as e:
+        logging.warning(f"Failed to flush metric sketches: {e}")
+
+def _record_sessions(shards: Shards, events: List[Tuple[int, datetime]]):
+    """Add newly stored (user_id, created_at) events to their users' open sessions"""
+    sessions.sessionizer.record(events)
+    try:
+        sessions.sessionizer.flush_if_due(shards)
+    except Exception as e:
+        logging.warning(f"Failed to flush sessions: {e}")
+
+def _decode_counts(db: Session, per_shard) -> Dict[str, int]:
+    """Sum (event_type_id, count) rows from each shard into counts by event type name"""
+    totals = Counter()
+    for rows in per_shard:
+        totals.update(dict(rows))
+    return {event_types.decode(db, code): count for code, count in totals.items()}
+
+def _estimate(sampled: int, sample: float, exact: int = 0):
+    """(scaled count, 95% interval) of a count read from a `sample` fraction of events"""
+    value, low, high = sampling.estimate(sampled, sample, exact)
+    return value, schemas.CountInterval(low=low, high=high)
+
+def _estimated_counts(sampled: Dict[str, int], sample: float, exact: Optional[Dict[str, int]] = None):
+    """Scaled counts by event type and their intervals; `exact` counts (the cold tier) are added as is"""
+    exact = exact or {}
+    counts, intervals = {}, {}
+    for event_type in set(sampled) | set(exact):
+        counts[event_type], intervals[event_type] = _estimate(
+            sampled.get(event_type, 0), sample, exact.get(event_type, 0)
+        )
+    return counts, intervals
+
+def _event_responses(db: Session, rows) -> List[schemas.EventResponse]:
+    """Decode event type codes for the API"""
+    return [
+        schemas.EventResponse(
+            id=row.id,
+            event_type=event_types.decode(db, row.event_type_id),
+            user_id=row.user_id,
+            event_metadata=row.event_metadata,
+            event_id=row.client_event_id,
+            created_at=row.created_at
+        )
+        for row in rows
+    ]
+
+def _events_response(request: Request, db: Session, rows):
+    """Event listing in the negotiated format: JSON via the response model, or Arrow/MessagePack"""
+    media_type = encoding.negotiate(request)
+    if media_type == encoding.JSON:
+        return _event_responses(db, rows)
+    return encoding.encode_events(media_type, encoding.event_columns(rows, lambda code: event_types.decode(db, code)))
+
+@register_warmer
+def warm_deduplicator(db: Session):
+    """Load recently used client event ids so retries after a restart skip the DB"""
+    since = datetime.utcnow() - timedelta(hours=DEDUP_WARM_HOURS)
+    recent = db.query(models.Event.client_event_id, models.Event.id).filter(
+        models.Event.created_at >= since,
+        models.Event.client_event_id.isnot(None)
+    ).order_by(models.Event.id).all()
+    for key, event_id in recent:
+        deduplicator.remember(key, event_id)
+
+def _check_metadata(db: Session, events: List[schemas.EventCreate]):
+    """Reject the request (422) if any event's metadata fails its type's registered schema"""
+    rejected = event_schemas.registry.validate(db, events)
+    if rejected:
+        raise HTTPException(status_code=422, detail=rejected)
+
 @router.post("/events", response_model=schemas.EventResponse, status_code=201)
-async def create_event(event: schemas.EventCreate, db: Session = Depends(get_db)):
-    """Record a new user activity event"""
-    db_event = models.Event(
-        event_type=event.event_type,
-        user_id=event.user_id,
-        event_metadata=event.event_metadata
+async def create_event(event: schemas.EventCreate, response: Response, shards: Shards = Depends(get_shards)):
+    """Record a new user activity event.
+
+    Resending an event with the same `event_id` returns the stored event with 200.
+    """
+    _check_metadata(shards.primary, [event])
+    stored_ids, created = _ingest_events(shards, [event])
+    db = shards.for_user(event.user_id)
+    stored = db.get(models.Event, stored_ids[0])
+    if stored is None or stored.client_event_id != event.event_id:
+        # The cached id outlived its row: archived, or moved by a rebalance (ids are per shard)
+        stored = db.query(models.Event).filter(models.Event.client_event_id == event.event_id).first()
+        if stored is None:
+            # Gone from the events table, so the key is free again as if it was never cached
+            deduplicator.forget(event.event_id)
+            stored_ids, created = _ingest_events(shards, [event])
+            stored = db.get(models.Event, stored_ids[0])
+        else:
+            deduplicator.remember(event.event_id, stored.id)
+    if not created:
+        response.status_code = 200
+    return _event_responses(shards.primary, [stored])[0]
+
+@router.post("/events/batch", response_model=schemas.EventBatchResponse, status_code=201)
+async def create_events_batch(batch: schemas.EventBatch, shards: Shards = Depends(get_shards)):
+    """Record many events in one transaction per shard, skipping already-ingested event ids.
+
+    The whole batch is rejected if any event fails its metadata schema.
+    """
+    _check_metadata(shards.primary, batch.events)
+    stored_ids, created = _ingest_events(shards, batch.events)
+    return schemas.EventBatchResponse(
+        created=created,
+        duplicates=len(batch.events) - created,
+        ids=stored_ids
+    )
+
+def _event_schema_response(event_type: str, row: models.EventSchema) -> schemas.EventSchemaResponse:
+    return schemas.EventSchemaResponse(
+        event_type=event_type, metadata_schema=row.definition, version=row.version, updated_at=row.updated_at
     )
-    db.add(db_event)
-    db.commit()
-    db.refresh(db_event)
-    return db_event
+
+@router.get("/event-schemas", response_model=List[schemas.EventSchemaResponse])
+async def list_event_schemas(shards: Shards = Depends(get_shards)):
+    """Registered metadata schemas by event type"""
+    rows = shards.primary.query(models.EventType.name, models.EventSchema).join(
+        models.EventType, models.EventType.id == models.EventSchema.event_type_id
+    ).order_by(models.EventType.name).all()
+    return [_event_schema_response(name, row) for name, row in rows]
+
+@router.get("/event-schemas/{event_type}", response_model=schemas.EventSchemaResponse)
+async def get_event_schema(event_type: str, shards: Shards = Depends(get_shards)):
+    code = event_types.lookup(shards.primary, event_type)
+    row = shards.primary.get(models.EventSchema, code) if code is not None else None
+    if row is None:
+        raise HTTPException(status_code=404, detail="No schema registered for this event type")
+    return _event_schema_response(event_type, row)
+
+@router.put("/event-schemas/{event_type}", response_model=schemas.EventSchemaResponse)
+async def put_event_schema(event_type: str, definition: Dict[str, Any], shards: Shards = Depends(get_shards)):
+    """Register or replace the JSON Schema that this event type's metadata must match.
+
+    Other workers pick the change up within SCHEMA_RELOAD_SECONDS.
+    """
+    try:
+        row = event_schemas.save(shards.primary, event_type, definition)
+    except event_schemas.SchemaError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except event_schemas.SchemaConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _event_schema_response(event_type, row)
+
+@router.delete("/event-schemas/{event_type}", status_code=204)
+async def delete_event_schema(event_type: str, shards: Shards = Depends(get_shards)):
+    if not event_schemas.delete(shards.primary, event_type):
+        raise HTTPException(status_code=404, detail="No schema registered for this event type")
+    return Response(status_code=204)
 
 @router.get("/events", response_model=List[schemas.EventResponse])
 async def get_events(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
     event_type: Optional[str] = None,
     user_id: Optional[int] = None,
-    db: Session = Depends(get_db)
+    shards: Shards = Depends(get_shards)
 ):
-    """Get all events with optional filtering"""
-    query = db.query(models.Event)
+    """Get all events with optional filtering, newest first.
 
+    Also available as Arrow or MessagePack columns via `Accept`.
+    """
+    code = None
     if event_type:
-        query = query.filter(models.Event.event_type == event_type)
-    if user_id:
-        query = query.filter(models.Event.user_id == user_id)
+        code = event_types.lookup(shards.primary, event_type)
+        if code is None:
+            return []
+
+    def newest(db: Session, offset: int, count: int):
+        query = db.query(*EVENT_COLUMNS)
+        if code is not None:
+            query = query.filter(models.Event.event_type_id == code)
+        if user_id:
+            query = query.filter(models.Event.user_id == user_id)
+        return query.order_by(models.Event.created_at.desc()).offset(offset).limit(count).all()
+
+    if user_id or shards.count == 1:
+        db = shards.for_user(user_id) if user_id else shards.session(0)
+        events = newest(db, skip, limit)
+    else:
+        # Each shard's first skip + limit rows cover the merged page
+        per_shard = await shards.gather(lambda db: newest(db, 0, skip + limit))
+        events = sorted(
+            (event for rows in per_shard for event in rows),
+            key=lambda event: as_utc_naive(event.created_at), reverse=True
+        )[skip:skip + limit]
+    return _events_response(request, shards.primary, events)
+
+@router.get("/events/changes", response_model=schemas.EventChanges)
+async def get_event_changes(
+    since: str = Query("0", pattern=r"^(0|\d+:\d+(\.\d+:\d+)*)$"),
+    limit: int = Query(1000, ge=1, le=10000),
+    wait: float = Query(0, ge=0, le=changes.CHANGES_MAX_WAIT_SECONDS),
+    shards: Shards = Depends(get_shards)
+):
+    """Get events stored after the `since` cursor, oldest first, and the cursor to continue from.
+
+    With `wait`, an empty read waits up to that many seconds for new events.
+    """
+    try:
+        positions = changes.parse_cursor(since, shards.count)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
 
-    events = query.order_by(models.Event.created_at.desc()).offset(skip).limit(limit).all()
-    return events
+    deadline = time.monotonic() + wait
+    while True:
+        woken = changes.notifier.subscribe()
+        reads = [changes.read(shards.session(index), after, limit) for index, after in enumerate(positions)]
+        events, last_positions = changes.merge([rows for rows, _ in reads], limit)
+        remaining = deadline - time.monotonic()
+        if events or remaining <= 0:
+            break
+        # End the read transactions: the connections go back to the pool while waiting,
+        # and the next read sees events committed meanwhile
+        for db in shards.sessions():
+            db.rollback()
+        await changes.notifier.wait(woken, min(remaining, changes.CHANGES_POLL_SECONDS))
+
+    return schemas.EventChanges(
+        events=_event_responses(shards.primary, events),
+        cursor=changes.format_cursor([
+            after if last is None else last for last, after in zip(last_positions, positions)
+        ]),
+        has_more=any(more for _, more in reads) or sum(len(rows) for rows, _ in reads) > len(events)
+    )
 
 @router.get("/summary", response_model=schemas.AnalyticsSummary)
-async def get_analytics_summary(db: Session = Depends(get_db)):
-    """Get overall analytics summary"""
+async def get_analytics_summary(
+    sample: Optional[float] = Query(None, gt=0, le=1),
+    shards: Shards = Depends(get_shards)
+):
+    """Get overall analytics summary (summed over all shards, hot and archived events).
+
+    With `sample`, hot-tier event counts are estimated from that fraction of events;
+    archived counts are exact.
+    """
     # Get total users from user service
     total_users = 0
     try:
@@ -57,99 +438,457 @@ async def get_analytics_summary(db: Session = Depends(get_db)):
                 users = response.json()
                 total_users = len(users)
     except Exception as e:
-        print(f"Failed to fetch users from user service: {e}")
-        # Fallback: count distinct user_ids from events
-        total_users = db.query(func.count(distinct(models.Event.user_id))).scalar()
+        logging.warning(f"Failed to fetch users from user service: {e}")
+        # Fallback: count profiles rather than distinct user_ids over every event (a user never spans shards)
+        total_users = sum(await shards.gather(lambda db: profiles.known_users(db) or 0))
 
-    # Get active users in last 24 hours
     last_24h = datetime.utcnow() - timedelta(hours=24)
-    active_users_24h = db.query(func.count(distinct(models.Event.user_id))).filter(
-        models.Event.created_at >= last_24h
-    ).scalar()
 
-    # Get total events
-    total_events = db.query(func.count(models.Event.id)).scalar()
+    def shard_summary(db: Session):
+        # Active users in last 24 hours (from the profiles' last_seen), type counts
+        events, criteria = sampling.sampled_events(db, sample)
+        return (
+            profiles.active_users_since(db, last_24h) or 0,
+            db.query(
+                events.event_type_id,
+                func.count(events.id).label('count')
+            ).filter(*criteria).group_by(events.event_type_id).all(),
+            archive.archived_counts(db)
+        )
 
-    # Get event type counts
-    event_counts = db.query(
-        models.Event.event_type,
-        func.count(models.Event.id).label('count')
-    ).group_by(models.Event.event_type).all()
-
-    event_type_counts = {event_type: count for event_type, count in event_counts}
+    results = await shards.gather(shard_summary)
+    active_users_24h = sum(active for active, _, _ in results)
+    hot_counts = _decode_counts(shards.primary, [counts for _, counts, _ in results])
+    cold_counts = _decode_counts(shards.primary, [counts for _, _, counts in results])
+    hot_events, cold_events = sum(hot_counts.values()), sum(cold_counts.values())
 
-    return schemas.AnalyticsSummary(
+    summary = schemas.AnalyticsSummary(
         total_users=total_users or 0,
         active_users_24h=active_users_24h or 0,
-        total_events=total_events or 0,
-        event_type_counts=event_type_counts
+        total_events=hot_events + cold_events,
+        event_type_counts=dict(Counter(hot_counts) + Counter(cold_counts))
     )
+    if sample:
+        summary.approximate, summary.sample_rate = True, sample
+        summary.total_events, summary.total_events_interval = _estimate(hot_events, sample, cold_events)
+        summary.event_type_counts, summary.event_type_intervals = _estimated_counts(hot_counts, sample, cold_counts)
+    return summary
 
 @router.get("/events/by-type", response_model=List[schemas.EventTypeCount])
-async def get_events_by_type(db: Session = Depends(get_db)):
-    """Get event counts grouped by type"""
-    event_counts = db.query(
-        models.Event.event_type,
-        func.count(models.Event.id).label('count')
-    ).group_by(models.Event.event_type).order_by(func.count(models.Event.id).desc()).all()
+async def get_events_by_type(
+    sample: Optional[float] = Query(None, gt=0, le=1),
+    shards: Shards = Depends(get_shards)
+):
+    """Get event counts grouped by type, hot and archived.
 
+    With `sample`, hot-tier counts are estimated from that fraction of events;
+    archived counts are exact.
+    """
+    def shard_counts(db: Session):
+        events, criteria = sampling.sampled_events(db, sample)
+        return db.query(
+            events.event_type_id,
+            func.count(events.id).label('count')
+        ).filter(*criteria).group_by(events.event_type_id).all(), archive.archived_counts(db)
+
+    results = await shards.gather(shard_counts)
+    hot_counts = _decode_counts(shards.primary, [counts for counts, _ in results])
+    cold_counts = _decode_counts(shards.primary, [counts for _, counts in results])
+    event_counts = dict(Counter(hot_counts) + Counter(cold_counts))
+    intervals = {}
+    if sample:
+        event_counts, intervals = _estimated_counts(hot_counts, sample, cold_counts)
     return [
-        schemas.EventTypeCount(event_type=event_type, count=count)
-        for event_type, count in event_counts
+        schemas.EventTypeCount(
+            event_type=event_type, count=count, approximate=bool(sample), interval=intervals.get(event_type)
+        )
+        for event_type, count in sorted(event_counts.items(), key=lambda item: -item[1])
     ]
 
 @router.get("/events/date-range", response_model=schemas.DateRangeAnalytics)
 async def get_analytics_by_date_range(
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
-    db: Session = Depends(get_db)
+    sample: Optional[float] = Query(None, gt=0, le=1),
+    shards: Shards = Depends(get_shards)
 ):
-    """Get analytics for a specific date range"""
-    query = db.query(models.Event)
+    """Get analytics for a specific date range.
 
+    Archived events in the range are read from the Parquet cold tier and merged in.
+    With `sample`, hot-tier counts are estimated from that fraction of events (archived
+    counts stay exact) and unique users from that fraction of users in both tiers.
+    """
     # Default to last 7 days if no dates provided
     if not start_date and not end_date:
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(days=7)
 
-    if start_date:
-        query = query.filter(models.Event.created_at >= start_date)
-    if end_date:
-        query = query.filter(models.Event.created_at <= end_date)
+    def in_range(query, entity):
+        if start_date:
+            query = query.filter(entity.created_at >= start_date)
+        if end_date:
+            query = query.filter(entity.created_at <= end_date)
+        return query
 
-    # Total events in range
-    total_events = query.count()
+    def shard_range(db: Session):
+        events, criteria = sampling.sampled_events(db, sample)
+        query = in_range(db.query(events).filter(*criteria), events)
+        users = in_range(db.query(models.Event).filter(*sampling.sampled_users(sample)), models.Event)
 
-    # Unique users in range
-    unique_users = query.with_entities(func.count(distinct(models.Event.user_id))).scalar()
+        # Total events, unique users and type counts in range
+        total_events = query.count()
+        unique_users = users.with_entities(func.count(distinct(models.Event.user_id))).scalar() or 0
+        event_counts = query.with_entities(
+            events.event_type_id,
+            func.count(events.id).label('count')
+        ).group_by(events.event_type_id).all()
 
-    # Event breakdown by type
-    event_breakdown = {}
-    event_counts = query.with_entities(
-        models.Event.event_type,
-        func.count(models.Event.id).label('count')
-    ).group_by(models.Event.event_type).all()
+        cold = archive.range_stats(db, start_date, end_date)
+        cold_events, cold_breakdown = 0, {}
+        if cold:
+            cold_events, cold_breakdown, cold_users = cold
+            # Distinct users have to be combined as sets across the two tiers
+            hot_users = users.with_entities(distinct(models.Event.user_id)).all()
+            unique_users = len(sampling.sample_users(cold_users, sample).union(user_id for user_id, in hot_users))
+        return total_events, cold_events, unique_users, event_counts, cold_breakdown
+
+    results = await shards.gather(shard_range)
+    event_breakdown = _decode_counts(shards.primary, [counts for _, _, _, counts, _ in results])
+    cold_breakdown = Counter()
+    for *_, shard_cold_breakdown in results:
+        cold_breakdown.update(shard_cold_breakdown)
+    hot_events = sum(total for total, _, _, _, _ in results)
+    cold_events = sum(cold for _, cold, _, _, _ in results)
+    unique_users = sum(users for _, _, users, _, _ in results)
 
-    event_breakdown = {event_type: count for event_type, count in event_counts}
+    if not sample:
+        for event_type, count in cold_breakdown.items():
+            event_breakdown[event_type] = event_breakdown.get(event_type, 0) + count
+        return schemas.DateRangeAnalytics(
+            start_date=start_date,
+            end_date=end_date,
+            total_events=hot_events + cold_events,
+            unique_users=unique_users,
+            event_breakdown=event_breakdown
+        )
 
+    total_events, total_interval = _estimate(hot_events, sample, cold_events)
+    unique_users, users_interval = _estimate(unique_users, sample)
+    event_breakdown, breakdown_intervals = _estimated_counts(event_breakdown, sample, cold_breakdown)
     return schemas.DateRangeAnalytics(
         start_date=start_date,
         end_date=end_date,
         total_events=total_events,
-        unique_users=unique_users or 0,
-        event_breakdown=event_breakdown
+        unique_users=unique_users,
+        event_breakdown=event_breakdown,
+        approximate=True,
+        sample_rate=sample,
+        total_events_interval=total_interval,
+        unique_users_interval=users_interval,
+        event_breakdown_intervals=breakdown_intervals
+    )
+
+@router.get("/events/export")
+async def export_events(
+    request: Request,
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    shards: Shards = Depends(get_shards)
+):
+    """Stream events in a date range as NDJSON, oldest first, from both storage tiers.
+
+    Also available as a chunked Arrow stream or MessagePack maps via `Accept`.
+    """
+    def order(row):
+        return as_utc_naive(row.created_at), row.id
+
+    def hot_rows(db: Session):
+        statement = select(*EVENT_COLUMNS).order_by(models.Event.created_at, models.Event.id)
+        if start_date:
+            statement = statement.where(models.Event.created_at >= start_date)
+        if end_date:
+            statement = statement.where(models.Event.created_at <= end_date)
+        for chunk in db.execute(statement, execution_options={"yield_per": 1000}).partitions():
+            yield from _event_responses(shards.primary, chunk)
+
+    def shard_rows(db: Session):
+        # Ids follow insertion, not created_at (rebalanced and backfilled rows get new ids),
+        # so both tiers are read in (created_at, id) order and merged
+        cold = (schemas.EventResponse(**row) for row in archive.iter_events(db, start_date, end_date))
+        yield from heapq.merge(cold, hot_rows(db), key=order)
+
+    def rows():
+        try:
+            yield from heapq.merge(*(shard_rows(db) for db in shards.sessions()), key=order)
+        finally:
+            shards.close()
+
+    media_type = encoding.negotiate(request)
+    if media_type == encoding.JSON:
+        lines = (row.model_dump_json() + "\n" for row in rows())
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+
+    def chunks():
+        batch = []
+        for row in rows():
+            batch.append(row)
+            if len(batch) == 1000:
+                yield encoding.response_columns(batch)
+                batch = []
+        if batch:
+            yield encoding.response_columns(batch)
+
+    return StreamingResponse(
+        encoding.encode_event_chunks(media_type, chunks()), media_type=media_type, headers={"Vary": "Accept"}
     )
 
 @router.get("/users/{user_id}/events", response_model=List[schemas.EventResponse])
 async def get_user_events(
+    request: Request,
     user_id: int,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    shards: Shards = Depends(get_shards)
 ):
-    """Get all events for a specific user"""
-    events = db.query(models.Event).filter(
+    """Get all events for a specific user (served by the user's shard)"""
+    events = shards.for_user(user_id).query(*EVENT_COLUMNS).filter(
         models.Event.user_id == user_id
     ).order_by(models.Event.created_at.desc()).offset(skip).limit(limit).all()
 
-    return events
+    return _events_response(request, shards.primary, events)
+
+@router.get("/users/{user_id}/profile", response_model=schemas.UserProfile)
+async def get_user_profile(user_id: int, shards: Shards = Depends(get_shards)):
+    """Get a user's activity profile"""
+    profile = profiles.load_profiles(shards.for_user(user_id), [user_id]).get(user_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="No activity recorded for this user")
+    return profile
+
+@router.post("/users/profiles", response_model=List[schemas.UserProfile])
+async def get_user_profiles(request: schemas.UserProfilesRequest, shards: Shards = Depends(get_shards)):
+    """Get activity profiles for many users; users without activity are omitted"""
+    by_shard: Dict[int, List[int]] = {}
+    for user_id in set(request.user_ids):
+        by_shard.setdefault(shards.index_for_user(user_id), []).append(user_id)
+    found = {}
+    for index, user_ids in by_shard.items():
+        found.update(profiles.load_profiles(shards.session(index), user_ids))
+    return [found[user_id] for user_id in dict.fromkeys(request.user_ids) if user_id in found]
+
+@router.get("/users/{user_id}/sessions", response_model=List[schemas.UserSessionResponse])
+async def get_user_sessions(
+    user_id: int,
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    shards: Shards = Depends(get_shards)
+):
+    """Get a user's sessions overlapping a window, newest first"""
+    return [
+        schemas.UserSessionResponse(
+            started_at=span.started_at,
+            ended_at=span.ended_at,
+            duration_seconds=span.duration_seconds,
+            event_count=span.event_count,
+            open=is_open
+        )
+        for span, is_open in sessions.user_sessions(shards.for_user(user_id), user_id, start_date, end_date, limit)
+    ]
+
+@router.get("/sessions/stats", response_model=schemas.SessionStats)
+async def get_session_stats(
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    shards: Shards = Depends(get_shards)
+):
+    """Get session count, duration and events per session for sessions started in a window.
+
+    Defaults to the last 7 days. Sessions this process holds in memory are included.
+    """
+    end_date = as_utc_naive(end_date) if end_date else datetime.utcnow()
+    start_date = as_utc_naive(start_date) if start_date else end_date - timedelta(days=7)
+
+    per_shard = await shards.gather(lambda db: sessions.range_stats(db, start_date, end_date))
+    held = [span for span in sessions.sessionizer.unwritten() if start_date <= span.started_at <= end_date]
+    count = sum(row[0] for row in per_shard) + len(held)
+    events = sum(row[1] for row in per_shard) + sum(span.event_count for span in held)
+    duration = sum(row[2] for row in per_shard) + sum(span.duration_seconds for span in held)
+    single = sum(row[3] for row in per_shard) + sum(span.event_count == 1 for span in held)
+
+    return schemas.SessionStats(
+        start_date=start_date,
+        end_date=end_date,
+        sessions=count,
+        open_sessions=len(held),
+        total_events=events,
+        average_duration_seconds=duration / count if count else 0.0,
+        average_events_per_session=events / count if count else 0.0,
+        bounce_rate=single / count if count else 0.0
+    )
+
+def _top_n_window(start_date: Optional[datetime], end_date: Optional[datetime]):
+    """Default top-N windows to the last 24 hours"""
+    end_date = as_utc_naive(end_date) if end_date else datetime.utcnow()
+    start_date = as_utc_naive(start_date) if start_date else end_date - timedelta(hours=24)
+    return start_date, end_date
+
+def _use_sketches(mode: str, start_date: datetime, end_date: datetime) -> bool:
+    if mode == "auto":
+        return end_date - start_date > timedelta(hours=TOPN_EXACT_MAX_HOURS)
+    return mode == "sketch"
+
+@router.get("/top-users", response_model=schemas.TopUsersResponse)
+async def get_top_users(
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    limit: int = Query(10, ge=1, le=100),
+    mode: str = Query("auto", pattern="^(auto|exact|sketch)$"),
+    shards: Shards = Depends(get_shards)
+):
+    """Get the most active users in a window.
+
+    Large windows are answered from per-bucket sketches, rounded out to whole buckets;
+    `mode=exact` forces a GROUP BY over the events in the window.
+    """
+    start_date, end_date = _top_n_window(start_date, end_date)
+    approximate = _use_sketches(mode, start_date, end_date)
+
+    if approximate:
+        sketch = heavy_hitters.store.merged(shards.primary, heavy_hitters.USERS, start_date, end_date)
+        users = [
+            schemas.TopUser(user_id=int(key), count=count, max_error=max_error)
+            for key, count, max_error in sketch.top(limit)
+        ]
+    else:
+        # Users never span shards, so the global top N is among the shards' top N
+        per_shard = await shards.gather(lambda db: db.query(
+            models.Event.user_id,
+            func.count(models.Event.id).label('count')
+        ).filter(
+            models.Event.created_at >= start_date,
+            models.Event.created_at <= end_date
+        ).group_by(models.Event.user_id).order_by(
+            func.count(models.Event.id).desc(), models.Event.user_id
+        ).limit(limit).all())
+        user_counts = sorted(
+            (row for rows in per_shard for row in rows), key=lambda row: (-row[1], row[0])
+        )[:limit]
+        users = [schemas.TopUser(user_id=user_id, count=count) for user_id, count in user_counts]
+
+    return schemas.TopUsersResponse(
+        start_date=start_date,
+        end_date=end_date,
+        approximate=approximate,
+        users=users
+    )
+
+@router.get("/top-event-types", response_model=schemas.TopEventTypesResponse)
+async def get_top_event_types(
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    limit: int = Query(10, ge=1, le=100),
+    mode: str = Query("auto", pattern="^(auto|exact|sketch)$"),
+    shards: Shards = Depends(get_shards)
+):
+    """Get the most frequent event types in a window (same modes as /top-users)"""
+    start_date, end_date = _top_n_window(start_date, end_date)
+    approximate = _use_sketches(mode, start_date, end_date)
+
+    if approximate:
+        sketch = heavy_hitters.store.merged(shards.primary, heavy_hitters.EVENT_TYPES, start_date, end_date)
+        top_types = [
+            schemas.TopEventType(event_type=key, count=count, max_error=max_error)
+            for key, count, max_error in sketch.top(limit)
+        ]
+    else:
+        per_shard = await shards.gather(lambda db: db.query(
+            models.Event.event_type_id,
+            func.count(models.Event.id).label('count')
+        ).filter(
+            models.Event.created_at >= start_date,
+            models.Event.created_at <= end_date
+        ).group_by(models.Event.event_type_id).all())
+        event_counts = _decode_counts(shards.primary, per_shard)
+        top_types = [
+            schemas.TopEventType(event_type=event_type, count=count)
+            for event_type, count in sorted(event_counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        ]
+
+    return schemas.TopEventTypesResponse(
+        start_date=start_date,
+        end_date=end_date,
+        approximate=approximate,
+        event_types=top_types
+    )
+
+@router.get("/metrics", response_model=schemas.MetricAggregates)
+async def get_metric_aggregates(
+    field: str = Query(..., min_length=1, max_length=metrics.MAX_FIELD_LENGTH),
+    event_type: Optional[str] = Query(None),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    granularity: str = Query("bucket", pattern="^(bucket|day|total)$"),
+    shards: Shards = Depends(get_shards)
+):
+    """Aggregate a numeric metadata field per event type and time bucket (default: last 24 hours).
+
+    Count, sum, min, max and average are exact for the buckets overlapping the window
+    (rounded out to whole buckets); percentiles come from the merged per-bucket sketches.
+    `granularity=day` merges buckets per UTC day, `total` over the whole window.
+    """
+    start_date, end_date = _top_n_window(start_date, end_date)
+    code = None
+    if event_type is not None:
+        code = event_types.lookup(shards.primary, event_type)
+        if code is None:
+            return schemas.MetricAggregates(field=field, start_date=start_date, end_date=end_date, groups=[])
+
+    groups = {}
+    for (event_type_id, start_of_bucket), sketch in metrics.store.merged(
+        shards.primary, field, start_date, end_date, code
+    ).items():
+        if granularity == "day":
+            start_of_bucket = start_of_bucket.replace(hour=0, minute=0, second=0, microsecond=0)
+        elif granularity == "total":
+            start_of_bucket = None
+        key = (event_type_id, start_of_bucket)
+        if key in groups:
+            groups[key].merge(sketch)
+        else:
+            groups[key] = sketch
+
+    results = [
+        schemas.MetricAggregate(
+            event_type=event_types.decode(shards.primary, event_type_id),
+            bucket_start=start_of_bucket,
+            count=sketch.count,
+            sum=sketch.sum,
+            min=sketch.min,
+            max=sketch.max,
+            avg=sketch.sum / sketch.count,
+            p50=sketch.quantile(0.5),
+            p90=sketch.quantile(0.9),
+            p99=sketch.quantile(0.99)
+        )
+        for (event_type_id, start_of_bucket), sketch in groups.items()
+    ]
+    results.sort(key=lambda group: (group.event_type, group.bucket_start or start_date))
+    return schemas.MetricAggregates(field=field, start_date=start_date, end_date=end_date, groups=results)
+
+@router.post("/query", response_model=schemas.QueryResult)
+async def run_aggregation_query(spec: schemas.QuerySpec, shards: Shards = Depends(get_shards)):
+    """Aggregate events by a declarative spec of measures, dimensions and filters (see app/aggregation.py).
+
+    Windows reaching archived events are refused; use /events/date-range for those.
+    """
+    try:
+        prepared = aggregation.prepare(shards.primary, spec, shards.count)
+        if prepared.source == aggregation.EVENTS and any(await shards.gather(
+            lambda db: archive.files_for_range(db, prepared.start, prepared.end)
+        )):
+            raise aggregation.QueryError("the window reaches archived events; use /analytics/events/date-range")
+        per_shard = await shards.gather(lambda db: aggregation.execute(db, prepared))
+    except aggregation.QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return aggregation.merge(shards.primary, prepared, per_shard)
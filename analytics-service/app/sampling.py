@@ -0,0 +1,76 @@
+"""Deterministic sampling for approximate aggregates.
+
+With `sample=<rate>`, event counts are taken over a fixed sample of rows and
+scaled by 1/rate: Postgres reads a `TABLESAMPLE SYSTEM` page sample (REPEATABLE,
+so the same query sees the same rows); other backends keep rows whose multiplicative
+hash of `id` falls below rate * 2^32. Distinct users are counted over the users
+whose hashed `user_id` passes the same test, which scales without bias; an index
+on that hash and `created_at` lets them read only the sampled users' events. Intervals
+are 95% normal approximations for independent inclusion with probability `rate`;
+page sampling clusters rows, so on Postgres they are somewhat optimistic for
+values concentrated in few pages.
+"""
+import math
+import os
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import func, literal, literal_column, tablesample
+from sqlalchemy.orm import Session, aliased
+
+from . import models
+
+SAMPLE_SEED = int(os.getenv("SAMPLE_SEED", "42"))
+
+Z_95 = 1.96
+# Knuth's multiplicative hash constant; products are reduced mod 2^32
+HASH_MULTIPLIER = 2654435761
+HASH_RANGE = 2 ** 32
+
+def _threshold(rate: float) -> int:
+    return int(rate * HASH_RANGE)
+
+def multiplicative_hash(column):
+    """SQL hash of an integer column, constants inlined so it matches the ix_events_user_hash expression"""
+    return (column * literal_column(str(HASH_MULTIPLIER))) % literal_column(str(HASH_RANGE))
+
+def hash_sampled(column, rate: float):
+    """SQL criterion keeping a deterministic `rate` fraction of integer `column` values"""
+    return multiplicative_hash(column) < _threshold(rate)
+
+def keep_user(user_id: int, rate: float) -> bool:
+    """Python twin of `hash_sampled` for user ids read outside SQL (the cold tier)"""
+    return (user_id * HASH_MULTIPLIER) % HASH_RANGE < _threshold(rate)
+
+def sampled_events(db: Session, rate: Optional[float]):
+    """(Event entity, criteria) reading a deterministic `rate` sample of events, or all if None"""
+    if rate is None:
+        return models.Event, []
+    if db.get_bind().dialect.name == "postgresql":
+        sample = tablesample(models.Event.__table__, func.system(rate * 100), seed=literal(SAMPLE_SEED))
+        return aliased(models.Event, sample), []
+    return models.Event, [hash_sampled(models.Event.id, rate)]
+
+def sampled_users(rate: Optional[float]) -> list:
+    """Criteria restricting events to the sampled users"""
+    if rate is None:
+        return []
+    return [hash_sampled(models.Event.user_id, rate)]
+
+def estimate(sampled: int, rate: float, exact: int = 0) -> Tuple[int, int, int]:
+    """(estimate, low, high) of a count from `sampled` rows at `rate`, plus an `exact` part.
+
+    With nothing sampled, the high end is the 95% "rule of three" bound.
+    """
+    value = sampled / rate
+    if sampled == 0:
+        margin = 3 / rate
+    else:
+        margin = Z_95 * math.sqrt(sampled * (1 - rate)) / rate
+    return (
+        round(value) + exact,
+        max(math.floor(value - margin), sampled) + exact,
+        math.ceil(value + margin) + exact
+    )
+
+def sample_users(user_ids: Iterable[int], rate: Optional[float]) -> set:
+    return {user_id for user_id in user_ids if rate is None or keep_user(user_id, rate)}
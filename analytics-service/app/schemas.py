@@ -1,28 +1,76 @@
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
-from datetime import datetime
+from pydantic import AliasChoices, BaseModel, Field, field_validator
+from typing import Optional, Dict, Any, List
+from datetime import datetime, timedelta
+
+from .timebuckets import as_utc_naive
+
+# How far ahead of this server's clock a client's event time may be
+MAX_CLOCK_SKEW = timedelta(minutes=5)
 
 class EventCreate(BaseModel):
     event_type: str
     user_id: int
     event_metadata: Optional[Dict[str, Any]] = {}
+    # Client-generated idempotency key: events resent with the same id are stored once
+    event_id: Optional[str] = Field(None, min_length=1, max_length=128)
+    # When the event happened (naive values are UTC); defaults to when it is stored.
+    # Sessions are built from this time, so events delivered late still join their session
+    created_at: Optional[datetime] = None
+
+    @field_validator("created_at")
+    @classmethod
+    def not_in_future(cls, value: Optional[datetime]):
+        if value is not None and as_utc_naive(value) > datetime.utcnow() + MAX_CLOCK_SKEW:
+            raise ValueError("created_at is in the future")
+        return value
 
-class EventResponse(EventCreate):
+class EventResponse(BaseModel):
     id: int
+    event_type: str
+    user_id: int
+    event_metadata: Optional[Dict[str, Any]] = {}
+    event_id: Optional[str] = Field(None, validation_alias=AliasChoices("client_event_id", "event_id"))
     created_at: datetime
 
     class Config:
         from_attributes = True
 
+class EventBatch(BaseModel):
+    events: List[EventCreate] = Field(..., min_length=1, max_length=10000)
+
+class EventBatchResponse(BaseModel):
+    created: int
+    duplicates: int
+    # Id of the stored event for each submitted event, in request order
+    ids: List[int]
+
+class EventChanges(BaseModel):
+    events: List[EventResponse]
+    # Pass as `since` to continue after these events
+    cursor: str
+    has_more: bool
+
+class CountInterval(BaseModel):
+    # 95% confidence interval of a count estimated from a sample
+    low: int
+    high: int
+
 class AnalyticsSummary(BaseModel):
     total_users: int
     active_users_24h: int
     total_events: int
     event_type_counts: Dict[str, int]
+    # Event counts were scaled up from a sample of `sample_rate` (?sample=)
+    approximate: bool = False
+    sample_rate: Optional[float] = None
+    total_events_interval: Optional[CountInterval] = None
+    event_type_intervals: Optional[Dict[str, CountInterval]] = None
 
 class EventTypeCount(BaseModel):
     event_type: str
     count: int
+    approximate: bool = False
+    interval: Optional[CountInterval] = None
 
 class DateRangeAnalytics(BaseModel):
     start_date: Optional[datetime] = None
@@ -30,3 +78,124 @@ class DateRangeAnalytics(BaseModel):
     total_events: int
     unique_users: int
     event_breakdown: Dict[str, int]
+    approximate: bool = False
+    sample_rate: Optional[float] = None
+    total_events_interval: Optional[CountInterval] = None
+    unique_users_interval: Optional[CountInterval] = None
+    event_breakdown_intervals: Optional[Dict[str, CountInterval]] = None
+
+class EventSchemaResponse(BaseModel):
+    event_type: str
+    # JSON Schema (supported subset) that the event type's metadata must match
+    metadata_schema: Dict[str, Any]
+    version: int
+    updated_at: Optional[datetime] = None
+
+class TopUser(BaseModel):
+    user_id: int
+    count: int
+    max_error: int = 0
+
+class TopEventType(BaseModel):
+    event_type: str
+    count: int
+    max_error: int = 0
+
+class TopUsersResponse(BaseModel):
+    start_date: datetime
+    end_date: datetime
+    approximate: bool
+    users: List[TopUser]
+
+class TopEventTypesResponse(BaseModel):
+    start_date: datetime
+    end_date: datetime
+    approximate: bool
+    event_types: List[TopEventType]
+
+class UserProfile(BaseModel):
+    user_id: int
+    first_seen: datetime
+    last_seen: datetime
+    total_events: int
+    event_type_counts: Dict[str, int]
+    events_7d: int
+    events_30d: int
+
+class UserProfilesRequest(BaseModel):
+    user_ids: List[int] = Field(..., min_length=1, max_length=1000)
+
+class UserSessionResponse(BaseModel):
+    started_at: datetime
+    ended_at: datetime
+    duration_seconds: float
+    event_count: int
+    # Still open in this process (not yet closed by the inactivity timeout)
+    open: bool
+
+class SessionStats(BaseModel):
+    start_date: datetime
+    end_date: datetime
+    sessions: int
+    open_sessions: int
+    total_events: int
+    average_duration_seconds: float
+    average_events_per_session: float
+    # Share of sessions with a single event
+    bounce_rate: float
+
+class MetricAggregate(BaseModel):
+    event_type: str
+    # Start of the bucket or UTC day; None for granularity=total
+    bucket_start: Optional[datetime] = None
+    count: int
+    sum: float
+    min: float
+    max: float
+    avg: float
+    p50: float
+    p90: float
+    p99: float
+
+class MetricAggregates(BaseModel):
+    field: str
+    start_date: datetime
+    end_date: datetime
+    groups: List[MetricAggregate]
+
+class QueryFilter(BaseModel):
+    # event_type, user_id or metadata.<key>
+    field: str
+    op: str = Field("eq", pattern="^(eq|ne|in|not_in|gt|gte|lt|lte)$")
+    # A list for in / not_in
+    value: Any
+
+class QueryOrder(BaseModel):
+    # A measure or dimension of the query
+    field: str
+    direction: str = Field("desc", pattern="^(asc|desc)$")
+
+class QuerySpec(BaseModel):
+    # count, distinct_users
+    measures: List[str] = Field(..., min_length=1)
+    # event_type, user_id, time (bucketed by granularity), metadata.<key>
+    dimensions: List[str] = Field([], max_length=4)
+    granularity: str = Field("day", pattern="^(hour|day|week|month)$")
+    filters: List[QueryFilter] = Field([], max_length=20)
+    # Half-open window [start_date, end_date); defaults to the last 7 days
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    # Defaults to the dimensions, ascending
+    order_by: List[QueryOrder] = []
+    limit: int = Field(1000, ge=1, le=10000)
+    # `events` skips the rollup and reads the events table
+    source: str = Field("auto", pattern="^(auto|events)$")
+
+class QueryResult(BaseModel):
+    columns: List[str]
+    # One object per group, keyed by the columns
+    rows: List[Dict[str, Any]]
+    # Table that answered the query: events or user_activity_days
+    source: str
+    start_date: datetime
+    end_date: datetime
@@ -0,0 +1,312 @@
+"""Gap-based sessionization of user events.
+
+A session is a run of one user's events with no gap longer than
+SESSION_TIMEOUT_MINUTES. Each process keeps the open sessions of the users it
+ingests for in memory. A session closes once the watermark (the latest event
+time seen, less SESSION_LATENESS_SECONDS) is past its end plus the timeout; it
+is then written to `user_sessions` on the user's shard. Events arriving up to the
+lateness window out of order still extend or join open sessions in memory.
+
+Writes merge each closed session with the user's stored sessions within the
+timeout of it, found through the (user_id, ended_at) index. That joins fragments
+of one session seen by different workers, and events later than the lateness
+window, without rescanning history.
+
+Backfill rebuilds sessions from the events table (run it while ingest is paused,
+as sessions written during the run would be counted twice):
+    python -m app.sessions backfill [--since YYYY-MM-DD]
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+from . import models
+from .sharding import Shards, shard_sessionmakers
+from .timebuckets import as_utc_naive
+
+SESSION_TIMEOUT_MINUTES = float(os.getenv("SESSION_TIMEOUT_MINUTES", "30"))
+SESSION_LATENESS_SECONDS = float(os.getenv("SESSION_LATENESS_SECONDS", "300"))
+SESSION_FLUSH_SECONDS = float(os.getenv("SESSION_FLUSH_SECONDS", "10"))
+
+class Span:
+    """One user's session (open or closed); timestamps are naive UTC"""
+    __slots__ = ("user_id", "started_at", "ended_at", "event_count")
+
+    def __init__(self, user_id: int, started_at: datetime, ended_at: datetime, event_count: int):
+        self.user_id = user_id
+        self.started_at = started_at
+        self.ended_at = ended_at
+        self.event_count = event_count
+
+    @property
+    def duration_seconds(self) -> float:
+        return (self.ended_at - self.started_at).total_seconds()
+
+def merge_spans(spans: Iterable[Span], timeout: timedelta) -> List[List[Span]]:
+    """Group one user's spans into runs separated by more than `timeout`, oldest first"""
+    groups: List[List[Span]] = []
+    end = None
+    for span in sorted(spans, key=lambda span: span.started_at):
+        if groups and span.started_at <= end + timeout:
+            groups[-1].append(span)
+            end = max(end, span.ended_at)
+        else:
+            groups.append([span])
+            end = span.ended_at
+    return groups
+
+def combine(user_id: int, spans: List[Span]) -> Span:
+    return Span(
+        user_id,
+        min(span.started_at for span in spans),
+        max(span.ended_at for span in spans),
+        sum(span.event_count for span in spans)
+    )
+
+class Sessionizer:
+    """Open sessions per user, closed by a watermark and flushed to the database on ingest"""
+
+    def __init__(self, timeout: timedelta, lateness: timedelta):
+        self._lock = threading.Lock()
+        self.timeout = timeout
+        self.lateness = lateness
+        # Each user's open spans, kept more than `timeout` apart (usually one)
+        self.open: Dict[int, List[Span]] = {}
+        # Closed spans not yet written
+        self.closed: List[Span] = []
+        self.max_seen: Optional[datetime] = None
+        self.last_flush = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self.open.clear()
+            self.closed.clear()
+            self.max_seen = None
+            self.last_flush = time.monotonic()
+
+    def record(self, events: Iterable[Tuple[int, datetime]]):
+        """Add (user_id, event time) pairs, in any order"""
+        with self._lock:
+            for user_id, at in events:
+                at = as_utc_naive(at)
+                if self.max_seen is None or at > self.max_seen:
+                    self.max_seen = at
+                spans = self.open.setdefault(user_id, [])
+                joined = [span for span in spans
+                          if span.started_at - self.timeout <= at <= span.ended_at + self.timeout]
+                if joined:
+                    # The event may bridge two spans that were more than the timeout apart
+                    merged = combine(user_id, joined + [Span(user_id, at, at, 1)])
+                    spans[:] = [span for span in spans if span not in joined] + [merged]
+                else:
+                    spans.append(Span(user_id, at, at, 1))
+
+    def close_expired(self, now: Optional[datetime] = None, close_all: bool = False):
+        """Move spans the watermark has passed (or every span) to the closed list"""
+        with self._lock:
+            latest = max(filter(None, [self.max_seen, now]), default=None)
+            if latest is None:
+                return
+            cutoff = latest - self.lateness - self.timeout
+            for user_id in list(self.open):
+                spans = self.open[user_id]
+                expired = [span for span in spans if close_all or span.ended_at < cutoff]
+                if expired:
+                    self.closed.extend(expired)
+                    remaining = [span for span in spans if span not in expired]
+                    if remaining:
+                        self.open[user_id] = remaining
+                    else:
+                        del self.open[user_id]
+
+    def flush_if_due(self, shards: Shards):
+        if time.monotonic() - self.last_flush >= SESSION_FLUSH_SECONDS:
+            self.flush(shards)
+
+    def flush(self, shards: Shards, close_all: bool = False):
+        """Write closed sessions to their users' shards"""
+        self.close_expired(datetime.utcnow(), close_all)
+        with self._lock:
+            pending, self.closed = self.closed, []
+            self.last_flush = time.monotonic()
+        if not pending:
+            return
+
+        by_shard = defaultdict(list)
+        for span in pending:
+            by_shard[shards.index_for_user(span.user_id)].append(span)
+        shard_spans = list(by_shard.items())
+        for position, (index, spans) in enumerate(shard_spans):
+            db = shards.session(index)
+            try:
+                persist(db, spans, self.timeout)
+            except Exception:
+                db.rollback()
+                # Retry this shard and those not reached yet on the next flush
+                with self._lock:
+                    self.closed.extend(span for _, unwritten in shard_spans[position:] for span in unwritten)
+                raise
+
+    def unwritten(self, user_id: Optional[int] = None) -> List[Span]:
+        """Open and not yet written sessions held by this process (optionally one user's)"""
+        with self._lock:
+            if user_id is not None:
+                return list(self.open.get(user_id, [])) + [span for span in self.closed if span.user_id == user_id]
+            return [span for spans in self.open.values() for span in spans] + list(self.closed)
+
+sessionizer = Sessionizer(
+    timedelta(minutes=SESSION_TIMEOUT_MINUTES), timedelta(seconds=SESSION_LATENESS_SECONDS)
+)
+
+def persist(db: Session, spans: List[Span], timeout: timedelta):
+    """Write closed sessions, merging each with the user's stored sessions within `timeout` of it"""
+    if not spans:
+        return
+    earliest = min(span.started_at for span in spans) - timeout
+    user_ids = sorted({span.user_id for span in spans})
+    stored: Dict[int, List[models.UserSession]] = defaultdict(list)
+    for offset in range(0, len(user_ids), 1000):
+        for row in db.query(models.UserSession).filter(
+            models.UserSession.user_id.in_(user_ids[offset:offset + 1000]),
+            models.UserSession.ended_at >= earliest
+        ):
+            stored[row.user_id].append(row)
+
+    new_by_user = defaultdict(list)
+    for span in spans:
+        new_by_user[span.user_id].append(span)
+    for user_id in user_ids:
+        existing = [(Span(user_id, row.started_at, row.ended_at, row.event_count), row) for row in stored[user_id]]
+        row_for = {id(span): row for span, row in existing}
+        for group in merge_spans(new_by_user[user_id] + [span for span, _ in existing], timeout):
+            group_rows = [row_for[id(span)] for span in group if id(span) in row_for]
+            if len(group_rows) == len(group):
+                # Only stored sessions, unchanged
+                continue
+            merged = combine(user_id, group)
+            row = group_rows[0] if group_rows else models.UserSession(user_id=user_id)
+            row.started_at = merged.started_at
+            row.ended_at = merged.ended_at
+            row.duration_seconds = merged.duration_seconds
+            row.event_count = merged.event_count
+            if not group_rows:
+                db.add(row)
+            for duplicate in group_rows[1:]:
+                db.delete(duplicate)
+    db.commit()
+
+def _sessionize(rows: Iterable[Tuple[int, datetime]], timeout: timedelta) -> List[Span]:
+    """Split (user_id, created_at) rows ordered by user and time into sessions"""
+    spans: List[Span] = []
+    current = None
+    for user_id, created_at in rows:
+        at = as_utc_naive(created_at)
+        if current and current.user_id == user_id and at <= current.ended_at + timeout:
+            current.ended_at = at
+            current.event_count += 1
+        else:
+            current = Span(user_id, at, at, 1)
+            spans.append(current)
+    return spans
+
+def backfill(db: Session, since: Optional[datetime] = None, timeout: Optional[timedelta] = None,
+             batch_users: int = 1000) -> int:
+    """Rebuild sessions from events created since `since` (default: every stored event).
+
+    Returns the number of sessions rebuilt. Stored sessions of archived events are kept.
+    """
+    timeout = timeout or sessionizer.timeout
+    if since is None:
+        since = db.query(func.min(models.Event.created_at)).scalar()
+        if since is None:
+            return 0
+    since = as_utc_naive(since)
+    # Start at a session boundary: widen the window past any stored session it would cut through
+    while True:
+        earlier = db.query(func.min(models.UserSession.started_at)).filter(
+            models.UserSession.ended_at >= since - timeout,
+            models.UserSession.started_at < since
+        ).scalar()
+        if earlier is None:
+            break
+        since = earlier
+    db.query(models.UserSession).filter(models.UserSession.started_at >= since).delete(synchronize_session=False)
+    db.commit()
+
+    user_ids = [user_id for user_id, in db.query(models.Event.user_id).filter(
+        models.Event.created_at >= since
+    ).distinct().order_by(models.Event.user_id)]
+    rebuilt = 0
+    for offset in range(0, len(user_ids), batch_users):
+        spans = _sessionize(db.query(models.Event.user_id, models.Event.created_at).filter(
+            models.Event.user_id.in_(user_ids[offset:offset + batch_users]),
+            models.Event.created_at >= since
+        ).order_by(models.Event.user_id, models.Event.created_at), timeout)
+        persist(db, spans, timeout)
+        rebuilt += len(spans)
+        logging.info(f"Rebuilt {rebuilt} sessions so far")
+    return rebuilt
+
+def range_stats(db: Session, start: datetime, end: datetime) -> Tuple[int, int, float, int]:
+    """(sessions, events, summed duration seconds, single-event sessions) of stored sessions started in a window"""
+    sessions, events, duration, single = db.query(
+        func.count(),
+        func.coalesce(func.sum(models.UserSession.event_count), 0),
+        func.coalesce(func.sum(models.UserSession.duration_seconds), 0.0),
+        func.coalesce(func.sum(case((models.UserSession.event_count == 1, 1), else_=0)), 0)
+    ).filter(
+        models.UserSession.started_at >= as_utc_naive(start),
+        models.UserSession.started_at <= as_utc_naive(end)
+    ).one()
+    return sessions, events, duration, single
+
+def user_sessions(db: Session, user_id: int, start: Optional[datetime], end: Optional[datetime],
+                  limit: int) -> List[Tuple[Span, bool]]:
+    """A user's sessions overlapping a window, newest first, as (session, still open) pairs.
+
+    Stored sessions are combined with those this process has not written yet.
+    """
+    query = db.query(models.UserSession).filter(models.UserSession.user_id == user_id)
+    if start:
+        query = query.filter(models.UserSession.ended_at >= as_utc_naive(start))
+    if end:
+        query = query.filter(models.UserSession.started_at <= as_utc_naive(end))
+    stored = [
+        Span(user_id, row.started_at, row.ended_at, row.event_count)
+        for row in query.order_by(models.UserSession.ended_at.desc()).limit(limit)
+    ]
+    held = [
+        span for span in sessionizer.unwritten(user_id)
+        if (not start or span.ended_at >= as_utc_naive(start)) and (not end or span.started_at <= as_utc_naive(end))
+    ]
+    held_ids = {id(span) for span in held}
+    merged = [
+        (combine(user_id, group), any(id(span) in held_ids for span in group))
+        for group in merge_spans(stored + held, sessionizer.timeout)
+    ]
+    return list(reversed(merged))[:limit]
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild user sessions from stored events")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subcommands.add_parser("backfill", help="sessionize stored events")
+    backfill_parser.add_argument("--since", type=datetime.fromisoformat, default=None,
+                                 help="only rebuild sessions from this UTC time on (default: all events)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    for index, make_session in enumerate(shard_sessionmakers):
+        with make_session() as db:
+            rebuilt = backfill(db, args.since)
+        print(f"shard {index}: rebuilt {rebuilt} sessions")
+
+if __name__ == "__main__":
+    main()
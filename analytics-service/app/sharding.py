@@ -0,0 +1,334 @@
+"""Hash sharding of events across databases.
+
+Events, and the per-user tables derived from them (profiles, sessions, archive manifests),
+live on the shard picked by a jump consistent hash of `user_id`, so growing from
+N to N+1 shards only moves about 1/(N+1) of the users. Shared tables (the event
+type dictionary, heavy-hitter sketches) live in DATABASE_URL, the primary, which
+may itself be one of the shards. Event type rows are copied to every shard so codes
+resolve (and foreign keys hold) locally.
+
+User-scoped reads go to a single shard; global aggregates run on every shard
+concurrently and are merged by the caller. Because a user never spans shards,
+distinct-user counts can be summed. Event ids are only unique within a shard.
+
+Tools (from analytics-service/):
+    python -m app.sharding migrate                     # alembic upgrade head on every database, check event types
+    python -m app.sharding rebalance [--source URL]    # move rows to the shard that owns them
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import struct
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from service_common.startup import register_warmer, warm_pool
+
+from . import models, profiles
+from .database import DATABASE_URL, SHARD_URLS, SessionLocal, dialect_insert, engine, engine_options
+from .event_types import event_types
+
+T = TypeVar("T")
+
+shard_engines = [engine if url == DATABASE_URL else create_engine(url, **engine_options(url)) for url in SHARD_URLS]
+shard_sessionmakers = [
+    SessionLocal if shard_engine is engine else sessionmaker(autocommit=False, autoflush=False, bind=shard_engine)
+    for shard_engine in shard_engines
+]
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping & Veach) of a 64-bit key into [0, buckets)"""
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+def shard_index(user_id: int, shard_count: int) -> int:
+    """Shard owning a user's events"""
+    if shard_count == 1:
+        return 0
+    key, = struct.unpack("<Q", hashlib.blake2b(str(user_id).encode(), digest_size=8).digest())
+    return jump_hash(key, shard_count)
+
+class EventTypeMismatch(RuntimeError):
+    """A shard maps an event type code to a different name than the primary"""
+
+# Event type codes already copied to each (non-primary) shard, by session factory
+_replicated: Dict[Callable[[], Session], set] = defaultdict(set)
+
+class Shards:
+    """Per-request sessions for the primary and every shard, opened on first use.
+
+    A `None` shard factory means that shard is the primary database and shares
+    the primary session.
+    """
+
+    def __init__(self, primary_factory: Callable[[], Session],
+                 shard_factories: List[Optional[Callable[[], Session]]]):
+        self._primary_factory = primary_factory
+        self._factories = shard_factories
+        self._primary: Optional[Session] = None
+        self._sessions: Dict[int, Session] = {}
+
+    @property
+    def count(self) -> int:
+        return len(self._factories)
+
+    @property
+    def primary(self) -> Session:
+        if self._primary is None:
+            self._primary = self._primary_factory()
+        return self._primary
+
+    def session(self, index: int) -> Session:
+        if index not in self._sessions:
+            factory = self._factories[index]
+            self._sessions[index] = self.primary if factory is None else factory()
+        return self._sessions[index]
+
+    def sessions(self) -> List[Session]:
+        return [self.session(index) for index in range(self.count)]
+
+    def index_for_user(self, user_id: int) -> int:
+        return shard_index(user_id, self.count)
+
+    def for_user(self, user_id: int) -> Session:
+        return self.session(self.index_for_user(user_id))
+
+    async def gather(self, func: Callable[[Session], T]) -> List[T]:
+        """Run `func` against every shard, concurrently in worker threads if there are several"""
+        sessions = self.sessions()
+        if len(sessions) == 1:
+            return [func(sessions[0])]
+        return list(await asyncio.gather(*(asyncio.to_thread(func, db) for db in sessions)))
+
+    def replicate_event_types(self, codes: Dict[str, int]):
+        """Copy event type rows from the primary dictionary to shards that lack them"""
+        for index, factory in enumerate(self._factories):
+            if factory is None:
+                continue
+            missing = {name: code for name, code in codes.items() if code not in _replicated[factory]}
+            if missing:
+                db = self.session(index)
+                db.execute(dialect_insert(db, models.EventType).values([
+                    {"id": code, "name": name} for name, code in sorted(missing.items(), key=lambda item: item[1])
+                ]).on_conflict_do_nothing())
+                db.commit()
+                # A code the shard already had under another name would silently decode to the wrong type
+                stored = dict(db.query(models.EventType.id, models.EventType.name).filter(
+                    models.EventType.id.in_(missing.values())
+                ))
+                conflicts = sorted(
+                    f"{code}: {stored[code]!r} on shard {index}, {name!r} on the primary"
+                    for name, code in missing.items() if stored[code] != name
+                )
+                if conflicts:
+                    raise EventTypeMismatch(f"event type codes differ from the primary: {'; '.join(conflicts)}")
+                _replicated[factory].update(missing.values())
+
+    def close(self):
+        for db in {id(db): db for db in [self._primary, *self._sessions.values()] if db is not None}.values():
+            db.close()
+
+def open_shards() -> Shards:
+    """Shards over the configured databases; the caller closes them"""
+    return Shards(SessionLocal, [None if maker is SessionLocal else maker for maker in shard_sessionmakers])
+
+def get_shards():
+    shards = open_shards()
+    try:
+        yield shards
+    finally:
+        shards.close()
+
+@register_warmer
+def warm_shard_pools(db: Session):
+    """Open connections to the shards that are not the primary database"""
+    for shard_engine in shard_engines:
+        if shard_engine is not engine:
+            warm_pool(shard_engine, shard_engine.pool.size() if hasattr(shard_engine.pool, "size") else 1)
+
+def _move_events(source: Session, source_index: Optional[int], shards: Shards, batch_rows: int) -> int:
+    names = dict(source.query(models.EventType.id, models.EventType.name).all())
+    codes = event_types.encode(shards.primary, names.values())
+    shards.replicate_event_types(codes)
+    label = source.get_bind().url.render_as_string(hide_password=True)
+
+    moved, last_id = 0, 0
+    while True:
+        rows = source.query(models.Event).filter(models.Event.id > last_id).order_by(models.Event.id).limit(batch_rows).all()
+        if not rows:
+            # Every copied row is gone from the source now; drop journal rows an interrupted run left
+            for index in range(shards.count):
+                target = shards.session(index)
+                target.query(models.RebalanceMove).filter(models.RebalanceMove.source == label).delete()
+                target.commit()
+            return moved
+        last_id = rows[-1].id
+
+        by_shard = defaultdict(list)
+        for row in rows:
+            index = shards.index_for_user(row.user_id)
+            if index != source_index:
+                by_shard[index].append(row)
+        for index, batch in by_shard.items():
+            # Copied and journalled in one target transaction, then deleted from the source.
+            # A run interrupted in between left the rows in both places: the re-run finds them
+            # in the journal (or their client event id on the target) and only deletes them
+            target = shards.session(index)
+            ids = [row.id for row in batch]
+            copied = {source_event_id for source_event_id, in target.query(models.RebalanceMove.source_event_id).filter(
+                models.RebalanceMove.source == label,
+                models.RebalanceMove.source_event_id.in_(ids)
+            )}
+            keys = [row.client_event_id for row in batch if row.client_event_id and row.id not in copied]
+            stored_keys = {key for key, in target.query(models.Event.client_event_id).filter(
+                models.Event.client_event_id.in_(keys)
+            )} if keys else set()
+            new = [row for row in batch if row.id not in copied and row.client_event_id not in stored_keys]
+            target.add_all([
+                models.Event(
+                    event_type_id=codes[names[row.event_type_id]],
+                    user_id=row.user_id,
+                    event_metadata=row.event_metadata,
+                    client_event_id=row.client_event_id,
+                    created_at=row.created_at
+                )
+                for row in new
+            ])
+            target.add_all([models.RebalanceMove(source=label, source_event_id=row.id) for row in new])
+            target.commit()
+            source.query(models.Event).filter(models.Event.id.in_(ids)).delete(synchronize_session=False)
+            source.commit()
+            target.query(models.RebalanceMove).filter(
+                models.RebalanceMove.source == label,
+                models.RebalanceMove.source_event_id.in_(ids)
+            ).delete(synchronize_session=False)
+            target.commit()
+            moved += len(batch)
+        logging.info(f"Moved {moved} events so far")
+
+def _move_profiles(source: Session, source_index: Optional[int], shards: Shards) -> int:
+    names = dict(source.query(models.EventType.id, models.EventType.name).all())
+    codes = event_types.encode(shards.primary, names.values())
+    label = source.get_bind().url.render_as_string(hide_password=True)
+
+    by_shard = defaultdict(list)
+    for row in source.query(models.UserActivity).all():
+        index = shards.index_for_user(row.user_id)
+        if index != source_index:
+            by_shard[index].append(row.user_id)
+
+    for index, user_ids in by_shard.items():
+        for offset in range(0, len(user_ids), 1000):
+            chunk = user_ids[offset:offset + 1000]
+            target = shards.session(index)
+            # Journalled like _move_events: counters merged twice or sessions inserted twice
+            # would be wrong, so a re-run only deletes users an interrupted run already copied
+            copied = {user_id for user_id, in target.query(models.RebalanceProfileMove.user_id).filter(
+                models.RebalanceProfileMove.source == label,
+                models.RebalanceProfileMove.user_id.in_(chunk)
+            )}
+            new = [user_id for user_id in chunk if user_id not in copied]
+            if new:
+                profiles.merge(target, [
+                    {"user_id": row.user_id, "first_seen": row.first_seen, "last_seen": row.last_seen,
+                     "total_events": row.total_events}
+                    for row in source.query(models.UserActivity).filter(models.UserActivity.user_id.in_(new))
+                ], [
+                    {"user_id": row.user_id, "event_type_id": codes[names[row.event_type_id]], "count": row.count}
+                    for row in source.query(models.UserActivityTypeCount).filter(
+                        models.UserActivityTypeCount.user_id.in_(new)
+                    )
+                ], [
+                    {"user_id": row.user_id, "day": row.day, "count": row.count}
+                    for row in source.query(models.UserActivityDay).filter(models.UserActivityDay.user_id.in_(new))
+                ])
+                target.add_all([
+                    models.UserSession(user_id=row.user_id, started_at=row.started_at, ended_at=row.ended_at,
+                                       duration_seconds=row.duration_seconds, event_count=row.event_count)
+                    for row in source.query(models.UserSession).filter(models.UserSession.user_id.in_(new))
+                ])
+                target.add_all([models.RebalanceProfileMove(source=label, user_id=user_id) for user_id in new])
+                target.commit()
+            for model in (models.UserActivity, models.UserActivityTypeCount, models.UserActivityDay,
+                          models.UserSession):
+                source.query(model).filter(model.user_id.in_(chunk)).delete(synchronize_session=False)
+            source.commit()
+            target.query(models.RebalanceProfileMove).filter(
+                models.RebalanceProfileMove.source == label,
+                models.RebalanceProfileMove.user_id.in_(chunk)
+            ).delete(synchronize_session=False)
+            target.commit()
+
+    # Drop journal rows of users an interrupted run copied whose profiles are gone from the source
+    for index in range(shards.count):
+        target = shards.session(index)
+        target.query(models.RebalanceProfileMove).filter(models.RebalanceProfileMove.source == label).delete()
+        target.commit()
+    return sum(len(user_ids) for user_ids in by_shard.values())
+
+def rebalance(source: Session, source_index: Optional[int], shards: Shards, batch_rows: int = 5000):
+    """Move events and profiles (with sessions) from `source` to the shards that own their users.
+
+    `source_index` is the source's own shard index, or None for a database outside
+    the shard set (a backfill). Returns (events moved, profiles moved). Archived
+    Parquet files stay with the shard that wrote them.
+    """
+    return _move_events(source, source_index, shards, batch_rows), _move_profiles(source, source_index, shards)
+
+def migrate():
+    """Upgrade the primary and every shard to the latest schema, then copy and check the event type dictionary.
+
+    Raises EventTypeMismatch if a shard maps a code to another name than the primary.
+    """
+    for url in dict.fromkeys([DATABASE_URL, *SHARD_URLS]):
+        config = Config("alembic.ini")
+        config.set_main_option("sqlalchemy.url", url)
+        command.upgrade(config, "head")
+    shards = open_shards()
+    try:
+        shards.replicate_event_types(dict(shards.primary.query(models.EventType.name, models.EventType.id).all()))
+    finally:
+        shards.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage hash-sharded event storage")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("migrate", help="apply migrations to the primary and every shard")
+    rebalance_parser = subcommands.add_parser("rebalance", help="move rows to the shard owning their user")
+    rebalance_parser.add_argument("--source", action="append", default=[],
+                                  help="also drain this database (e.g. the pre-sharding one); repeatable")
+    rebalance_parser.add_argument("--batch-rows", type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate()
+        return
+
+    logging.basicConfig(level=logging.INFO)
+    with SessionLocal() as primary:
+        shards = Shards(lambda: primary, [None if maker is SessionLocal else maker for maker in shard_sessionmakers])
+        try:
+            for index in range(shards.count):
+                events, users = rebalance(shards.session(index), index, shards, args.batch_rows)
+                print(f"shard {index}: moved {events} events and {users} profiles")
+            for url in args.source:
+                source_engine = create_engine(url, **engine_options(url))
+                with Session(bind=source_engine) as source:
+                    events, users = rebalance(source, None, shards, args.batch_rows)
+                source_engine.dispose()
+                print(f"{url}: moved {events} events and {users} profiles")
+        finally:
+            shards.close()
+
+if __name__ == "__main__":
+    main()
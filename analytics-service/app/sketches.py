@@ -0,0 +1,293 @@
+"""Mergeable streaming sketches used for approximate aggregates.
+
+Every sketch supports ``add``, ``merge`` and a JSON-compatible ``to_dict`` /
+``from_dict`` round trip, so partial sketches built per time bucket (and per
+process) can be stored and combined at query time.
+"""
+import hashlib
+import heapq
+import math
+import operator
+import struct
+from typing import Dict, List, Optional, Tuple
+
+class SpaceSaving:
+    """Space-Saving top-k summary (Metwally et al.) with the mergeable-summaries merge.
+
+    Tracks at most `capacity` keys. For each key, the stored count overestimates the
+    true count by at most the stored error.
+    """
+
+    def __init__(self, capacity: int = 256):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+
+    def add(self, key: str, count: int = 1):
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+        else:
+            victim = min(self.counts, key=self.counts.get)
+            floor = self.counts.pop(victim)
+            del self.errors[victim]
+            self.counts[key] = floor + count
+            self.errors[key] = floor
+
+    def _floor(self) -> int:
+        """Upper bound on the count of any key that is not tracked"""
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def merge(self, other: "SpaceSaving"):
+        own_floor, other_floor = self._floor(), other._floor()
+        counts, errors = {}, {}
+        for key in self.counts.keys() | other.counts.keys():
+            counts[key] = self.counts.get(key, own_floor) + other.counts.get(key, other_floor)
+            errors[key] = self.errors.get(key, own_floor) + other.errors.get(key, other_floor)
+        kept = heapq.nlargest(self.capacity, counts, key=counts.get)
+        self.counts = {key: counts[key] for key in kept}
+        self.errors = {key: errors[key] for key in kept}
+
+    def to_dict(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "counts": {key: [count, self.errors[key]] for key, count in self.counts.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SpaceSaving":
+        summary = cls(data["capacity"])
+        for key, (count, error) in data["counts"].items():
+            summary.counts[key] = count
+            summary.errors[key] = error
+        return summary
+
+class CountMinSketch:
+    """Count-Min sketch (Cormode & Muthukrishnan); estimates never undercount.
+
+    Hashing is derived from blake2b so sketches built in different processes agree.
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.table: List[List[int]] = [[0] * width for _ in range(depth)]
+
+    def _columns(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=4 * self.depth).digest()
+        for value in struct.unpack(f"<{self.depth}I", digest):
+            yield value % self.width
+
+    def add(self, key: str, count: int = 1):
+        for row, column in zip(self.table, self._columns(key)):
+            row[column] += count
+
+    def estimate(self, key: str) -> int:
+        return min(row[column] for row, column in zip(self.table, self._columns(key)))
+
+    def merge(self, other: "CountMinSketch"):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Cannot merge Count-Min sketches of different shapes")
+        self.table = [list(map(operator.add, row, other_row))
+                      for row, other_row in zip(self.table, other.table)]
+
+    def to_dict(self) -> dict:
+        return {"width": self.width, "depth": self.depth, "table": [list(row) for row in self.table]}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CountMinSketch":
+        sketch = cls.__new__(cls)
+        sketch.width = data["width"]
+        sketch.depth = data["depth"]
+        sketch.table = data["table"]
+        return sketch
+
+class HeavyHitterSketch:
+    """Space-Saving for candidate keys plus Count-Min to tighten their counts"""
+
+    def __init__(self, capacity: int = 256, width: int = 2048, depth: int = 4):
+        self.total = 0
+        self.summary = SpaceSaving(capacity)
+        self.frequencies = CountMinSketch(width, depth)
+
+    def add(self, key: str, count: int = 1):
+        self.total += count
+        self.summary.add(key, count)
+        self.frequencies.add(key, count)
+
+    def merge(self, other: "HeavyHitterSketch"):
+        self.total += other.total
+        self.summary.merge(other.summary)
+        self.frequencies.merge(other.frequencies)
+
+    def top(self, n: int) -> List[Tuple[str, int, int]]:
+        """Return up to `n` (key, estimated_count, max_error) tuples, largest first.
+
+        The true count of each key lies in [estimated_count - max_error, estimated_count].
+        """
+        results = []
+        for key, count in self.summary.counts.items():
+            estimate = min(count, self.frequencies.estimate(key))
+            lower_bound = max(count - self.summary.errors[key], 0)
+            results.append((key, estimate, estimate - lower_bound))
+        results.sort(key=lambda item: (-item[1], item[0]))
+        return results[:n]
+
+    def to_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "summary": self.summary.to_dict(),
+            "frequencies": self.frequencies.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HeavyHitterSketch":
+        sketch = cls.__new__(cls)
+        sketch.total = data["total"]
+        sketch.summary = SpaceSaving.from_dict(data["summary"])
+        sketch.frequencies = CountMinSketch.from_dict(data["frequencies"])
+        return sketch
+
+class DDSketch:
+    """DDSketch (Masson et al.): quantiles within relative error `alpha`, merged exactly.
+
+    Values are counted in logarithmically sized buckets (negative values in a mirrored
+    store, values near zero apart). When a store exceeds `max_buckets`, its buckets
+    closest to zero are collapsed, so only the smallest magnitudes lose accuracy.
+    """
+    MIN_MAGNITUDE = 1e-9
+
+    def __init__(self, alpha: float = 0.01, max_buckets: int = 2048):
+        self.alpha = alpha
+        self.max_buckets = max_buckets
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+
+    def _index(self, magnitude: float) -> int:
+        return math.ceil(math.log(magnitude) / self._log_gamma)
+
+    def _value(self, index: int) -> float:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def _collapse(self, store: Dict[int, int]):
+        if len(store) <= self.max_buckets:
+            return
+        indexes = sorted(store)
+        excess = indexes[:len(store) - self.max_buckets + 1]
+        store[excess[-1]] = sum(store.pop(index) for index in excess[:-1]) + store[excess[-1]]
+
+    def add(self, value: float, count: int = 1):
+        if value > self.MIN_MAGNITUDE:
+            index = self._index(value)
+            self.positive[index] = self.positive.get(index, 0) + count
+            self._collapse(self.positive)
+        elif value < -self.MIN_MAGNITUDE:
+            index = self._index(-value)
+            self.negative[index] = self.negative.get(index, 0) + count
+            self._collapse(self.negative)
+        else:
+            self.zeros += count
+        self.count += count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimated value at quantile `q` in [0, 1]; None if empty"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(self.positive))
+
+    def merge(self, other: "DDSketch"):
+        if self.alpha != other.alpha:
+            raise ValueError("Cannot merge DDSketches with different relative accuracy")
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in other_store.items():
+                store[index] = store.get(index, 0) + count
+            self._collapse(store)
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def to_dict(self) -> dict:
+        return {
+            "alpha": self.alpha,
+            "max_buckets": self.max_buckets,
+            "positive": {str(index): count for index, count in self.positive.items()},
+            "negative": {str(index): count for index, count in self.negative.items()},
+            "zeros": self.zeros,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DDSketch":
+        sketch = cls(data["alpha"], data["max_buckets"])
+        sketch.positive = {int(index): count for index, count in data["positive"].items()}
+        sketch.negative = {int(index): count for index, count in data["negative"].items()}
+        sketch.zeros = data["zeros"]
+        sketch.count = sum(sketch.positive.values()) + sum(sketch.negative.values()) + sketch.zeros
+        return sketch
+
+class NumericSketch:
+    """Exact count/sum/min/max plus a DDSketch for quantiles of one numeric series"""
+
+    def __init__(self, alpha: float = 0.01):
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.quantiles = DDSketch(alpha)
+
+    @property
+    def count(self) -> int:
+        return self.quantiles.count
+
+    def add(self, value: float):
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.quantiles.add(value)
+
+    def merge(self, other: "NumericSketch"):
+        self.sum += other.sum
+        self.min = min(filter(lambda value: value is not None, [self.min, other.min]), default=None)
+        self.max = max(filter(lambda value: value is not None, [self.max, other.max]), default=None)
+        self.quantiles.merge(other.quantiles)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Quantile estimate clamped to the exact min/max (which answer q=0 and q=1)"""
+        value = self.quantiles.quantile(q)
+        if value is None:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        return min(max(value, self.min), self.max)
+
+    def to_dict(self) -> dict:
+        return {"sum": self.sum, "min": self.min, "max": self.max, "quantiles": self.quantiles.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "NumericSketch":
+        sketch = cls.__new__(cls)
+        sketch.sum = data["sum"]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+        sketch.quantiles = DDSketch.from_dict(data["quantiles"])
+        return sketch
@@ -0,0 +1,18 @@
+"""Helpers for bucketing event timestamps.
+
+Bucket boundaries are naive UTC datetimes, matching the naive `datetime.utcnow()`
+values the routers already compare `created_at` against.
+"""
+from datetime import datetime, timezone
+
+def as_utc_naive(value: datetime) -> datetime:
+    """Convert an aware datetime to naive UTC; naive values are assumed to be UTC"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def bucket_start(value: datetime, bucket_seconds: int) -> datetime:
+    """Start of the fixed-width bucket containing `value`"""
+    value = as_utc_naive(value)
+    epoch = int(value.replace(tzinfo=timezone.utc).timestamp())
+    return datetime.utcfromtimestamp(epoch - epoch % bucket_seconds)
@@ -0,0 +1,66 @@
+"""Measure cold-start-to-first-fast-response for the analytics service.
+
+Starts a fresh `uvicorn` process, then reports:
+  - time until the process accepts connections (/health)
+  - time until warm-up completes (/ready)
+  - latency of the first and of steady-state /analytics/summary requests
+
+Usage (from analytics-service/):
+    python benchmarks/cold_start.py                 # throwaway SQLite database
+    DATABASE_URL=postgresql://... python benchmarks/cold_start.py
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+PORT = int(os.getenv("BENCH_PORT", "8101"))
+BASE_URL = f"http://127.0.0.1:{PORT}"
+
+def wait_for(path: str, started: float, timeout: float = 60.0) -> float:
+    while time.monotonic() - started < timeout:
+        try:
+            if httpx.get(f"{BASE_URL}{path}", timeout=1.0).status_code == 200:
+                return time.monotonic() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{path} did not become available within {timeout}s")
+
+def timed_get(path: str) -> float:
+    started = time.perf_counter()
+    httpx.get(f"{BASE_URL}{path}", timeout=10.0).raise_for_status()
+    return time.perf_counter() - started
+
+def main():
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/cold_start.db")
+    env.setdefault("USER_SERVICE_URL", "http://127.0.0.1:9")
+    subprocess.run(["alembic", "upgrade", "head"], env=env, check=True, capture_output=True)
+
+    started = time.monotonic()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(PORT)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        listening = wait_for("/health", started)
+        ready = wait_for("/ready", started)
+        first = timed_get("/analytics/summary")
+        steady = [timed_get("/analytics/summary") for _ in range(20)]
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"process start -> listening:      {listening * 1000:8.1f} ms")
+    print(f"process start -> ready:          {ready * 1000:8.1f} ms")
+    print(f"first /analytics/summary:        {first * 1000:8.1f} ms")
+    print(f"steady /analytics/summary (p50): {statistics.median(steady) * 1000:8.1f} ms")
+    print(f"cold start -> first response:    {(ready + first) * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Table/index size and scan speed before and after dictionary-encoding event types.
+
+Migrates a scratch database to revision 0003 (event type names stored in every
+row), loads a synthetic event stream, measures, then runs the 0004 migration and
+measures the same queries against the encoded schema.
+
+Usage (from analytics-service/):
+    python -m benchmarks.event_type_encoding [events] [event_types]
+
+Set DATABASE_URL to an empty Postgres database to measure there; the default is a
+temporary SQLite file.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, text
+
+REPEATS = 5
+
+def migrate(url: str, revision: str) -> float:
+    config = Config("alembic.ini")
+    config.set_main_option("sqlalchemy.url", url)
+    config.attributes["configure_logger"] = False
+    started = time.perf_counter()
+    command.upgrade(config, revision)
+    return time.perf_counter() - started
+
+def load(engine, events: int, types: int, seed: int = 42):
+    rng = random.Random(seed)
+    names = [f"{rng.choice(['page', 'user', 'order', 'cart'])}_event_{i}" for i in range(types)]
+    weights = [1 / rank for rank in range(1, types + 1)]
+    with engine.begin() as connection:
+        for offset in range(0, events, 10_000):
+            count = min(10_000, events - offset)
+            connection.execute(
+                text("INSERT INTO events (event_type, user_id, event_metadata) VALUES (:t, :u, '{}')"),
+                [{"t": t, "u": rng.randrange(50_000)} for t in rng.choices(names, weights=weights, k=count)]
+            )
+    return names[0]
+
+def sizes(engine):
+    """(table bytes, bytes of indexes on events)"""
+    with engine.connect() as connection:
+        if engine.dialect.name == "postgresql":
+            return connection.execute(text(
+                "SELECT pg_relation_size('events'), pg_indexes_size('events')"
+            )).one()
+        connection.execute(text("VACUUM"))
+        indexes = [row[0] for row in connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'events'"
+        ))]
+        by_name = dict(connection.execute(text("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")).all())
+        return by_name["events"], sum(by_name.get(name, 0) for name in indexes)
+
+def best_ms(engine, sql: str, **params) -> float:
+    best = float("inf")
+    with engine.connect() as connection:
+        for _ in range(REPEATS):
+            started = time.perf_counter()
+            connection.execute(text(sql), params).all()
+            best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+def measure(engine, encoded: bool, name: str):
+    table_bytes, index_bytes = sizes(engine)
+    if encoded:
+        with engine.connect() as connection:
+            code = connection.execute(text("SELECT id FROM event_types WHERE name = :n"), {"n": name}).scalar()
+        group_ms = best_ms(engine, "SELECT event_type_id, COUNT(id) FROM events GROUP BY event_type_id")
+        filter_ms = best_ms(engine, "SELECT COUNT(id) FROM events WHERE event_type_id = :c", c=code)
+    else:
+        group_ms = best_ms(engine, "SELECT event_type, COUNT(id) FROM events GROUP BY event_type")
+        filter_ms = best_ms(engine, "SELECT COUNT(id) FROM events WHERE event_type = :n", n=name)
+    return table_bytes, index_bytes, group_ms, filter_ms
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    types = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    url = os.getenv("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/encoding.db")
+
+    migrate(url, "0003")
+    engine = create_engine(url)
+    common_type = load(engine, events, types)
+    before = measure(engine, False, common_type)
+    engine.dispose()
+
+    migration_seconds = migrate(url, "0004")
+    engine = create_engine(url)
+    after = measure(engine, True, common_type)
+    engine.dispose()
+
+    print(f"{events} events, {types} event types on {url.split(':')[0]} (migration took {migration_seconds:.1f}s)")
+    print(f"{'':>16} {'names':>12} {'codes':>12} {'ratio':>7}")
+    labels = ("table bytes", "index bytes", "group by ms", "filter ms")
+    for label, old, new in zip(labels, before, after):
+        digits = 1 if label.endswith("ms") else 0
+        print(f"{label:>16} {old:>12,.{digits}f} {new:>12,.{digits}f} {new / old:>7.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Accuracy/latency benchmark for sketch-backed top-N queries.
+
+Generates a Zipf-distributed event stream spread over hourly buckets, then
+compares the per-bucket sketches (merged at query time) against an exact
+GROUP BY over the same rows in SQLite.
+
+Usage (from analytics-service/):
+    python -m benchmarks.heavy_hitters [events] [users] [days]
+"""
+import random
+import sqlite3
+import sys
+import time
+from collections import Counter, defaultdict
+
+from app.sketches import HeavyHitterSketch
+
+TOP_N = 10
+
+def generate(events: int, users: int, days: int, seed: int = 42):
+    rng = random.Random(seed)
+    weights = [1 / rank ** 1.1 for rank in range(1, users + 1)]
+    user_ids = rng.choices(range(1, users + 1), weights=weights, k=events)
+    hours = [rng.randrange(days * 24) for _ in range(events)]
+    return list(zip(hours, user_ids))
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+    days = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+    stream = generate(events, users, days)
+
+    started = time.perf_counter()
+    buckets = defaultdict(HeavyHitterSketch)
+    for hour, user_id in stream:
+        buckets[hour].add(str(user_id))
+    ingest_seconds = time.perf_counter() - started
+    stored = {hour: sketch.to_dict() for hour, sketch in buckets.items()}
+
+    db = sqlite3.connect(":memory:")
+    db.execute("CREATE TABLE events (id INTEGER PRIMARY KEY, user_id INTEGER, hour INTEGER)")
+    db.executemany("INSERT INTO events (user_id, hour) VALUES (?, ?)",
+                   [(user_id, hour) for hour, user_id in stream])
+    db.execute("CREATE INDEX ix_events_hour ON events (hour)")
+
+    print(f"{events} events, {users} users, {days} days of hourly buckets")
+    print(f"sketch ingest: {events / ingest_seconds:,.0f} events/s")
+    print(f"{'window':>8} {'exact ms':>9} {'sketch ms':>10} {'recall@10':>10} {'max rel err':>12}")
+    for window_days in (1, 7, days):
+        window = range(days * 24 - window_days * 24, days * 24)
+
+        started = time.perf_counter()
+        exact = db.execute(
+            "SELECT user_id, COUNT(id) FROM events WHERE hour >= ? GROUP BY user_id "
+            "ORDER BY COUNT(id) DESC LIMIT ?", (window.start, TOP_N)
+        ).fetchall()
+        exact_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        merged = HeavyHitterSketch()
+        for hour in window:
+            if hour in stored:
+                merged.merge(HeavyHitterSketch.from_dict(stored[hour]))
+        top = merged.top(TOP_N)
+        sketch_ms = (time.perf_counter() - started) * 1000
+
+        truth = Counter(user_id for hour, user_id in stream if hour in window)
+        recall = len({int(key) for key, _, _ in top} & {user_id for user_id, _ in exact}) / TOP_N
+        max_error = max(abs(count - truth[int(key)]) / truth[int(key)] for key, count, _ in top)
+        print(f"{window_days:>7}d {exact_ms:>9.1f} {sketch_ms:>10.1f} {recall:>10.2f} {max_error:>12.3%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Payload size and latency of GET /analytics/events per response format.
+
+Seeds a scratch database with events, starts the service under gunicorn with one
+worker, and fetches the same page of rows as JSON, Arrow and MessagePack, each
+with and without gzip. Latency covers the round trip plus decoding the body on
+the client, since that is what a dashboard or notebook pays.
+
+Usage (from analytics-service/):
+    python -m benchmarks.response_formats [rows]
+
+Set DATABASE_URL to an empty Postgres database to measure there; the default is a
+temporary SQLite file.
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+import msgpack
+import pyarrow as pa
+from sqlalchemy import create_engine, text
+
+PORT = int(os.getenv("BENCH_PORT", "8103"))
+BASE_URL = f"http://127.0.0.1:{PORT}"
+REPEATS = 5
+
+FORMATS = {
+    "json": ("application/json", json.loads),
+    "arrow": ("application/vnd.apache.arrow.stream", lambda body: pa.ipc.open_stream(body).read_all()),
+    "msgpack": ("application/msgpack", lambda body: msgpack.unpackb(body, timestamp=3)),
+}
+
+def seed(url: str, rows: int, seed: int = 42):
+    rng = random.Random(seed)
+    names = ["page_view", "click", "user_login", "user_logout", "purchase", "search"]
+    started = datetime.utcnow() - timedelta(days=1)
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO event_types (id, name) VALUES (:i, :n)"),
+                           [{"i": i + 1, "n": name} for i, name in enumerate(names)])
+        for offset in range(0, rows, 10_000):
+            connection.execute(
+                text("INSERT INTO events (event_type_id, user_id, event_metadata, client_event_id, created_at) "
+                     "VALUES (:t, :u, :m, :c, :at)"),
+                [{
+                    "t": rng.randrange(len(names)) + 1,
+                    "u": rng.randrange(50_000),
+                    "m": json.dumps({"page": f"/products/{rng.randrange(500)}", "ms": rng.randrange(2000)}),
+                    "c": f"{offset + i:032x}",
+                    "at": started + timedelta(milliseconds=offset + i),
+                } for i in range(min(10_000, rows - offset))]
+            )
+    engine.dispose()
+
+def wait_until_ready(timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{BASE_URL}/ready").status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("service did not become ready")
+
+def measure(client: httpx.Client, rows: int, accept: str, compression: str, parse):
+    """(bytes on the wire, best milliseconds for request plus decode)"""
+    best, wire_bytes = float("inf"), 0
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        response = client.get("/analytics/events", params={"limit": rows},
+                              headers={"Accept": accept, "Accept-Encoding": compression})
+        response.raise_for_status()
+        parse(response.content)
+        best = min(best, time.perf_counter() - started)
+        wire_bytes = response.num_bytes_downloaded
+    return wire_bytes, best * 1000
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/formats.db")
+    env.setdefault("USER_SERVICE_URL", "http://127.0.0.1:9")
+    env["PORT"] = str(PORT)
+    env["WEB_CONCURRENCY"] = "1"
+    env["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp()
+    subprocess.run(["alembic", "upgrade", "head"], env=env, check=True, capture_output=True)
+    seed(env["DATABASE_URL"], rows)
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app.main:app", "-c", "gunicorn.conf.py"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready()
+        results = {}
+        with httpx.Client(base_url=BASE_URL, timeout=120.0) as client:
+            for name, (accept, parse) in FORMATS.items():
+                for compression in ("identity", "gzip"):
+                    results[name, compression] = measure(client, rows, accept, compression, parse)
+    finally:
+        server.terminate()
+        server.wait()
+
+    json_bytes, json_ms = results["json", "identity"]
+    print(f"{rows} events on {env['DATABASE_URL'].split(':')[0]}")
+    print(f"{'format':>8} {'encoding':>9} {'bytes':>13} {'size':>6} {'ms':>9} {'speedup':>8}")
+    for (name, compression), (wire_bytes, ms) in results.items():
+        print(f"{name:>8} {compression:>9} {wire_bytes:>13,} {wire_bytes / json_bytes:>6.2f} "
+              f"{ms:>9.1f} {json_ms / ms:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Latency versus error of ?sample= on the count endpoints.
+
+Seeds a scratch database with events, starts the service under gunicorn with one
+worker, and queries /analytics/events/by-type and /analytics/events/date-range
+exactly and at several sample rates. For each rate it reports the best latency,
+the largest relative error of any event type count (and of unique users), and
+whether every exact value fell inside the reported 95% interval.
+
+Usage (from analytics-service/):
+    python -m benchmarks.sampling [rows]
+
+Set DATABASE_URL to an empty Postgres database to measure TABLESAMPLE; the default
+is a temporary SQLite file, which samples by hashing event ids.
+"""
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import create_engine, text
+
+PORT = int(os.getenv("BENCH_PORT", "8105"))
+BASE_URL = f"http://127.0.0.1:{PORT}"
+REPEATS = 5
+RATES = [0.001, 0.01, 0.05, 0.1, 0.25]
+
+def seed(url: str, rows: int, seed: int = 42):
+    rng = random.Random(seed)
+    # Skewed type frequencies, so rare types show the error of small counts
+    names = ["page_view", "click", "search", "user_login", "purchase", "refund"]
+    weights = [50, 25, 12, 8, 4, 1]
+    started = datetime.utcnow() - timedelta(days=1)
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO event_types (id, name) VALUES (:i, :n)"),
+                           [{"i": i + 1, "n": name} for i, name in enumerate(names)])
+        for offset in range(0, rows, 10_000):
+            count = min(10_000, rows - offset)
+            types = rng.choices(range(1, len(names) + 1), weights, k=count)
+            connection.execute(
+                text("INSERT INTO events (event_type_id, user_id, event_metadata, created_at) "
+                     "VALUES (:t, :u, '{}', :at)"),
+                [{
+                    "t": types[i],
+                    "u": rng.randrange(100_000),
+                    "at": started + timedelta(milliseconds=(offset + i) * 50),
+                } for i in range(count)]
+            )
+    engine.dispose()
+
+def wait_until_ready(timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{BASE_URL}/ready").status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("service did not become ready")
+
+def measure(client: httpx.Client, path: str, params: dict):
+    """(response body, best milliseconds)"""
+    best, body = float("inf"), None
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        response = client.get(path, params=params)
+        response.raise_for_status()
+        best = min(best, time.perf_counter() - started)
+        body = response.json()
+    return body, best * 1000
+
+def by_type_error(exact: dict, rows: list):
+    """(largest relative error over event types, all exact counts inside their interval)"""
+    error, covered = 0.0, True
+    for row in rows:
+        truth = exact[row["event_type"]]
+        error = max(error, abs(row["count"] - truth) / truth)
+        covered = covered and row["interval"]["low"] <= truth <= row["interval"]["high"]
+    return error, covered
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/sampling.db")
+    env.setdefault("USER_SERVICE_URL", "http://127.0.0.1:9")
+    env["PORT"] = str(PORT)
+    env["WEB_CONCURRENCY"] = "1"
+    env["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp()
+    subprocess.run(["alembic", "upgrade", "head"], env=env, check=True, capture_output=True)
+    seed(env["DATABASE_URL"], rows)
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app.main:app", "-c", "gunicorn.conf.py"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready()
+        with httpx.Client(base_url=BASE_URL, timeout=300.0) as client:
+            exact_types, exact_type_ms = measure(client, "/analytics/events/by-type", {})
+            exact_range, exact_range_ms = measure(client, "/analytics/events/date-range", {})
+            exact = {row["event_type"]: row["count"] for row in exact_types}
+            results = []
+            for rate in RATES:
+                types, type_ms = measure(client, "/analytics/events/by-type", {"sample": rate})
+                date_range, range_ms = measure(client, "/analytics/events/date-range", {"sample": rate})
+                type_error, covered = by_type_error(exact, types)
+                users = exact_range["unique_users"]
+                users_error = abs(date_range["unique_users"] - users) / users
+                interval = date_range["unique_users_interval"]
+                covered = covered and interval["low"] <= users <= interval["high"]
+                results.append((rate, type_ms, type_error, range_ms, users_error, covered))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"{rows} events on {env['DATABASE_URL'].split(':')[0]}")
+    print(f"{'sample':>7} {'by-type ms':>11} {'max type err':>13} {'range ms':>9} {'users err':>10} {'in 95% CI':>10}")
+    print(f"{'exact':>7} {exact_type_ms:>11.1f} {0:>13.2%} {exact_range_ms:>9.1f} {0:>10.2%} {'':>10}")
+    for rate, type_ms, type_error, range_ms, users_error, covered in results:
+        print(f"{rate:>7} {type_ms:>11.1f} {type_error:>13.2%} {range_ms:>9.1f} {users_error:>10.2%} "
+              f"{'yes' if covered else 'no':>10}")
+
+if __name__ == "__main__":
+    main()
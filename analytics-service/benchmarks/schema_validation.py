@@ -0,0 +1,119 @@
+"""Metadata validation throughput: compiled schemas versus Pydantic models.
+
+Builds a batch payload of purchase and page_view events and times, per event:
+- the current request model alone (`EventBatch`, metadata is `Dict[str, Any]`),
+- that plus a per-type Pydantic model equivalent to each schema, which is what
+  a consumer re-validating the metadata pays,
+- that plus the compiled validators from app/event_schemas.py.
+
+Usage (from analytics-service/):
+    python -m benchmarks.schema_validation [events]
+"""
+import random
+import sys
+import time
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+from app.event_schemas import compile_schema
+from app.schemas import EventBatch
+
+REPEATS = 5
+
+SCHEMAS = {
+    "purchase": {
+        "type": "object",
+        "properties": {
+            "amount": {"type": "number", "minimum": 0},
+            "currency": {"type": "string", "enum": ["EUR", "USD", "GBP"]},
+            "sku": {"type": "string", "pattern": "^SKU-[0-9]+$", "maxLength": 16},
+            "quantity": {"type": "integer", "minimum": 1, "maximum": 100},
+            "coupons": {"type": "array", "items": {"type": "string"}, "maxItems": 5},
+        },
+        "required": ["amount", "currency", "sku"],
+        "additionalProperties": False,
+    },
+    "page_view": {
+        "type": "object",
+        "properties": {
+            "page": {"type": "string", "maxLength": 200},
+            "referrer": {"type": ["string", "null"]},
+            "load_ms": {"type": "integer", "minimum": 0},
+        },
+        "required": ["page"],
+    },
+}
+
+class PurchaseMetadata(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    amount: float = Field(ge=0)
+    currency: Literal["EUR", "USD", "GBP"]
+    sku: str = Field(pattern="^SKU-[0-9]+$", max_length=16)
+    quantity: Optional[int] = Field(None, ge=1, le=100)
+    coupons: Optional[List[str]] = Field(None, max_length=5)
+
+class PageViewMetadata(BaseModel):
+    page: str = Field(max_length=200)
+    referrer: Optional[str] = None
+    load_ms: Optional[int] = Field(None, ge=0)
+
+MODELS = {"purchase": PurchaseMetadata, "page_view": PageViewMetadata}
+
+def generate(events: int, seed: int = 42) -> dict:
+    rng = random.Random(seed)
+    payload = []
+    for i in range(events):
+        if rng.random() < 0.3:
+            metadata = {
+                "amount": round(rng.uniform(1, 500), 2),
+                "currency": rng.choice(["EUR", "USD", "GBP"]),
+                "sku": f"SKU-{rng.randrange(10_000)}",
+                "quantity": rng.randrange(1, 5),
+                "coupons": ["SPRING"] if rng.random() < 0.2 else [],
+            }
+            payload.append({"event_type": "purchase", "user_id": i % 5000, "event_metadata": metadata})
+        else:
+            metadata = {"page": f"/products/{rng.randrange(500)}", "referrer": None, "load_ms": rng.randrange(2000)}
+            payload.append({"event_type": "page_view", "user_id": i % 5000, "event_metadata": metadata})
+    return {"events": payload}
+
+def best_of(func) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    payload = generate(events)
+    validators = {name: compile_schema(schema) for name, schema in SCHEMAS.items()}
+
+    def request_model():
+        return EventBatch.model_validate(payload)
+
+    def with_pydantic():
+        batch = EventBatch.model_validate(payload)
+        for event in batch.events:
+            MODELS[event.event_type].model_validate(event.event_metadata)
+
+    def with_compiled():
+        batch = EventBatch.model_validate(payload)
+        for event in batch.events:
+            assert not validators[event.event_type](event.event_metadata)
+
+    baseline = best_of(request_model)
+    pydantic_total = best_of(with_pydantic)
+    compiled_total = best_of(with_compiled)
+
+    print(f"{events} events (30% purchase, 70% page_view)")
+    print(f"{'path':>28} {'events/s':>12} {'metadata us/event':>18}")
+    print(f"{'EventBatch only':>28} {events / baseline:>12,.0f} {'-':>18}")
+    for name, total in (("+ Pydantic metadata models", pydantic_total), ("+ compiled schemas", compiled_total)):
+        print(f"{name:>28} {events / total:>12,.0f} {(total - baseline) / events * 1e6:>18.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Throughput scaling of the ingest and summary paths from 1 to N workers.
+
+For each worker count, starts the service under gunicorn (as in the Docker image)
+and drives POST /analytics/events and GET /analytics/summary with concurrent
+clients for a fixed duration, then checks that /metrics counts every request
+across all workers.
+
+Usage (from analytics-service/, against a migrated Postgres database):
+    DATABASE_URL=postgresql://... python -m benchmarks.worker_scaling [max_workers] [seconds]
+
+SQLite works for a smoke run, but serialises writers, so ingest will not scale.
+"""
+import asyncio
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+PORT = int(os.getenv("BENCH_PORT", "8102"))
+BASE_URL = f"http://127.0.0.1:{PORT}"
+# Keep below the connection pool size (DB_POOL_SIZE + DB_MAX_OVERFLOW) per worker:
+# the handlers make blocking DB calls on the event loop.
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "8"))
+
+async def drive(path: str, seconds: float) -> int:
+    """Run CONCURRENCY clients against one path; returns completed requests"""
+    completed = 0
+    deadline = time.monotonic() + seconds
+
+    async def client_loop(client: httpx.AsyncClient):
+        nonlocal completed
+        while time.monotonic() < deadline:
+            if path == "/analytics/events":
+                response = await client.post(path, json={
+                    "event_type": "bench", "user_id": completed % 1000, "event_metadata": {}
+                })
+            else:
+                response = await client.get(path)
+            response.raise_for_status()
+            completed += 1
+
+    limits = httpx.Limits(max_connections=CONCURRENCY)
+    async with httpx.AsyncClient(base_url=BASE_URL, limits=limits, timeout=30.0) as client:
+        await asyncio.gather(*(client_loop(client) for _ in range(CONCURRENCY)))
+    return completed
+
+def scraped_request_count(path: str) -> int:
+    metrics = httpx.get(f"{BASE_URL}/metrics").text
+    pattern = rf'http_requests_total\{{[^}}]*handler="{re.escape(path)}"[^}}]*\}} ([0-9.e+]+)'
+    return int(sum(float(value) for value in re.findall(pattern, metrics)))
+
+def wait_until_ready(workers: int, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            # Every worker must be warm before measuring
+            if all(httpx.get(f"{BASE_URL}/ready").status_code == 200 for _ in range(workers * 4)):
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("service did not become ready")
+
+def main():
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/scaling.db")
+    env.setdefault("USER_SERVICE_URL", "http://127.0.0.1:9")
+    env["PORT"] = str(PORT)
+    subprocess.run(["alembic", "upgrade", "head"], env=env, check=True, capture_output=True)
+
+    print(f"{'workers':>7} {'ingest req/s':>13} {'summary req/s':>14} {'/metrics ok':>12}")
+    for workers in range(1, max_workers + 1):
+        env["WEB_CONCURRENCY"] = str(workers)
+        env["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "app.main:app", "-c", "gunicorn.conf.py"],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_until_ready(workers)
+            ingested = asyncio.run(drive("/analytics/events", seconds))
+            summaries = asyncio.run(drive("/analytics/summary", seconds))
+            metrics_ok = scraped_request_count("/analytics/events") == ingested
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{workers:>7} {ingested / seconds:>13.0f} {summaries / seconds:>14.0f} {str(metrics_ok):>12}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""Gunicorn settings for running `WEB_CONCURRENCY` uvicorn workers behind one port.
+
+Prometheus metrics are written per worker to PROMETHEUS_MULTIPROC_DIR and
+aggregated across all workers when /metrics is scraped.
+"""
+import os
+import shutil
+
+from prometheus_client import multiprocess
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8001')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+graceful_timeout = 30
+
+def on_starting(server):
+    """Start from an empty metrics directory so files from a previous run are not summed"""
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+def child_exit(server, worker):
+    """Drop live gauges of a dead worker; its counters keep contributing to totals"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
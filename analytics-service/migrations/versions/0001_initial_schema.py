@@ -0,0 +1,42 @@
+"""Initial schema: events table
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19
+
+Databases created by the old startup-time ``create_all`` already have this table;
+it is left untouched so they can be brought under migration control.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if sa.inspect(op.get_bind()).has_table("events"):
+        return
+
+    op.create_table(
+        "events",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("event_type", sa.String(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("event_metadata", sa.JSON(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    )
+    op.create_index("ix_events_id", "events", ["id"])
+    op.create_index("ix_events_event_type", "events", ["event_type"])
+    op.create_index("ix_events_user_id", "events", ["user_id"])
+    op.create_index("ix_events_created_at", "events", ["created_at"])
+
+
+def downgrade() -> None:
+    op.drop_table("events")
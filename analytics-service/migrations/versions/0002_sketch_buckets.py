@@ -0,0 +1,36 @@
+"""Per-bucket heavy-hitter sketches
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sketch_buckets",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("dimension", sa.String(), nullable=False),
+        sa.Column("bucket_start", sa.DateTime(), nullable=False),
+        sa.Column("node_id", sa.String(), nullable=False),
+        sa.Column("payload", sa.JSON(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.UniqueConstraint("dimension", "bucket_start", "node_id", name="uq_sketch_buckets_node"),
+    )
+    op.create_index("ix_sketch_buckets_dimension_bucket", "sketch_buckets", ["dimension", "bucket_start"])
+
+
+def downgrade() -> None:
+    op.drop_table("sketch_buckets")
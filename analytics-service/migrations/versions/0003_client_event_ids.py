@@ -0,0 +1,30 @@
+"""Client-supplied event ids for idempotent ingestion
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("events") as batch_op:
+        batch_op.add_column(sa.Column("client_event_id", sa.String(), nullable=True))
+        batch_op.create_index("ix_events_client_event_id", ["client_event_id"], unique=True)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("events") as batch_op:
+        batch_op.drop_index("ix_events_client_event_id")
+        batch_op.drop_column("client_event_id")
@@ -0,0 +1,63 @@
+"""Dictionary-encode event types
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19
+
+Moves the distinct event type names into ``event_types`` and replaces
+``events.event_type`` with a small integer code referencing it.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+code_type = sa.SmallInteger().with_variant(sa.Integer(), "sqlite")
+
+
+def upgrade() -> None:
+    op.create_table(
+        "event_types",
+        sa.Column("id", code_type, primary_key=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.UniqueConstraint("name"),
+    )
+    op.execute("INSERT INTO event_types (name) SELECT DISTINCT event_type FROM events ORDER BY event_type")
+
+    with op.batch_alter_table("events") as batch_op:
+        batch_op.add_column(sa.Column("event_type_id", code_type, nullable=True))
+    op.execute(
+        "UPDATE events SET event_type_id = "
+        "(SELECT event_types.id FROM event_types WHERE event_types.name = events.event_type)"
+    )
+
+    with op.batch_alter_table("events") as batch_op:
+        batch_op.alter_column("event_type_id", existing_type=code_type, nullable=False)
+        batch_op.create_foreign_key("fk_events_event_type_id", "event_types", ["event_type_id"], ["id"])
+        batch_op.create_index("ix_events_event_type_id", ["event_type_id"])
+        batch_op.drop_index("ix_events_event_type")
+        batch_op.drop_column("event_type")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("events") as batch_op:
+        batch_op.add_column(sa.Column("event_type", sa.String(), nullable=True))
+    op.execute(
+        "UPDATE events SET event_type = "
+        "(SELECT event_types.name FROM event_types WHERE event_types.id = events.event_type_id)"
+    )
+
+    with op.batch_alter_table("events") as batch_op:
+        batch_op.alter_column("event_type", existing_type=sa.String(), nullable=False)
+        batch_op.create_index("ix_events_event_type", ["event_type"])
+        batch_op.drop_index("ix_events_event_type_id")
+        batch_op.drop_constraint("fk_events_event_type_id", type_="foreignkey")
+        batch_op.drop_column("event_type_id")
+    op.drop_table("event_types")
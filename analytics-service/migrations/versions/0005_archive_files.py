@@ -0,0 +1,37 @@
+"""Manifest of archived Parquet event files
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "archive_files",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("path", sa.String(), nullable=False),
+        sa.Column("min_created_at", sa.DateTime(), nullable=False),
+        sa.Column("max_created_at", sa.DateTime(), nullable=False),
+        sa.Column("row_count", sa.Integer(), nullable=False),
+        sa.Column("size_bytes", sa.Integer(), nullable=False),
+        sa.Column("archived_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.UniqueConstraint("path"),
+    )
+    op.create_index("ix_archive_files_range", "archive_files", ["min_created_at", "max_created_at"])
+
+
+def downgrade() -> None:
+    op.drop_table("archive_files")
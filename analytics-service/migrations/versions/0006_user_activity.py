@@ -0,0 +1,68 @@
+"""Per-user activity profiles
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19
+
+Profiles are backfilled from the events still in the table; per-day counts only
+for the last 30 days.
+"""
+from datetime import datetime, timedelta
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+code_type = sa.SmallInteger().with_variant(sa.Integer(), "sqlite")
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user_activity",
+        sa.Column("user_id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("first_seen", sa.DateTime(), nullable=False),
+        sa.Column("last_seen", sa.DateTime(), nullable=False),
+        sa.Column("total_events", sa.Integer(), nullable=False),
+    )
+    op.create_index("ix_user_activity_last_seen", "user_activity", ["last_seen"])
+    op.create_table(
+        "user_activity_type_counts",
+        sa.Column("user_id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("event_type_id", code_type, sa.ForeignKey("event_types.id"), primary_key=True,
+                  autoincrement=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+    )
+    op.create_table(
+        "user_activity_days",
+        sa.Column("user_id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("day", sa.Date(), primary_key=True),
+        sa.Column("count", sa.Integer(), nullable=False),
+    )
+    op.create_index("ix_user_activity_days_day", "user_activity_days", ["day"])
+
+    op.execute(
+        "INSERT INTO user_activity (user_id, first_seen, last_seen, total_events) "
+        "SELECT user_id, MIN(created_at), MAX(created_at), COUNT(*) FROM events GROUP BY user_id"
+    )
+    op.execute(
+        "INSERT INTO user_activity_type_counts (user_id, event_type_id, count) "
+        "SELECT user_id, event_type_id, COUNT(*) FROM events GROUP BY user_id, event_type_id"
+    )
+    op.get_bind().execute(sa.text(
+        "INSERT INTO user_activity_days (user_id, day, count) "
+        "SELECT user_id, DATE(created_at), COUNT(*) FROM events WHERE created_at >= :since "
+        "GROUP BY user_id, DATE(created_at)"
+    ), {"since": datetime.utcnow() - timedelta(days=30)})
+
+
+def downgrade() -> None:
+    op.drop_table("user_activity_days")
+    op.drop_table("user_activity_type_counts")
+    op.drop_table("user_activity")
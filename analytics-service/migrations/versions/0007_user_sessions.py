@@ -0,0 +1,37 @@
+"""Closed user sessions
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19
+
+Existing events are sessionized with `python -m app.sessions backfill`.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user_sessions",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("started_at", sa.DateTime(), nullable=False),
+        sa.Column("ended_at", sa.DateTime(), nullable=False),
+        sa.Column("duration_seconds", sa.Float(), nullable=False),
+        sa.Column("event_count", sa.Integer(), nullable=False),
+    )
+    op.create_index("ix_user_sessions_user_ended", "user_sessions", ["user_id", "ended_at"])
+    op.create_index("ix_user_sessions_started_at", "user_sessions", ["started_at"])
+
+
+def downgrade() -> None:
+    op.drop_table("user_sessions")
@@ -0,0 +1,39 @@
+"""Per-bucket numeric sketches of metadata fields
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0008"
+down_revision: Union[str, None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+code_type = sa.SmallInteger().with_variant(sa.Integer(), "sqlite")
+
+
+def upgrade() -> None:
+    op.create_table(
+        "metric_buckets",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("event_type_id", code_type, sa.ForeignKey("event_types.id"), nullable=False),
+        sa.Column("field", sa.String(), nullable=False),
+        sa.Column("bucket_start", sa.DateTime(), nullable=False),
+        sa.Column("node_id", sa.String(), nullable=False),
+        sa.Column("payload", sa.JSON(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.UniqueConstraint("event_type_id", "field", "bucket_start", "node_id", name="uq_metric_buckets_node"),
+    )
+    op.create_index("ix_metric_buckets_field_bucket", "metric_buckets", ["field", "bucket_start"])
+
+
+def downgrade() -> None:
+    op.drop_table("metric_buckets")
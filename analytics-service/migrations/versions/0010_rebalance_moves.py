@@ -0,0 +1,30 @@
+"""Journal of events copied by the shard rebalancer
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0010"
+down_revision: Union[str, None] = "0009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "rebalance_moves",
+        sa.Column("source", sa.String(), primary_key=True),
+        sa.Column("source_event_id", sa.Integer(), primary_key=True, autoincrement=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("rebalance_moves")
@@ -0,0 +1,30 @@
+"""Journal of users whose profiles and sessions the shard rebalancer copied
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0011"
+down_revision: Union[str, None] = "0010"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "rebalance_profile_moves",
+        sa.Column("source", sa.String(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), primary_key=True, autoincrement=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("rebalance_profile_moves")
@@ -0,0 +1,33 @@
+"""Inserting transaction id on events, for the change feed
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-19
+
+Existing rows get 0: they are all committed, so they come first in id order.
+On Postgres new rows default to pg_current_xact_id() (13+); it is set after
+adding the column because a volatile default in ADD COLUMN rewrites the table.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0012"
+down_revision: Union[str, None] = "0011"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("events", sa.Column("txid", sa.BigInteger(), nullable=False, server_default="0"))
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("ALTER TABLE events ALTER COLUMN txid SET DEFAULT pg_current_xact_id()::text::bigint")
+    op.create_index("ix_events_txid_id", "events", ["txid", "id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_events_txid_id", table_name="events")
+    op.drop_column("events", "txid")
@@ -0,0 +1,29 @@
+"""Index on the sampling hash of user_id, for sampled distinct-user counts
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0013"
+down_revision: Union[str, None] = "0012"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_events_user_hash", "events",
+        [sa.text("((user_id * 2654435761) % 4294967296)"), "created_at", "user_id"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_events_user_hash", table_name="events")
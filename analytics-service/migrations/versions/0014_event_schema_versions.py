@@ -0,0 +1,41 @@
+"""Unique metadata schema versions
+
+Revision ID: 0014
+Revises: 0013
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0014"
+down_revision: Union[str, None] = "0013"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    rows = connection.execute(sa.text(
+        "SELECT event_type_id, version FROM event_schemas ORDER BY version, event_type_id"
+    )).all()
+    if len({version for _, version in rows}) < len(rows):
+        # Concurrent saves could share a version: renumber above the old maximum,
+        # which also makes every worker reload
+        top = rows[-1][1]
+        for position, (event_type_id, _) in enumerate(rows, start=1):
+            connection.execute(
+                sa.text("UPDATE event_schemas SET version = :version WHERE event_type_id = :id"),
+                {"version": top + position, "id": event_type_id}
+            )
+    with op.batch_alter_table("event_schemas") as batch_op:
+        batch_op.create_unique_constraint("uq_event_schemas_version", ["version"])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("event_schemas") as batch_op:
+        batch_op.drop_constraint("uq_event_schemas_version", type_="unique")
@@ -0,0 +1,34 @@
+"""Archived event counts per day and event type
+
+Revision ID: 0015
+Revises: 0014
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0015"
+down_revision: Union[str, None] = "0014"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+code_type = sa.SmallInteger().with_variant(sa.Integer(), "sqlite")
+
+
+def upgrade() -> None:
+    # Files archived before this revision are counted by `python -m app.archive --recount`
+    op.create_table(
+        "archive_daily_counts",
+        sa.Column("day", sa.Date(), primary_key=True),
+        sa.Column("event_type_id", code_type, sa.ForeignKey("event_types.id"), primary_key=True),
+        sa.Column("count", sa.Integer(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("archive_daily_counts")
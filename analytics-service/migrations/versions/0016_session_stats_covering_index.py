@@ -0,0 +1,30 @@
+"""Cover the session stats columns in the started_at index of user_sessions
+
+Revision ID: 0016
+Revises: 0015
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0016"
+down_revision: Union[str, None] = "0015"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.drop_index("ix_user_sessions_started_at", table_name="user_sessions")
+    op.create_index(
+        "ix_user_sessions_started_at", "user_sessions", ["started_at"],
+        postgresql_include=["event_count", "duration_seconds"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_user_sessions_started_at", table_name="user_sessions")
+    op.create_index("ix_user_sessions_started_at", "user_sessions", ["started_at"])
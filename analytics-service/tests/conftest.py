@@ -4,8 +4,14 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
+from service_common import startup
+
+from app import aggregation, changes, event_schemas, heavy_hitters, metrics, sessions
+from app.dedup import deduplicator
+from app.event_types import event_types
 from app.main import app
 from app.database import Base, get_db
+from app.sharding import Shards, get_shards
 
 # Create in-memory SQLite database for testing
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
@@ -17,6 +23,17 @@ engine = create_engine(
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def reset_process_state():
+    """Forget the per-process caches and sketches, which would otherwise leak between tests"""
+    heavy_hitters.store.clear()
+    deduplicator.clear()
+    event_types.clear()
+    sessions.sessionizer.clear()
+    metrics.store.clear()
+    event_schemas.registry.clear()
+    changes.notifier.clear()
+    aggregation.plans.clear()
+
 @pytest.fixture
 def db_session():
     """Create a fresh database for each test"""
@@ -37,7 +54,20 @@ def client(db_session):
         finally:
             pass
 
+    def override_get_shards():
+        yield Shards(lambda: db_session, [None])
+
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_shards] = override_get_shards
+    reset_process_state()
     with TestClient(app) as test_client:
         yield test_client
+        reset_process_state()
     app.dependency_overrides.clear()
+
+@pytest.fixture
+def readiness(monkeypatch):
+    """Give each test its own readiness state"""
+    state = startup.Readiness()
+    monkeypatch.setattr(startup, "readiness", state)
+    return state
@@ -1,7 +1,22 @@
+import io
+import json
+import sqlite3
+
+import msgpack
+import pyarrow as pa
 import pytest
 from fastapi import status
 from datetime import datetime, timedelta
 
+from service_common import startup
+
+from app import heavy_hitters, metrics, models
+from app.dedup import deduplicator
+from app.event_types import event_types
+from app.sketches import HeavyHitterSketch
+from app.timebuckets import bucket_start
+from tests.conftest import engine
+
 def test_create_event(client):
     """Test creating an analytics event"""
     response = client.post(
@@ -20,6 +35,49 @@ def test_create_event(client):
     assert "id" in data
     assert "created_at" in data
 
+def test_create_event_is_idempotent(client):
+    """Resending an event with the same event_id returns the stored event"""
+    payload = {"event_type": "page_view", "user_id": 1, "event_id": "evt-1"}
+
+    first = client.post("/analytics/events", json=payload)
+    second = client.post("/analytics/events", json=payload)
+
+    assert first.status_code == status.HTTP_201_CREATED
+    assert second.status_code == status.HTTP_200_OK
+    assert second.json()["id"] == first.json()["id"]
+    assert second.json()["event_id"] == "evt-1"
+    assert len(client.get("/analytics/events").json()) == 1
+
+def test_create_event_duplicate_after_cache_reset(client):
+    """Duplicates are still caught by the database once the in-memory cache is gone"""
+    payload = {"event_type": "page_view", "user_id": 1, "event_id": "evt-1"}
+    first = client.post("/analytics/events", json=payload)
+
+    deduplicator.clear()
+    second = client.post("/analytics/events", json=payload)
+
+    assert second.status_code == status.HTTP_200_OK
+    assert second.json()["id"] == first.json()["id"]
+
+def test_create_events_batch(client):
+    """Batch ingest skips ids already stored and repeated within the batch"""
+    client.post("/analytics/events", json={"event_type": "click", "user_id": 1, "event_id": "a"})
+
+    response = client.post("/analytics/events/batch", json={"events": [
+        {"event_type": "click", "user_id": 1, "event_id": "a"},
+        {"event_type": "click", "user_id": 2, "event_id": "b"},
+        {"event_type": "click", "user_id": 2, "event_id": "b"},
+        {"event_type": "click", "user_id": 3},
+    ]})
+
+    assert response.status_code == status.HTTP_201_CREATED
+    data = response.json()
+    assert data["created"] == 2
+    assert data["duplicates"] == 2
+    assert data["ids"][1] == data["ids"][2]
+    assert len(set(data["ids"])) == 3
+    assert len(client.get("/analytics/events").json()) == 3
+
 def test_get_events(client):
     """Test retrieving events"""
     # Create some events
@@ -68,6 +126,68 @@ def test_get_events_with_filter(client):
     data = response.json()
     assert len(data) == 2
 
+def test_get_events_as_arrow(client):
+    """Test that event listings can be requested as an Arrow stream"""
+    for i in range(3):
+        client.post(
+            "/analytics/events",
+            json={"event_type": "page_view", "user_id": i + 1, "event_metadata": {"page": i}}
+        )
+
+    response = client.get("/analytics/events", headers={"Accept": "application/vnd.apache.arrow.stream"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.num_rows == 3
+    assert set(table["event_type"].to_pylist()) == {"page_view"}
+    assert sorted(json.loads(value)["page"] for value in table["event_metadata"].to_pylist()) == [0, 1, 2]
+
+def test_get_events_as_msgpack_and_export(client):
+    """Test MessagePack columns for listings and the export stream"""
+    for i in range(3):
+        client.post(
+            "/analytics/events",
+            json={"event_type": "user_login", "user_id": 7, "event_metadata": {}, "event_id": f"evt-{i}"}
+        )
+
+    response = client.get("/analytics/users/7/events", headers={"Accept": "application/msgpack"})
+    assert response.headers["content-type"] == "application/msgpack"
+    columns = msgpack.unpackb(response.content, timestamp=3)
+    assert sorted(columns["event_id"]) == ["evt-0", "evt-1", "evt-2"]
+    assert all(value.tzinfo is not None for value in columns["created_at"])
+
+    response = client.get("/analytics/events/export", headers={"Accept": "application/msgpack"})
+    chunks = list(msgpack.Unpacker(io.BytesIO(response.content), timestamp=3))
+    assert [len(chunk["id"]) for chunk in chunks] == [3]
+
+def test_json_remains_default_and_gzip_is_negotiated(client):
+    """Test unknown Accept types fall back to JSON, compressed only when asked"""
+    client.post(
+        "/analytics/events",
+        json={"event_type": "page_view", "user_id": 1, "event_metadata": {"padding": "x" * 2000}}
+    )
+
+    response = client.get("/analytics/events", headers={"Accept": "text/html", "Accept-Encoding": "identity"})
+    assert response.headers["content-type"] == "application/json"
+    assert "content-encoding" not in response.headers
+
+    response = client.get("/analytics/events", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.json()) == 1
+
+def test_event_types_are_dictionary_encoded(client, db_session):
+    """Test that events store type codes and decode types registered elsewhere"""
+    client.post("/analytics/events", json={"event_type": "page_view", "user_id": 1})
+    client.post("/analytics/events", json={"event_type": "page_view", "user_id": 2})
+
+    assert db_session.query(models.EventType).count() == 1
+    # Another worker's cache would not know the code yet
+    event_types.clear()
+    response = client.get("/analytics/events", params={"event_type": "page_view"})
+    assert [event["event_type"] for event in response.json()] == ["page_view", "page_view"]
+    assert client.get("/analytics/events", params={"event_type": "unknown"}).json() == []
+
 def test_get_analytics_summary(client):
     """Test getting analytics summary"""
     # Create test events
@@ -96,6 +216,8 @@ def test_get_analytics_summary(client):
     assert data["total_events"] == 3
     assert data["event_type_counts"]["user_login"] == 2
     assert data["event_type_counts"]["profile_updated"] == 1
+    # The user service is unreachable in tests, so users are counted from their profiles
+    assert data["total_users"] == 2
 
 def test_get_events_by_type(client):
     """Test getting event counts by type"""
@@ -145,6 +267,39 @@ def test_get_analytics_by_date_range(client):
     assert data["total_events"] == 2
     assert data["unique_users"] == 2
 
+def test_sampled_counts_are_scaled_with_intervals(client):
+    """?sample= estimates counts from a deterministic sample and reports intervals"""
+    events = [
+        {"event_type": "page_view" if i % 4 else "purchase", "user_id": i % 200, "event_metadata": {}}
+        for i in range(4000)
+    ]
+    client.post("/analytics/events/batch", json={"events": events})
+
+    by_type = client.get("/analytics/events/by-type", params={"sample": 0.2}).json()
+    assert by_type == client.get("/analytics/events/by-type", params={"sample": 0.2}).json()
+    exact = {"page_view": 3000, "purchase": 1000}
+    for row in by_type:
+        assert row["approximate"] is True
+        assert row["interval"]["low"] <= row["count"] <= row["interval"]["high"]
+        assert row["interval"]["low"] <= exact[row["event_type"]] <= row["interval"]["high"]
+
+    summary = client.get("/analytics/summary", params={"sample": 0.2}).json()
+    assert summary["approximate"] is True and summary["sample_rate"] == 0.2
+    assert summary["total_events_interval"]["low"] <= 4000 <= summary["total_events_interval"]["high"]
+    assert set(summary["event_type_intervals"]) == {"page_view", "purchase"}
+
+    date_range = client.get("/analytics/events/date-range", params={"sample": 0.5}).json()
+    assert date_range["approximate"] is True
+    assert date_range["unique_users_interval"]["low"] <= 200 <= date_range["unique_users_interval"]["high"]
+    assert date_range["total_events_interval"]["low"] <= 4000 <= date_range["total_events_interval"]["high"]
+
+    # A full sample is exact; without one nothing is marked approximate
+    full = client.get("/analytics/events/date-range", params={"sample": 1}).json()
+    assert full["total_events"] == 4000 and full["unique_users"] == 200
+    assert full["total_events_interval"] == {"low": 4000, "high": 4000}
+    assert client.get("/analytics/events/date-range").json()["approximate"] is False
+    assert client.get("/analytics/events/by-type", params={"sample": 0}).status_code == 422
+
 def test_get_user_events(client):
     """Test getting events for specific user"""
     # Create events for different users
@@ -167,12 +322,166 @@ def test_get_user_events(client):
     for event in data:
         assert event["user_id"] == 1
 
+def test_get_user_profile(client):
+    """Test that profiles are maintained on single and batch ingest"""
+    client.post("/analytics/events", json={"event_type": "user_login", "user_id": 1})
+    client.post("/analytics/events/batch", json={"events": [
+        {"event_type": "page_view", "user_id": 1},
+        {"event_type": "page_view", "user_id": 1},
+        {"event_type": "page_view", "user_id": 2},
+    ]})
+
+    response = client.get("/analytics/users/1/profile")
+
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["total_events"] == 3
+    assert data["event_type_counts"] == {"user_login": 1, "page_view": 2}
+    assert data["events_7d"] == 3
+    assert data["events_30d"] == 3
+    assert data["first_seen"] <= data["last_seen"]
+
+    assert client.get("/analytics/users/99/profile").status_code == status.HTTP_404_NOT_FOUND
+
+def test_max_batch_of_distinct_users_fits_parameter_limit(client, db_session):
+    """Test that a full batch of new users stays under SQLite's default 32,766 bound parameters"""
+    connection = db_session.connection().connection.driver_connection
+    limit = connection.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 32766)
+    try:
+        response = client.post("/analytics/events/batch", json={"events": [
+            {"event_type": "page_view", "user_id": user_id} for user_id in range(10000)
+        ]})
+    finally:
+        connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, limit)
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["created"] == 10000
+    assert client.get("/analytics/users/9999/profile").json()["total_events"] == 1
+
+def test_get_user_profiles_bulk(client):
+    """Test fetching several profiles in one request"""
+    for user_id in (1, 2):
+        client.post("/analytics/events", json={"event_type": "user_login", "user_id": user_id})
+
+    response = client.post("/analytics/users/profiles", json={"user_ids": [2, 99, 1]})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [profile["user_id"] for profile in response.json()] == [2, 1]
+
+def test_sessions_endpoints(client, db_session):
+    """Test session stats and per-user sessions combine stored and open sessions"""
+    now = datetime.utcnow()
+    db_session.add(models.UserSession(
+        user_id=1, started_at=now - timedelta(hours=3), ended_at=now - timedelta(hours=2, minutes=50),
+        duration_seconds=600, event_count=4
+    ))
+    db_session.commit()
+    for _ in range(2):
+        client.post("/analytics/events", json={"event_type": "page_view", "user_id": 1, "event_metadata": {}})
+
+    response = client.get("/analytics/users/1/sessions")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert [(item["event_count"], item["open"]) for item in data] == [(2, True), (4, False)]
+
+    stats = client.get("/analytics/sessions/stats").json()
+    assert stats["sessions"] == 2
+    assert stats["open_sessions"] == 1
+    assert stats["total_events"] == 6
+    assert stats["average_events_per_session"] == 3
+    assert stats["bounce_rate"] == 0
+
+def test_metric_aggregates(client, db_session):
+    """Test numeric metadata aggregates merge flushed and unflushed bucket sketches"""
+    for load_ms in range(1, 101):
+        client.post(
+            "/analytics/events",
+            json={"event_type": "page_view", "user_id": 1, "event_metadata": {"load_ms": load_ms, "ok": True}}
+        )
+        if load_ms == 50:
+            metrics.store.flush(db_session)
+    client.post("/analytics/events", json={"event_type": "click", "user_id": 1, "event_metadata": {"load_ms": 7}})
+
+    assert db_session.query(models.MetricBucket).count() == 1
+    response = client.get("/analytics/metrics", params={"field": "load_ms", "granularity": "total"})
+    assert response.status_code == status.HTTP_200_OK
+    groups = {group["event_type"]: group for group in response.json()["groups"]}
+    page_views = groups["page_view"]
+    assert (page_views["count"], page_views["sum"], page_views["min"], page_views["max"]) == (100, 5050, 1, 100)
+    assert abs(page_views["p50"] - 50) <= 1
+    assert abs(page_views["p99"] - 99) <= 2
+    assert groups["click"]["count"] == 1
+
+    response = client.get("/analytics/metrics", params={"field": "load_ms", "event_type": "click"})
+    assert [group["bucket_start"] is not None for group in response.json()["groups"]] == [True]
+    assert client.get("/analytics/metrics", params={"field": "ok"}).json()["groups"] == []
+
+def test_get_top_users(client):
+    """Test top users from the exact path and from the sketches agree"""
+    for user_id, count in [(1, 2), (2, 5), (3, 1)]:
+        for _ in range(count):
+            client.post(
+                "/analytics/events",
+                json={"event_type": "page_view", "user_id": user_id, "event_metadata": {}}
+            )
+
+    for mode in ["exact", "sketch"]:
+        response = client.get(f"/analytics/top-users?limit=2&mode={mode}")
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["approximate"] is (mode == "sketch")
+        assert [(u["user_id"], u["count"]) for u in data["users"]] == [(2, 5), (1, 2)]
+
+def test_get_top_event_types_from_flushed_sketches(client, db_session, monkeypatch):
+    """Test top event types merge sketches flushed to the database"""
+    monkeypatch.setattr(heavy_hitters, "SKETCH_FLUSH_SECONDS", 0)
+    for event_type, count in [("user_login", 3), ("profile_updated", 1)]:
+        for _ in range(count):
+            client.post(
+                "/analytics/events",
+                json={"event_type": event_type, "user_id": 1, "event_metadata": {}}
+            )
+    assert not heavy_hitters.store.dirty
+
+    # Another process's partial sketch for the same bucket
+    other = HeavyHitterSketch()
+    other.add("profile_updated", 4)
+    db_session.add(models.SketchBucket(
+        dimension=heavy_hitters.EVENT_TYPES,
+        bucket_start=bucket_start(datetime.utcnow(), heavy_hitters.SKETCH_BUCKET_SECONDS),
+        node_id="other",
+        payload=other.to_dict()
+    ))
+    db_session.commit()
+
+    response = client.get("/analytics/top-event-types?mode=sketch")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()["event_types"]
+    assert [(t["event_type"], t["count"]) for t in data] == [("profile_updated", 5), ("user_login", 3)]
+
 def test_health_check(client):
     """Test health check endpoint"""
     response = client.get("/health")
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == {"status": "healthy"}
 
+def test_readiness_before_warm_up(client, readiness):
+    """Test readiness probe fails until warm-up has completed"""
+    response = client.get("/ready")
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.json()["status"] == "warming_up"
+
+def test_readiness_after_warm_up(client, readiness):
+    """Test readiness probe succeeds once the pool and query cache are warm"""
+    assert startup.warm_up(engine) is True
+
+    response = client.get("/ready")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["status"] == "ready"
+    assert data["cold_start_seconds"] > 0
+
 def test_event_pagination(client):
     """Test event pagination"""
     # Create 15 events
@@ -0,0 +1,127 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import archive, models
+from app.event_types import event_types
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    return tmp_path
+
+def add_events(db, rows):
+    codes = event_types.encode(db, {event_type for event_type, _, _ in rows})
+    db.add_all([
+        models.Event(event_type_id=codes[event_type], user_id=user_id, event_metadata={"n": user_id},
+                     created_at=created_at)
+        for event_type, user_id, created_at in rows
+    ])
+    db.commit()
+
+def test_archive_events_moves_old_rows(client, db_session, archive_dir):
+    """Test that old events move to daily Parquet files listed in the manifest"""
+    now = datetime.utcnow()
+    add_events(db_session, [
+        ("login", 1, datetime(2024, 1, 1, 10)),
+        ("click", 2, datetime(2024, 1, 1, 12)),
+        ("login", 1, datetime(2024, 1, 2, 9)),
+        ("login", 3, now),
+    ])
+
+    assert archive.archive_events(db_session, now - timedelta(days=30)) == 3
+
+    assert db_session.query(models.Event).count() == 1
+    entries = db_session.query(models.ArchiveFile).order_by(models.ArchiveFile.min_created_at).all()
+    assert [entry.path.split("/")[0] for entry in entries] == ["date=2024-01-01", "date=2024-01-02"]
+    assert [entry.row_count for entry in entries] == [2, 1]
+    assert entries[0].max_created_at == datetime(2024, 1, 1, 12)
+    assert all((archive_dir / entry.path).exists() for entry in entries)
+
+def test_files_for_range_prunes_by_manifest(client, db_session, archive_dir):
+    """Test that only files overlapping the window are read"""
+    add_events(db_session, [("login", 1, datetime(2024, 1, day, 12)) for day in (1, 2, 3)])
+    archive.archive_events(db_session, datetime(2024, 2, 1))
+
+    entries = archive.files_for_range(db_session, datetime(2024, 1, 2), datetime(2024, 1, 2, 23))
+    assert [entry.path.split("/")[0] for entry in entries] == ["date=2024-01-02"]
+
+def test_date_range_and_export_include_archived_events(client, db_session, archive_dir):
+    """Test that date-range analytics and export merge hot and cold events"""
+    now = datetime.utcnow()
+    add_events(db_session, [
+        ("login", 1, now - timedelta(days=5)),
+        ("click", 2, now - timedelta(days=5)),
+        ("login", 1, now - timedelta(hours=1)),
+        ("login", 3, now - timedelta(hours=1)),
+    ])
+    archive.archive_events(db_session, now - timedelta(days=1))
+
+    response = client.get("/analytics/events/date-range")
+    data = response.json()
+    assert data["total_events"] == 4
+    assert data["unique_users"] == 3
+    assert data["event_breakdown"] == {"login": 3, "click": 1}
+
+    response = client.get("/analytics/events/export")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["user_id"] for event in events] == [1, 2, 1, 3]
+    assert events[0]["event_metadata"] == {"n": 1}
+    assert events[0]["event_type"] == "login"
+
+def test_totals_include_archived_events(client, db_session, archive_dir):
+    """Test that summary and by-type counts add the archived events to the hot tier"""
+    now = datetime.utcnow()
+    add_events(db_session, [
+        ("login", 1, datetime(2024, 1, 1, 10)),
+        ("click", 2, datetime(2024, 1, 1, 12)),
+        ("login", 1, datetime(2024, 1, 2, 9)),
+        ("login", 3, now),
+    ])
+    archive.archive_events(db_session, now - timedelta(days=30), file_rows=1)
+
+    summary = client.get("/analytics/summary").json()
+    assert summary["total_events"] == 4
+    assert summary["event_type_counts"] == {"login": 3, "click": 1}
+    counts = {row["event_type"]: row["count"] for row in client.get("/analytics/events/by-type").json()}
+    assert counts == {"login": 3, "click": 1}
+
+    # Archived counts stay exact when the hot tier is sampled
+    sampled = client.get("/analytics/summary", params={"sample": 0.5}).json()
+    assert sampled["total_events_interval"]["low"] >= 3
+
+    # The daily counts can be rebuilt from the files
+    db_session.query(models.ArchiveDailyCount).delete()
+    db_session.commit()
+    assert archive.recount(db_session) == 3
+    assert sorted((row.day.day, row.count) for row in db_session.query(models.ArchiveDailyCount)) == [
+        (1, 1), (1, 1), (2, 1)
+    ]
+
+def test_export_orders_by_created_at_across_files_and_tiers(client, db_session, archive_dir):
+    """Test that export is ordered by created_at even where ids are not"""
+    day = datetime(2024, 1, 1)
+    add_events(db_session, [("login", hour, day + timedelta(hours=hour)) for hour in (12, 10, 11)])
+    # Two files for the day with interleaved spans: ids 1-2 (10:00-12:00) and id 3 (11:00)
+    archive.archive_events(db_session, datetime(2024, 2, 1), file_rows=2)
+    # Backfilled after archiving: a new id, older than the archived rows
+    add_events(db_session, [("login", 9, day + timedelta(hours=9))])
+
+    events = [json.loads(line) for line in client.get("/analytics/events/export").text.splitlines()]
+    assert [event["user_id"] for event in events] == [9, 10, 11, 12]
+
+def test_retry_after_archiving_is_stored_again(client, db_session, archive_dir):
+    """Test that a cached event id whose row was archived does not break a retry"""
+    event = {"event_type": "login", "user_id": 1, "event_id": "retry-1"}
+    first = client.post("/analytics/events", json=event)
+    assert first.status_code == 201
+
+    archive.archive_events(db_session, datetime.utcnow() + timedelta(days=1))
+    assert db_session.query(models.Event).count() == 0
+
+    retry = client.post("/analytics/events", json=event)
+    assert retry.status_code == 201
+    assert retry.json()["event_id"] == "retry-1"
+    assert client.post("/analytics/events", json=event).json()["id"] == retry.json()["id"]
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import changes, models
+from app.changes import format_cursor, merge, parse_cursor, read
+
+Row = namedtuple("Row", "id created_at txid", defaults=[0])
+START = datetime(2026, 1, 1, 12, 0)
+
+def post(client, user_id):
+    return client.post("/analytics/events", json={"event_type": "click", "user_id": user_id})
+
+def test_feed_resumes_from_cursor(client):
+    for user_id in range(5):
+        post(client, user_id)
+
+    page = client.get("/analytics/events/changes", params={"limit": 3}).json()
+    assert [event["user_id"] for event in page["events"]] == [0, 1, 2]
+    assert page["has_more"] is True
+
+    # Events stored while paging are picked up after the cursor, never twice
+    post(client, 5)
+    page = client.get("/analytics/events/changes", params={"since": page["cursor"], "limit": 3}).json()
+    assert [event["user_id"] for event in page["events"]] == [3, 4, 5]
+    assert page["has_more"] is False
+
+    empty = client.get("/analytics/events/changes", params={"since": page["cursor"]}).json()
+    assert empty == {"events": [], "cursor": page["cursor"], "has_more": False}
+
+def test_invalid_cursor_is_rejected(client):
+    assert client.get("/analytics/events/changes", params={"since": "3:4.5:6"}).status_code == 400
+    assert client.get("/analytics/events/changes", params={"since": "3.4"}).status_code == 422
+    assert client.get("/analytics/events/changes", params={"since": "-1"}).status_code == 422
+
+def test_feed_follows_inserting_transactions(db_session):
+    # Id 2 was allocated first by a transaction that committed later, so it comes after ids 1 and 3
+    db_session.add_all([
+        models.EventType(id=1, name="click"),
+        models.Event(id=1, event_type_id=1, user_id=1, created_at=START, txid=5),
+        models.Event(id=2, event_type_id=1, user_id=1, created_at=START, txid=7),
+        models.Event(id=3, event_type_id=1, user_id=1, created_at=START, txid=5),
+    ])
+    db_session.commit()
+
+    rows, more = read(db_session, (0, 0), 2)
+    assert [row.id for row in rows] == [1, 3] and more is True
+    rows, more = read(db_session, (5, 3), 2)
+    assert [row.id for row in rows] == [2] and more is False
+
+def test_merge_takes_oldest_prefix_of_each_shard():
+    minute = timedelta(minutes=1)
+    shard_a = [Row(10, START), Row(11, START + 3 * minute)]
+    shard_b = [Row(4, START + minute), Row(5, START + 2 * minute), Row(6, START + 4 * minute)]
+    rows, last_positions = merge([shard_a, shard_b, []], 3)
+    assert [row.id for row in rows] == [10, 4, 5]
+    assert last_positions == [(0, 10), (0, 5), None]
+
+    # A shard's rows are taken in feed order, whatever their timestamps, and a call always progresses
+    rows, last_positions = merge([[Row(1, START + 5 * minute), Row(2, START)]], 1)
+    assert [row.id for row in rows] == [1] and last_positions == [(0, 1)]
+
+    assert parse_cursor("0", 3) == [(0, 0)] * 3
+    assert format_cursor(parse_cursor("7:1.0:0.9:12", 3)) == "7:1.0:0.9:12"
+    with pytest.raises(ValueError):
+        parse_cursor("7:1", 2)
+    with pytest.raises(ValueError):
+        parse_cursor("7", 1)
+
+def test_merge_progresses_when_ids_and_timestamps_disagree():
+    minute = timedelta(minutes=1)
+    # On both shards the first row in feed order is the newer event (long transactions, skewed clocks)
+    shard_a = [Row(1, START + 5 * minute), Row(2, START)]
+    shard_b = [Row(1, START + 6 * minute), Row(2, START + minute)]
+    rows, last_positions = merge([shard_a, shard_b], 2)
+    assert [(row.id, row.created_at) for row in rows] == [(1, START + 5 * minute), (2, START)]
+    assert last_positions == [(0, 2), None]
+
+    rows, last_positions = merge([shard_a[2:], shard_b], 2)
+    assert [row.id for row in rows] == [1, 2] and last_positions == [None, (0, 2)]
+
+def test_long_poll_is_woken_by_ingest(client, monkeypatch):
+    # Far above the test duration, so only the ingest notification can end the wait early
+    monkeypatch.setattr(changes, "CHANGES_POLL_SECONDS", 30)
+    responses = []
+
+    def consume():
+        responses.append(client.get("/analytics/events/changes", params={"wait": 10}).json())
+    consumer = threading.Thread(target=consume)
+    started = time.monotonic()
+    consumer.start()
+    time.sleep(0.3)
+    assert responses == []
+
+    post(client, 42)
+    consumer.join(5)
+    assert time.monotonic() - started < 5
+    assert [event["user_id"] for event in responses[0]["events"]] == [42]
+
+def test_long_poll_times_out_empty(client):
+    started = time.monotonic()
+    response = client.get("/analytics/events/changes", params={"wait": 0.2}).json()
+    assert response == {"events": [], "cursor": "0:0", "has_more": False}
+    assert time.monotonic() - started >= 0.2
@@ -0,0 +1,30 @@
+from app.dedup import BloomFilter, Deduplicator
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"key-{i}")
+
+    assert all(f"key-{i}" in bloom for i in range(1000))
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+def test_deduplicator_lru_evicts_oldest():
+    dedup = Deduplicator(capacity=100, error_rate=0.01, lru_size=2)
+    dedup.remember("a", 1)
+    dedup.remember("b", 2)
+    dedup.cached("a")
+    dedup.remember("c", 3)
+
+    assert dedup.cached("a") == 1
+    assert dedup.cached("b") is None
+    assert dedup.might_contain("b")
+
+def test_deduplicator_keeps_previous_generation():
+    dedup = Deduplicator(capacity=2, error_rate=0.01, lru_size=1)
+    dedup.remember("a", 1)
+    dedup.remember("b", 2)
+    dedup.remember("c", 3)
+
+    assert dedup.might_contain("a")
+    assert dedup.might_contain("c")
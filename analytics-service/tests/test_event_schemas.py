@@ -0,0 +1,134 @@
+import pytest
+from fastapi import status
+
+from app import event_schemas, models
+from app.event_schemas import SchemaError, SchemaRegistry, compile_schema
+from app.schemas import EventCreate
+
+PURCHASE = {
+    "type": "object",
+    "properties": {
+        "amount": {"type": "number", "minimum": 0},
+        "currency": {"type": "string", "enum": ["EUR", "USD"]},
+        "sku": {"type": "string", "pattern": "^SKU-[0-9]+$", "maxLength": 12},
+        "coupons": {"type": "array", "items": {"type": "string"}, "maxItems": 2},
+        "gift": {"type": "boolean"},
+    },
+    "required": ["amount", "currency"],
+    "additionalProperties": False,
+}
+
+def test_compiled_validator_reports_every_violation():
+    validate = compile_schema(PURCHASE)
+    assert validate({"amount": 12.5, "currency": "EUR", "sku": "SKU-1", "coupons": ["A"], "gift": False}) == []
+
+    errors = validate({"amount": -1, "sku": "X-1", "coupons": ["A", 2, "C"], "gift": 1, "note": "hi"})
+    assert "event_metadata.currency: required" in errors
+    assert "event_metadata.amount: must be >= 0" in errors
+    assert "event_metadata.sku: must match '^SKU-[0-9]+$'" in errors
+    assert "event_metadata.coupons[1]: expected string" in errors
+    assert "event_metadata.coupons: item count must be <= 2" in errors
+    assert "event_metadata.gift: expected boolean" in errors
+    assert "event_metadata: unexpected field 'note'" in errors
+    assert len(errors) == 7
+
+    # Booleans are not numbers, missing metadata is an empty object
+    assert compile_schema({"properties": {"n": {"type": "integer"}}})({"n": True}) == ["event_metadata.n: expected integer"]
+    assert validate(None) == ["event_metadata.amount: required", "event_metadata.currency: required"]
+
+    nested = compile_schema({"properties": {"lines": {"type": "array", "items": {
+        "properties": {"qty": {"type": "integer", "minimum": 1}}, "required": ["qty"]
+    }}}})
+    assert nested({"lines": [{"qty": 0}, {}]}) == ["event_metadata.lines[0].qty: must be >= 1",
+                                                  "event_metadata.lines[1].qty: required"]
+    assert compile_schema({})({"anything": 1}) == []
+
+def test_enum_members_match_by_json_value():
+    validate = compile_schema({"properties": {"n": {"enum": [1, "a", [1, "b"]]}}})
+    assert validate({"n": 1}) == validate({"n": 1.0}) == validate({"n": "a"}) == validate({"n": [1.0, "b"]}) == []
+    # Booleans are not numbers, even though True == 1 in Python
+    assert validate({"n": True}) == ["event_metadata.n: must be one of [1, 'a', [1, 'b']]"]
+    assert validate({"n": [True, "b"]}) != []
+    assert compile_schema({"properties": {"b": {"enum": [False]}}})({"b": 0}) != []
+
+@pytest.mark.parametrize("schema", [
+    {"type": "array"},
+    {"type": "object", "properties": {"a": {"type": "decimal"}}},
+    {"type": "object", "properties": {"a": {"oneOf": []}}},
+    {"type": "object", "additionalProperties": {"type": "string"}},
+    {"type": "object", "properties": {"a": {"pattern": "("}}},
+])
+def test_unsupported_schemas_are_rejected(schema):
+    with pytest.raises(SchemaError):
+        compile_schema(schema)
+
+def test_registry_reloads_changed_schemas(db_session, monkeypatch):
+    monkeypatch.setattr(event_schemas, "SCHEMA_RELOAD_SECONDS", 0)
+    worker = SchemaRegistry()
+    worker.load(db_session)
+    event = EventCreate(event_type="purchase", user_id=1, event_metadata={"amount": 1})
+    assert worker.validate(db_session, [event]) == []
+
+    event_schemas.save(db_session, "purchase", PURCHASE)
+    assert worker.validate(db_session, [event])[0]["errors"] == ["event_metadata.currency: required"]
+    compiled = worker.validators["purchase"]
+
+    # Unchanged rows keep their compiled validator
+    event_schemas.save(db_session, "refund", {"type": "object"})
+    worker.reload_if_due(db_session)
+    assert worker.validators["purchase"] is compiled
+
+    event_schemas.delete(db_session, "purchase")
+    assert worker.validate(db_session, [event]) == []
+
+def test_save_retries_when_a_concurrent_save_takes_its_version(db_session, monkeypatch):
+    event_schemas.save(db_session, "purchase", PURCHASE)
+    next_version = event_schemas._next_version
+    calls = []
+
+    def stale_version(db):
+        # The first attempt computes its version before the other save committed
+        calls.append(1)
+        return 1 if len(calls) == 1 else next_version(db)
+
+    monkeypatch.setattr(event_schemas, "_next_version", stale_version)
+    row = event_schemas.save(db_session, "refund", {"type": "object"})
+    assert len(calls) == 2
+    assert row.version == 2
+    assert sorted(version for version, in db_session.query(models.EventSchema.version)) == [1, 2]
+
+def test_ingest_applies_registered_schemas(client):
+    response = client.put("/analytics/event-schemas/purchase", json=PURCHASE)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["version"] == 1
+    assert client.get("/analytics/event-schemas").json()[0]["metadata_schema"] == PURCHASE
+
+    valid = {"event_type": "purchase", "user_id": 1, "event_metadata": {"amount": 5, "currency": "USD"}}
+    invalid = {"event_type": "purchase", "user_id": 2, "event_metadata": {"amount": "5", "currency": "USD"}}
+    assert client.post("/analytics/events", json=valid).status_code == 201
+
+    response = client.post("/analytics/events", json=invalid)
+    assert response.status_code == 422
+    assert response.json()["detail"] == [
+        {"index": 0, "event_type": "purchase", "errors": ["event_metadata.amount: expected number"]}
+    ]
+
+    # One bad event rejects the whole batch
+    response = client.post("/analytics/events/batch", json={"events": [valid, invalid]})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["index"] == 1
+    assert client.get("/analytics/summary").json()["total_events"] == 1
+
+    assert client.put("/analytics/event-schemas/purchase", json={"type": "object", "anyOf": []}).status_code == 400
+    assert client.delete("/analytics/event-schemas/purchase").status_code == 204
+    assert client.get("/analytics/event-schemas/purchase").status_code == 404
+    assert client.post("/analytics/events", json=invalid).status_code == 201
+
+def test_strict_mode_rejects_unknown_types(client, monkeypatch):
+    monkeypatch.setattr(event_schemas, "SCHEMA_ALLOW_UNKNOWN_TYPES", False)
+    client.put("/analytics/event-schemas/purchase", json={"type": "object"})
+
+    assert client.post("/analytics/events", json={"event_type": "purchase", "user_id": 1}).status_code == 201
+    response = client.post("/analytics/events", json={"event_type": "page_view", "user_id": 1})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["errors"] == ["no metadata schema is registered for this event type"]
@@ -0,0 +1,86 @@
+import asyncio
+
+from fastapi import status
+
+from service_common.load_shedding import AdaptiveLimit, LoadShedder, LoadSheddingMiddleware
+
+from app.main import classify_request, load_shedder
+
+def test_adaptive_limit_backs_off_when_latency_rises():
+    """Test that the limit grows while latency is flat and shrinks when it degrades"""
+    limit = AdaptiveLimit(10, max_limit=100)
+    for _ in range(8):
+        assert limit.try_acquire()
+    for _ in range(50):
+        limit.release(0.01)
+        assert limit.try_acquire()
+    grown = limit.limit
+    assert grown > 10
+
+    for _ in range(20):
+        limit.try_acquire()
+        limit.release(1.0)
+    assert limit.limit < grown
+
+def test_low_share_classes_are_shed_first():
+    """Test that heavy aggregates are rejected before ingest when the cap fills up"""
+    shedder = LoadShedder({"ingest": 1.0, "heavy": 0.5}, max_concurrency=4)
+    assert shedder.admit("heavy")
+    assert shedder.admit("ingest")
+    assert not shedder.admit("heavy")
+    assert shedder.admit("ingest")
+    assert shedder.admit("ingest")
+    assert not shedder.admit("ingest")
+
+def test_streamed_body_is_not_counted_as_latency():
+    """Test that a slow download is timed to its first byte, not to completion"""
+    latencies = []
+
+    class RecordingShedder(LoadShedder):
+        def release(self, route_class, latency, failed):
+            latencies.append(latency)
+            super().release(route_class, latency, failed)
+
+    shedder = RecordingShedder({"heavy": 1.0}, max_concurrency=4)
+
+    async def streaming_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        for _ in range(3):
+            await asyncio.sleep(0.1)
+            await send({"type": "http.response.body", "body": b"chunk", "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        pass
+
+    middleware = LoadSheddingMiddleware(streaming_app, shedder, lambda method, path: "heavy")
+    asyncio.run(middleware({"type": "http", "method": "GET", "path": "/export"}, None, send))
+
+    assert len(latencies) == 1
+    assert latencies[0] < 0.1
+    assert shedder.in_flight == 0
+
+def test_routes_are_classified():
+    """Test that ad-hoc queries share the heavy aggregate budget"""
+    assert classify_request("POST", "/analytics/query") == "heavy"
+    assert classify_request("GET", "/analytics/summary") == "heavy"
+    assert classify_request("POST", "/analytics/events/batch") == "ingest"
+    assert classify_request("GET", "/analytics/events") == "reads"
+    assert classify_request("GET", "/analytics/events/changes") is None
+
+def test_overloaded_route_class_returns_503(client, monkeypatch):
+    """Test that requests over the class limit get a fast 503 with Retry-After"""
+    heavy = load_shedder.limits["heavy"]
+    monkeypatch.setattr(heavy, "in_flight", int(heavy.limit))
+
+    response = client.get("/analytics/summary")
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "1"
+
+    # Other classes and probes are unaffected
+    response = client.post(
+        "/analytics/events",
+        json={"event_type": "user_login", "user_id": 1, "event_metadata": {}}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert client.get("/health").status_code == status.HTTP_200_OK
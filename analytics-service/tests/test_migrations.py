@@ -0,0 +1,89 @@
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, text
+
+from app.database import Base
+
+def run_upgrade(url, revision="head"):
+    config = Config("alembic.ini")
+    config.set_main_option("sqlalchemy.url", url)
+    config.attributes["configure_logger"] = False
+    command.upgrade(config, revision)
+
+def test_migrations_match_models(tmp_path):
+    """Test that upgrading to head produces exactly the schema the models describe"""
+    url = f"sqlite:///{tmp_path / 'migrated.db'}"
+    run_upgrade(url)
+
+    engine = create_engine(url)
+    with engine.connect() as connection:
+        diff = compare_metadata(MigrationContext.configure(connection), Base.metadata)
+    engine.dispose()
+
+    assert diff == []
+
+def test_migrations_adopt_existing_schema(tmp_path):
+    """Test that databases created by the old startup create_all can be migrated"""
+    url = f"sqlite:///{tmp_path / 'legacy.db'}"
+    # The original events table, without migration bookkeeping
+    run_upgrade(url, "0001")
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE alembic_version"))
+    engine.dispose()
+
+    run_upgrade(url)
+
+def test_migrations_encode_existing_event_types(tmp_path):
+    """Test that existing event type names are converted to dictionary codes"""
+    url = f"sqlite:///{tmp_path / 'encode.db'}"
+    run_upgrade(url, "0003")
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO events (event_type, user_id) VALUES ('login', 1), ('click', 2), ('login', 3)"
+        ))
+
+    run_upgrade(url)
+
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT events.user_id, event_types.name FROM events "
+            "JOIN event_types ON event_types.id = events.event_type_id ORDER BY events.user_id"
+        )).all()
+        type_count = connection.execute(text("SELECT COUNT(*) FROM event_types")).scalar()
+    engine.dispose()
+
+    assert [tuple(row) for row in rows] == [(1, "login"), (2, "click"), (3, "login")]
+    assert type_count == 2
+
+def test_migrations_backfill_user_activity(tmp_path):
+    """Test that profiles are built from the events already stored"""
+    url = f"sqlite:///{tmp_path / 'profiles.db'}"
+    run_upgrade(url, "0005")
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO event_types (id, name) VALUES (1, 'login'), (2, 'click')"))
+        connection.execute(text(
+            "INSERT INTO events (event_type_id, user_id, created_at) VALUES "
+            "(1, 1, '2024-01-01 10:00:00'), (2, 1, '2024-01-03 10:00:00'), (1, 2, '2024-01-02 10:00:00')"
+        ))
+
+    run_upgrade(url)
+
+    with engine.connect() as connection:
+        activity = connection.execute(text(
+            "SELECT user_id, first_seen, last_seen, total_events FROM user_activity ORDER BY user_id"
+        )).all()
+        type_counts = connection.execute(text(
+            "SELECT COUNT(*) FROM user_activity_type_counts"
+        )).scalar()
+    engine.dispose()
+
+    assert [tuple(row) for row in activity] == [
+        (1, "2024-01-01 10:00:00", "2024-01-03 10:00:00", 2),
+        (2, "2024-01-02 10:00:00", "2024-01-02 10:00:00", 1),
+    ]
+    assert type_counts == 3
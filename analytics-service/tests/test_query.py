@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta
+
+from app import aggregation, models, schemas
+
+# A Monday, outside the rollup's retention, so queries read the events table
+DAY = datetime(2026, 3, 2)
+WINDOW = {"start_date": DAY.isoformat(), "end_date": (DAY + timedelta(days=14)).isoformat()}
+
+def seed(db):
+    db.add_all([models.EventType(id=1, name="click"), models.EventType(id=2, name="view")])
+    db.add_all([
+        models.Event(event_type_id=1, user_id=1, event_metadata={"plan": "pro", "price": 30},
+                     created_at=DAY + timedelta(hours=1)),
+        models.Event(event_type_id=1, user_id=1, event_metadata={"plan": "pro", "price": 5},
+                     created_at=DAY + timedelta(hours=2)),
+        models.Event(event_type_id=1, user_id=2, event_metadata={"plan": "free"}, created_at=DAY + timedelta(days=1)),
+        models.Event(event_type_id=2, user_id=2, event_metadata={"price": "n/a"},
+                     created_at=DAY + timedelta(days=1, hours=5)),
+        models.Event(event_type_id=2, user_id=3, event_metadata={}, created_at=DAY + timedelta(days=8)),
+    ])
+    db.commit()
+
+def query(client, **spec):
+    response = client.post("/analytics/query", json={**WINDOW, **spec})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_query_groups_by_dimensions(client, db_session):
+    seed(db_session)
+
+    by_type = query(client, measures=["count", "distinct_users"], dimensions=["event_type"])
+    assert by_type["source"] == "events"
+    assert by_type["columns"] == ["event_type", "count", "distinct_users"]
+    assert by_type["rows"] == [
+        {"event_type": "click", "count": 3, "distinct_users": 2},
+        {"event_type": "view", "count": 2, "distinct_users": 2},
+    ]
+
+    weekly = query(client, measures=["count"], dimensions=["time"], granularity="week")
+    assert weekly["rows"] == [{"time": "2026-03-02T00:00:00", "count": 4}, {"time": "2026-03-09T00:00:00", "count": 1}]
+    daily_clicks = query(client, measures=["count"], dimensions=["time"],
+                         filters=[{"field": "event_type", "value": "click"}])
+    assert daily_clicks["rows"] == [{"time": "2026-03-02T00:00:00", "count": 2}, {"time": "2026-03-03T00:00:00", "count": 1}]
+
+    # Events without the key group under null, after the values
+    by_plan = query(client, measures=["count"], dimensions=["metadata.plan"])
+    assert by_plan["rows"] == [
+        {"metadata.plan": "free", "count": 1}, {"metadata.plan": "pro", "count": 2}, {"metadata.plan": None, "count": 2}
+    ]
+
+    total = query(client, measures=["count", "distinct_users"])
+    assert total["rows"] == [{"count": 5, "distinct_users": 3}]
+
+def test_query_filters(client, db_session):
+    seed(db_session)
+
+    def count(*filters):
+        return query(client, measures=["count"], filters=list(filters))["rows"][0]["count"]
+
+    # Only numeric values compare as numbers
+    assert count({"field": "metadata.price", "op": "gt", "value": 10}) == 1
+    assert count({"field": "metadata.price", "op": "lte", "value": 30}) == 2
+    assert count({"field": "event_type", "op": "in", "value": ["view", "signup"]}) == 2
+    assert count({"field": "event_type", "op": "ne", "value": "signup"}) == 5
+    assert count({"field": "user_id", "op": "not_in", "value": [1]}) == 3
+    assert count({"field": "metadata.plan", "value": "pro"}, {"field": "user_id", "value": 1}) == 2
+
+def test_query_orders_and_limits(client, db_session):
+    seed(db_session)
+
+    top = query(client, measures=["count"], dimensions=["user_id"], order_by=[{"field": "count"}], limit=2)
+    assert top["rows"] == [{"user_id": 1, "count": 2}, {"user_id": 2, "count": 2}]
+    last = query(client, measures=["count"], dimensions=["user_id"], order_by=[{"field": "user_id"}], limit=1)
+    assert last["rows"] == [{"user_id": 3, "count": 1}]
+    types = query(client, measures=["count"], dimensions=["event_type"],
+                  order_by=[{"field": "event_type", "direction": "desc"}], limit=1)
+    assert types["rows"] == [{"event_type": "view", "count": 2}]
+
+def test_query_reads_rollup_for_whole_recent_days(client):
+    for user_id in (1, 1, 2):
+        client.post("/analytics/events", json={"event_type": "click", "user_id": user_id})
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    spec = {
+        "measures": ["count", "distinct_users"],
+        "dimensions": ["time"],
+        "start_date": (today - timedelta(days=2)).isoformat(),
+        "end_date": (today + timedelta(days=1)).isoformat(),
+    }
+
+    rollup = query(client, **spec)
+    events = query(client, **spec, source="events")
+    assert rollup["source"] == "user_activity_days" and events["source"] == "events"
+    assert rollup["rows"] == events["rows"] == [{"time": today.isoformat(), "count": 3, "distinct_users": 2}]
+
+    per_user = query(client, **{**spec, "dimensions": ["user_id"], "filters": [{"field": "user_id", "value": 1}]})
+    assert per_user["source"] == "user_activity_days"
+    assert per_user["rows"] == [{"user_id": 1, "count": 2, "distinct_users": 1}]
+
+    # Event types and partial days are only in the events table
+    assert query(client, **{**spec, "dimensions": ["event_type"]})["source"] == "events"
+    assert query(client, **{**spec, "end_date": datetime.utcnow().isoformat()})["source"] == "events"
+
+def test_plans_are_cached_by_spec_shape(db_session):
+    aggregation.plans.clear()
+
+    def spec(op, value):
+        return schemas.QuerySpec(measures=["count"], dimensions=["time"], filters=[
+            {"field": "user_id", "op": op, "value": value}
+        ], **WINDOW)
+
+    first = aggregation.prepare(db_session, spec("in", [1]), shard_count=1)
+    second = aggregation.prepare(db_session, spec("in", [2, 3]), shard_count=1)
+    assert second.statement is first.statement
+    assert second.params["f0"] == [2, 3]
+    assert aggregation.prepare(db_session, spec("eq", 1), shard_count=1).statement is not first.statement
+    assert len(aggregation.plans.plans) == 2
+
+def test_invalid_query_is_rejected(client, db_session):
+    def status(**spec):
+        return client.post("/analytics/query", json={"measures": ["count"], **spec}).status_code
+
+    assert status(measures=["sum"]) == 400
+    assert status(dimensions=["country"]) == 400
+    assert status(order_by=[{"field": "user_id"}]) == 400
+    assert status(filters=[{"field": "user_id", "op": "in", "value": 1}]) == 400
+    assert status(filters=[{"field": "event_type", "op": "gt", "value": "a"}]) == 400
+    assert status(filters=[{"field": "metadata.a b", "value": 1}]) == 400
+    assert status(start_date="2026-03-02T00:00:00", end_date="2026-03-01T00:00:00") == 400
+    assert status(filters=[{"field": "user_id", "op": "like", "value": 1}]) == 422
+
+    # Archived events are only merged in by /events/date-range
+    db_session.add(models.ArchiveFile(path="a.parquet", min_created_at=DAY, max_created_at=DAY + timedelta(days=1),
+                                      row_count=1, size_bytes=1))
+    db_session.commit()
+    assert status(**WINDOW) == 400
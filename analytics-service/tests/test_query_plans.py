@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+import pytest
+
+from benchmarks.query_plans import BUDGETS_PATH, budget_for, cases, check, measure, normalize
+
+# EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) output of a nested loop over an index and a filtered seq scan
+EXPLAIN = [{"Plan": {
+    "Node Type": "Nested Loop", "Actual Rows": 10, "Actual Loops": 1,
+    "Shared Hit Blocks": 120, "Shared Read Blocks": 30,
+    "Plans": [
+        {"Node Type": "Seq Scan", "Relation Name": "user_activity", "Actual Rows": 5, "Actual Loops": 1,
+         "Rows Removed by Filter": 995},
+        {"Node Type": "Index Scan", "Relation Name": "events", "Index Name": "ix_events_user_id",
+         "Actual Rows": 2, "Actual Loops": 5},
+    ],
+}}]
+
+def test_plan_measures():
+    measured = measure(EXPLAIN)
+    assert measured["seq_scans"] == ["user_activity"]
+    assert measured["rows"] == 5 + 995 + 2 * 5
+    assert measured["buffers"] == 150
+    assert measured["shape"] == [
+        "Nested Loop", "  Seq Scan on user_activity", "  Index Scan on events using ix_events_user_id"
+    ]
+
+def test_budget_violations():
+    statement = {"sql": "SELECT 1", **measure(EXPLAIN)}
+    assert check([statement], {"no_seq_scan": ["events"], "max_rows": 2000, "max_buffers": None}) == []
+    assert check([statement, statement], {"no_seq_scan": ["user_activity"], "max_rows": 2000, "max_buffers": 200}) == [
+        "sequential scan on user_activity: SELECT 1",
+        "sequential scan on user_activity: SELECT 1",
+        "rows 2020 over budget 2000",
+        "buffers 300 over budget 200",
+    ]
+
+def test_budgets_cover_known_cases():
+    budgets = json.loads(BUDGETS_PATH.read_text())
+    names = {case[0] for case in cases(datetime.utcnow())}
+    assert set(budgets["cases"]) <= names
+    # Every case has a row and buffer limit, so no plan can grow unnoticed
+    assert all(budget_for(budgets, name)[f"max_{key}"] is not None for name in names for key in ("rows", "buffers"))
+    assert budget_for(budgets, "events_newest") == budgets["default"]
+
+    # Parameter lists of any length normalize to the same SQL
+    assert normalize("SELECT *\n  FROM events WHERE id IN (%(id_1_1)s, %(id_1_2)s, %(id_1_3)s)") == \
+        "SELECT * FROM events WHERE id IN (%(...)s)"
+
+@pytest.mark.skipif(not os.getenv("PLAN_DATABASE_URL"), reason="needs an empty Postgres database in PLAN_DATABASE_URL")
+def test_endpoints_stay_within_plan_budgets(tmp_path):
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.query_plans", "--events", "1000000", "--report", str(tmp_path / "report.txt")],
+        capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+from app import models, sessions
+from app.sessions import Sessionizer, Span, backfill, persist
+from app.sharding import Shards
+
+START = datetime(2026, 1, 1, 12, 0)
+TIMEOUT = timedelta(minutes=30)
+
+def minutes(value: float) -> datetime:
+    return START + timedelta(minutes=value)
+
+def stored(db):
+    return [
+        (row.user_id, row.started_at, row.ended_at, row.event_count)
+        for row in db.query(models.UserSession).order_by(models.UserSession.user_id, models.UserSession.started_at)
+    ]
+
+def test_sessionizer_splits_on_inactivity_gap():
+    sessionizer = Sessionizer(TIMEOUT, timedelta(minutes=5))
+    sessionizer.record([(1, minutes(0)), (1, minutes(10)), (1, minutes(50)), (2, minutes(20))])
+    sessionizer.close_expired(minutes(200))
+
+    closed = sorted((span.user_id, span.started_at, span.event_count) for span in sessionizer.closed)
+    assert closed == [(1, minutes(0), 2), (1, minutes(50), 1), (2, minutes(20), 1)]
+    assert sessionizer.open == {}
+
+def test_sessionizer_late_event_bridges_open_sessions():
+    sessionizer = Sessionizer(TIMEOUT, timedelta(minutes=60))
+    sessionizer.record([(1, minutes(0)), (1, minutes(50))])
+    assert len(sessionizer.open[1]) == 2
+
+    # Arrives after the 50-minute event but within the lateness window
+    sessionizer.record([(1, minutes(25))])
+    sessionizer.close_expired(minutes(60))
+    assert [span.event_count for span in sessionizer.open[1]] == [3]
+    assert sessionizer.closed == []
+
+def test_ingest_sessionizes_on_event_time(client, monkeypatch):
+    """Test that sessions follow when events happened, not when they were delivered"""
+    monkeypatch.setattr(sessions.sessionizer, "lateness", timedelta(hours=1))
+    now = datetime.utcnow()
+
+    def post(user_id, at=None):
+        event = {"event_type": "page_view", "user_id": user_id}
+        if at:
+            event["created_at"] = at.isoformat()
+        assert client.post("/analytics/events", json=event).status_code == 201
+
+    # Delivered together, but 90 minutes apart: two sessions
+    post(1, now - timedelta(minutes=90))
+    post(1)
+    # A late event inside the lateness window joins the two open sessions around it
+    post(2, now - timedelta(minutes=40))
+    post(2)
+    post(2, now - timedelta(minutes=20))
+
+    assert sorted(span.event_count for span in sessions.sessionizer.unwritten(1)) == [1, 1]
+    [span] = sessions.sessionizer.unwritten(2)
+    assert span.event_count == 3
+    assert span.started_at == now - timedelta(minutes=40)
+
+    response = client.post("/analytics/events", json={
+        "event_type": "page_view", "user_id": 3, "created_at": (now + timedelta(hours=1)).isoformat()
+    })
+    assert response.status_code == 422
+
+def test_persist_merges_with_stored_neighbours(db_session):
+    persist(db_session, [Span(1, minutes(0), minutes(10), 3)], TIMEOUT)
+    # A fragment of the same session closed by another worker, then a separate session
+    persist(db_session, [Span(1, minutes(20), minutes(30), 2), Span(1, minutes(120), minutes(120), 1)], TIMEOUT)
+
+    assert stored(db_session) == [(1, minutes(0), minutes(30), 5), (1, minutes(120), minutes(120), 1)]
+    assert db_session.query(models.UserSession).first().duration_seconds == 1800
+
+def test_flush_writes_closed_sessions(db_session):
+    sessionizer = Sessionizer(TIMEOUT, timedelta(0))
+    sessionizer.record([(1, datetime.utcnow() - timedelta(hours=2)), (2, datetime.utcnow())])
+    sessionizer.flush(Shards(lambda: db_session, [None]))
+
+    assert [row[0] for row in stored(db_session)] == [1]
+    assert [span.user_id for span in sessionizer.unwritten()] == [2]
+
+def test_backfill_rebuilds_sessions_from_events(db_session):
+    db_session.add(models.EventType(id=1, name="page_view"))
+    db_session.add_all([
+        models.Event(event_type_id=1, user_id=user_id, event_metadata={}, created_at=minutes(offset))
+        for user_id, offset in [(1, 0), (1, 5), (1, 90), (2, 10)]
+    ])
+    # Stale row from an earlier run that the rebuild replaces
+    db_session.add(models.UserSession(
+        user_id=1, started_at=minutes(0), ended_at=minutes(0), duration_seconds=0, event_count=1
+    ))
+    db_session.commit()
+
+    assert backfill(db_session, timeout=TIMEOUT) == 3
+    assert stored(db_session) == [
+        (1, minutes(0), minutes(5), 2), (1, minutes(90), minutes(90), 1), (2, minutes(10), minutes(10), 1)
+    ]
@@ -0,0 +1,274 @@
+from collections import Counter
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.database import Base, engine_options
+from app.event_types import event_types
+from app.main import app
+from app.sharding import (
+    EventTypeMismatch, Shards, _move_events, _move_profiles, get_shards, jump_hash, rebalance, shard_index
+)
+from tests.conftest import reset_process_state
+
+def make_databases(tmp_path, count):
+    makers = []
+    for index in range(count):
+        url = f"sqlite:///{tmp_path / f'shard{index}.db'}"
+        shard_engine = create_engine(url, **engine_options(url))
+        Base.metadata.create_all(bind=shard_engine)
+        makers.append(sessionmaker(autocommit=False, autoflush=False, bind=shard_engine))
+    return makers
+
+@pytest.fixture
+def shard_makers(tmp_path):
+    """Two SQLite shards; the first is also the primary database"""
+    return make_databases(tmp_path, 2)
+
+@pytest.fixture
+def sharded_client(shard_makers):
+    def override_get_shards():
+        shards = Shards(shard_makers[0], [None, shard_makers[1]])
+        try:
+            yield shards
+        finally:
+            shards.close()
+
+    app.dependency_overrides[get_shards] = override_get_shards
+    reset_process_state()
+    with TestClient(app) as test_client:
+        yield test_client
+        reset_process_state()
+    app.dependency_overrides.clear()
+
+def test_jump_hash_moves_few_keys_when_growing():
+    keys = range(10000)
+    before = [jump_hash(key * 7919, 4) for key in keys]
+    after = [jump_hash(key * 7919, 5) for key in keys]
+
+    moved = sum(old != new for old, new in zip(before, after))
+    assert all(new == old or new == 4 for old, new in zip(before, after))
+    assert 1500 < moved < 2500
+    assert min(Counter(before).values()) > 2200
+
+def test_events_are_routed_by_user(sharded_client, shard_makers):
+    """Test that each user's events land on one shard and reads merge across shards"""
+    events = [{"event_type": "click" if user_id % 2 else "view", "user_id": user_id} for user_id in range(1, 21)]
+    events += [{"event_type": "click", "user_id": 1}]
+    response = sharded_client.post("/analytics/events/batch", json={"events": events})
+    assert response.json()["created"] == 21
+
+    for index, make_session in enumerate(shard_makers):
+        with make_session() as db:
+            user_ids = {user_id for user_id, in db.query(models.Event.user_id)}
+            assert user_ids and all(shard_index(user_id, 2) == index for user_id in user_ids)
+
+    assert len(sharded_client.get("/analytics/users/1/events").json()) == 2
+    assert sharded_client.get("/analytics/users/1/profile").json()["total_events"] == 2
+    assert len(sharded_client.get("/analytics/events", params={"limit": 5}).json()) == 5
+    assert len(sharded_client.get("/analytics/events", params={"event_type": "view"}).json()) == 10
+
+    summary = sharded_client.get("/analytics/summary").json()
+    assert summary["total_events"] == 21
+    assert summary["active_users_24h"] == 20
+    assert summary["event_type_counts"] == {"click": 11, "view": 10}
+
+    date_range = sharded_client.get("/analytics/events/date-range").json()
+    assert date_range["total_events"] == 21
+    assert date_range["unique_users"] == 20
+
+    top = sharded_client.get("/analytics/top-users", params={"mode": "exact", "limit": 1}).json()
+    assert top["users"] == [{"user_id": 1, "count": 2, "max_error": 0}]
+
+    exported = sharded_client.get("/analytics/events/export").text.splitlines()
+    assert len(exported) == 21
+
+    by_type = sharded_client.post("/analytics/query", json={
+        "measures": ["count", "distinct_users"], "dimensions": ["event_type"], "source": "events"
+    }).json()
+    assert by_type["rows"] == [
+        {"event_type": "click", "count": 11, "distinct_users": 10},
+        {"event_type": "view", "count": 10, "distinct_users": 10},
+    ]
+    top_users = sharded_client.post("/analytics/query", json={
+        "measures": ["count"], "dimensions": ["user_id"], "order_by": [{"field": "count"}], "limit": 2
+    }).json()
+    assert top_users["rows"] == [{"user_id": 1, "count": 2}, {"user_id": 2, "count": 1}]
+
+    feed, cursor = [], "0"
+    while True:
+        page = sharded_client.get("/analytics/events/changes", params={"since": cursor, "limit": 8}).json()
+        feed += page["events"]
+        cursor = page["cursor"]
+        if not page["has_more"]:
+            break
+    assert len(feed) == 21 and len(cursor.split(".")) == 2
+    assert sorted(event["user_id"] for event in feed) == sorted(event["user_id"] for event in events)
+
+def test_rebalance_backfills_from_single_database(tmp_path):
+    """Test that the rebalancing tool moves events and profiles to their owning shard"""
+    source_maker, *shard_makers = make_databases(tmp_path, 3)
+    with source_maker() as source:
+        codes = event_types.encode(source, ["login"])
+        source.add_all([models.Event(event_type_id=codes["login"], user_id=user_id) for user_id in range(1, 11)])
+        source.add_all([
+            models.UserActivity(user_id=user_id, first_seen=models.func.now(), last_seen=models.func.now(),
+                                total_events=1)
+            for user_id in range(1, 11)
+        ])
+        source.add_all([
+            models.UserSession(user_id=user_id, started_at=datetime(2026, 1, 1), ended_at=datetime(2026, 1, 1),
+                               duration_seconds=0, event_count=1)
+            for user_id in range(1, 11)
+        ])
+        source.commit()
+        # The codes above belong to the source database, not the primary
+        event_types.clear()
+
+        shards = Shards(shard_makers[0], [None, shard_makers[1]])
+        try:
+            assert rebalance(source, None, shards) == (10, 10)
+        finally:
+            shards.close()
+        assert source.query(models.Event).count() == 0
+    event_types.clear()
+
+    for index, make_session in enumerate(shard_makers):
+        with make_session() as db:
+            expected = {user_id for user_id in range(1, 11) if shard_index(user_id, 2) == index}
+            assert {user_id for user_id, in db.query(models.Event.user_id)} == expected
+            assert {user_id for user_id, in db.query(models.UserActivity.user_id)} == expected
+            assert {user_id for user_id, in db.query(models.UserSession.user_id)} == expected
+            assert db.query(models.EventType.name).all() == [("login",)]
+
+def test_interrupted_rebalance_can_be_rerun(tmp_path, monkeypatch):
+    """Test that re-running after a crash between copy and delete neither fails nor duplicates"""
+    source_maker, *shard_makers = make_databases(tmp_path, 3)
+    with source_maker() as source:
+        codes = event_types.encode(source, ["login"])
+        source.add_all([
+            models.Event(event_type_id=codes["login"], user_id=user_id,
+                         client_event_id=f"key-{user_id}" if user_id % 2 else None)
+            for user_id in range(1, 11)
+        ])
+        source.commit()
+        event_types.clear()
+
+        shards = Shards(shard_makers[0], [None, shard_makers[1]])
+        try:
+            # Crash after the first batch was committed on its target, before its rows leave the source
+            def crash():
+                raise RuntimeError("interrupted")
+            monkeypatch.setattr(source, "commit", crash)
+            with pytest.raises(RuntimeError):
+                _move_events(source, None, shards, batch_rows=4)
+            monkeypatch.undo()
+            source.rollback()
+            assert source.query(models.Event).count() == 10
+
+            assert _move_events(source, None, shards, batch_rows=4) == 10
+        finally:
+            shards.close()
+        assert source.query(models.Event).count() == 0
+    event_types.clear()
+
+    user_ids = []
+    for make_session in shard_makers:
+        with make_session() as db:
+            user_ids += [user_id for user_id, in db.query(models.Event.user_id)]
+            assert db.query(models.RebalanceMove).count() == 0
+    assert sorted(user_ids) == list(range(1, 11))
+
+def test_interrupted_profile_move_can_be_rerun(tmp_path, monkeypatch):
+    """Test that re-running after a crash between copy and delete neither double-counts nor duplicates sessions"""
+    source_maker, *shard_makers = make_databases(tmp_path, 3)
+    with source_maker() as source:
+        codes = event_types.encode(source, ["login"])
+        source.add_all([
+            models.UserActivity(user_id=user_id, first_seen=datetime(2026, 1, 1), last_seen=datetime(2026, 1, 2),
+                                total_events=3)
+            for user_id in range(1, 11)
+        ])
+        source.add_all([
+            models.UserActivityTypeCount(user_id=user_id, event_type_id=codes["login"], count=3)
+            for user_id in range(1, 11)
+        ])
+        source.add_all([
+            models.UserSession(user_id=user_id, started_at=datetime(2026, 1, 1), ended_at=datetime(2026, 1, 2),
+                               duration_seconds=86400, event_count=3)
+            for user_id in range(1, 11)
+        ])
+        source.commit()
+        event_types.clear()
+
+        shards = Shards(shard_makers[0], [None, shard_makers[1]])
+        try:
+            def crash():
+                raise RuntimeError("interrupted")
+            monkeypatch.setattr(source, "commit", crash)
+            with pytest.raises(RuntimeError):
+                _move_profiles(source, None, shards)
+            monkeypatch.undo()
+            source.rollback()
+            assert source.query(models.UserActivity).count() == 10
+
+            assert _move_profiles(source, None, shards) == 10
+        finally:
+            shards.close()
+        assert source.query(models.UserActivity).count() == 0
+    event_types.clear()
+
+    totals, type_counts, sessions = [], [], []
+    for make_session in shard_makers:
+        with make_session() as db:
+            totals += [total for total, in db.query(models.UserActivity.total_events)]
+            type_counts += [count for count, in db.query(models.UserActivityTypeCount.count)]
+            sessions += [user_id for user_id, in db.query(models.UserSession.user_id)]
+            assert db.query(models.RebalanceProfileMove).count() == 0
+    assert totals == type_counts == [3] * 10
+    assert sorted(sessions) == list(range(1, 11))
+
+def test_readiness_checks_every_shard(tmp_path, shard_makers, readiness):
+    """Test that one unreachable shard keeps the service from reporting ready"""
+    readiness.ready = True
+    broken = create_engine(f"sqlite:///{tmp_path / 'missing' / 'shard.db'}")
+    factories = {"up": shard_makers[1], "down": sessionmaker(bind=broken)}
+    state = {"second": "up"}
+
+    def override_get_shards():
+        shards = Shards(shard_makers[0], [None, factories[state["second"]]])
+        try:
+            yield shards
+        finally:
+            shards.close()
+
+    app.dependency_overrides[get_shards] = override_get_shards
+    try:
+        with TestClient(app) as client:
+            assert client.get("/ready").status_code == 200
+            state["second"] = "down"
+            response = client.get("/ready")
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 503
+    assert response.json()["detail"].startswith("shard 1: ")
+
+def test_conflicting_event_type_codes_are_reported(shard_makers):
+    """Test that a shard mapping a code to another name than the primary fails replication"""
+    with shard_makers[1]() as shard:
+        shard.add(models.EventType(id=1, name="view"))
+        shard.commit()
+
+    shards = Shards(shard_makers[0], [None, shard_makers[1]])
+    try:
+        codes = event_types.encode(shards.primary, ["click"])
+        assert codes == {"click": 1}
+        with pytest.raises(EventTypeMismatch, match="'view' on shard 1, 'click' on the primary"):
+            shards.replicate_event_types(codes)
+    finally:
+        shards.close()
+    event_types.clear()
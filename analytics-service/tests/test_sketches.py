@@ -0,0 +1,86 @@
+import random
+from collections import Counter
+
+from app.sketches import CountMinSketch, DDSketch, HeavyHitterSketch, NumericSketch, SpaceSaving
+
+def zipf_stream(n, keys=2000, seed=7):
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, keys + 1)]
+    return [f"k{key}" for key in rng.choices(range(keys), weights=weights, k=n)]
+
+def test_space_saving_bounds():
+    """Test that Space-Saving counts bracket the true counts"""
+    stream = zipf_stream(20000)
+    truth = Counter(stream)
+    summary = SpaceSaving(capacity=100)
+    for key in stream:
+        summary.add(key)
+
+    for key, count in summary.counts.items():
+        assert count - summary.errors[key] <= truth[key] <= count
+
+def test_count_min_never_undercounts():
+    """Test that Count-Min estimates are upper bounds"""
+    stream = zipf_stream(20000)
+    sketch = CountMinSketch(width=512, depth=4)
+    for key in stream:
+        sketch.add(key)
+
+    for key, count in Counter(stream).items():
+        assert sketch.estimate(key) >= count
+
+def test_heavy_hitter_merge_finds_top_keys():
+    """Test that merging per-bucket sketches recovers the true top keys"""
+    stream = zipf_stream(30000)
+    truth = Counter(stream)
+    merged = HeavyHitterSketch(capacity=100)
+    for offset in range(0, len(stream), 5000):
+        bucket = HeavyHitterSketch(capacity=100)
+        for key in stream[offset:offset + 5000]:
+            bucket.add(key)
+        merged.merge(HeavyHitterSketch.from_dict(bucket.to_dict()))
+
+    assert merged.total == len(stream)
+    top = merged.top(10)
+    assert [key for key, _, _ in top] == [key for key, _ in truth.most_common(10)]
+    for key, count, max_error in top:
+        assert count - max_error <= truth[key] <= count
+
+def test_ddsketch_quantiles_within_relative_error():
+    """Test that merged DDSketch quantiles stay within the relative accuracy"""
+    rng = random.Random(3)
+    values = [rng.lognormvariate(5, 1.5) for _ in range(20000)] + [-rng.expovariate(0.1) for _ in range(2000)]
+    merged = DDSketch(alpha=0.01)
+    for offset in range(0, len(values), 4000):
+        part = DDSketch(alpha=0.01)
+        for value in values[offset:offset + 4000]:
+            part.add(value)
+        merged.merge(DDSketch.from_dict(part.to_dict()))
+
+    ordered = sorted(values)
+    assert merged.count == len(values)
+    for q in (0.01, 0.05, 0.5, 0.9, 0.99):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        assert abs(merged.quantile(q) - exact) <= 0.01 * abs(exact) + 1e-9
+
+def test_ddsketch_collapses_smallest_buckets():
+    """Test that a bounded DDSketch keeps high quantiles accurate"""
+    sketch = DDSketch(alpha=0.01, max_buckets=100)
+    for exponent in range(-200, 200):
+        sketch.add(1.05 ** exponent)
+
+    assert len(sketch.positive) == 100
+    assert abs(sketch.quantile(0.99) - 1.05 ** 195) <= 0.02 * 1.05 ** 195
+
+def test_numeric_sketch_exact_aggregates():
+    """Test count/sum/min/max survive merging and serialization"""
+    left, right = NumericSketch(), NumericSketch()
+    for value in (3, 1, 4):
+        left.add(value)
+    for value in (1, 5, 9, 2):
+        right.add(value)
+    left.merge(NumericSketch.from_dict(right.to_dict()))
+
+    assert (left.count, left.sum, left.min, left.max) == (7, 25, 1, 9)
+    assert left.quantile(0) == 1
+    assert left.quantile(1) == 9
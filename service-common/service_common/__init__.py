@@ -0,0 +1,6 @@
+"""Process-level plumbing shared by the user and analytics services.
+
+Each service installs this package from its requirements (``-e ../service-common``)
+and keeps its own configuration: the route classes it sheds, the concurrency cap
+derived from its connection pool, and the warmers it registers.
+"""
@@ -0,0 +1,164 @@
+"""Adaptive concurrency limiting and load shedding.
+
+Requests are grouped into route classes, each with its own concurrency limit that
+adapts to observed latency (additive increase, multiplicative decrease when latency
+rises well above the best seen recently). A global cap keeps total in-flight requests
+within the database connection pool (beyond it, blocking DB calls on the event loop
+wait for connections that can only be returned by the blocked loop), and each class
+may only use its share of that cap, so ingest and login keep headroom over dashboard
+aggregates under overload. Requests over a limit are rejected immediately with 503
+and `Retry-After` instead of queueing.
+"""
+import json
+import os
+import time
+from typing import Callable, Dict, Optional
+
+from prometheus_client import Counter, Gauge
+
+LOAD_SHED_ENABLED = os.getenv("LOAD_SHED_ENABLED", "true").lower() == "true"
+LOAD_SHED_LATENCY_TOLERANCE = float(os.getenv("LOAD_SHED_LATENCY_TOLERANCE", "2.0"))
+LOAD_SHED_RETRY_AFTER_SECONDS = int(os.getenv("LOAD_SHED_RETRY_AFTER_SECONDS", "1"))
+
+LIMIT = Gauge(
+    "load_shedding_limit", "Current adaptive concurrency limit",
+    ["route_class"], multiprocess_mode="livesum"
+)
+IN_FLIGHT = Gauge(
+    "load_shedding_in_flight", "Requests currently admitted",
+    ["route_class"], multiprocess_mode="livesum"
+)
+SHED = Counter("load_shedding_shed_total", "Requests rejected with 503", ["route_class"])
+
+class AdaptiveLimit:
+    """AIMD concurrency limit driven by request latency.
+
+    The baseline is the lowest latency seen, drifting slowly upwards so it follows
+    real changes in the workload. While smoothed latency stays within `tolerance`
+    times the baseline, the limit grows by about one per limit's worth of
+    completions; beyond it (or on a server error) the limit is cut by `backoff`,
+    at most once per smoothed latency interval.
+    """
+
+    def __init__(self, initial: int, min_limit: int = 1, max_limit: int = 1000,
+                 tolerance: float = 2.0, backoff: float = 0.9, smoothing: float = 0.2):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self.baseline: Optional[float] = None
+        self.smoothed: Optional[float] = None
+        self.last_decrease = 0.0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= int(self.limit):
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self, latency: float, failed: bool = False):
+        self.in_flight -= 1
+        if self.baseline is None:
+            self.baseline = self.smoothed = latency
+        else:
+            self.baseline = min(latency, self.baseline + (latency - self.baseline) * 0.01)
+            self.smoothed += (latency - self.smoothed) * self.smoothing
+
+        if failed or self.smoothed > self.baseline * self.tolerance:
+            now = time.monotonic()
+            if now - self.last_decrease >= self.smoothed:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.last_decrease = now
+        elif self.in_flight + 1 >= int(self.limit) / 2:
+            # Only grow when the current limit is actually being used
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+class LoadShedder:
+    """Per-route-class adaptive limits plus a global cap.
+
+    `classes` maps a class name to its `share` of the global cap: a class is only
+    admitted while total in-flight requests are below `share * max_concurrency`, so
+    classes with a smaller share are shed first.
+    """
+
+    def __init__(self, classes: Dict[str, float], max_concurrency: int, tolerance: float = 2.0):
+        self.max_concurrency = max_concurrency
+        self.caps = {name: max(1, int(share * max_concurrency)) for name, share in classes.items()}
+        self.limits = {
+            name: AdaptiveLimit(cap, max_limit=cap, tolerance=tolerance)
+            for name, cap in self.caps.items()
+        }
+        self.in_flight = 0
+        for name, limit in self.limits.items():
+            LIMIT.labels(route_class=name).set(limit.limit)
+
+    def admit(self, route_class: str) -> bool:
+        if self.in_flight >= self.caps[route_class] or not self.limits[route_class].try_acquire():
+            SHED.labels(route_class=route_class).inc()
+            return False
+        self.in_flight += 1
+        IN_FLIGHT.labels(route_class=route_class).inc()
+        return True
+
+    def release(self, route_class: str, latency: float, failed: bool):
+        limit = self.limits[route_class]
+        limit.release(latency, failed)
+        self.in_flight -= 1
+        IN_FLIGHT.labels(route_class=route_class).dec()
+        LIMIT.labels(route_class=route_class).set(limit.limit)
+
+class LoadSheddingMiddleware:
+    """ASGI middleware applying a LoadShedder to requests a classifier maps to a class"""
+
+    def __init__(self, app, shedder: LoadShedder, classify: Callable[[str, str], Optional[str]]):
+        self.app = app
+        self.shedder = shedder
+        self.classify = classify
+
+    async def __call__(self, scope, receive, send):
+        route_class = None
+        if scope["type"] == "http" and LOAD_SHED_ENABLED:
+            route_class = self.classify(scope["method"], scope["path"])
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not self.shedder.admit(route_class):
+            await self._reject(send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+        latency = None
+
+        async def send_with_status(message):
+            nonlocal status_code, latency
+            if message["type"] == "http.response.start":
+                # Latency is time to first byte: a streamed body is paced by the
+                # client and the size of the download, not by server load
+                status_code = message["status"]
+                latency = time.perf_counter() - started
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            if latency is None:
+                latency = time.perf_counter() - started
+            self.shedder.release(route_class, latency, status_code >= 500)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": "Service overloaded, retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(LOAD_SHED_RETRY_AFTER_SECONDS).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
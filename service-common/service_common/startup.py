@@ -0,0 +1,89 @@
+"""Startup warm-up and readiness tracking.
+
+Schema changes are applied by the migration step (``alembic upgrade head``)
+before the service starts, so the process itself only has to open its
+connection pool and prime hot query paths before it reports ready.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, List, Optional
+
+from prometheus_client import Gauge
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+PROCESS_STARTED_AT = time.monotonic()
+
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+
+COLD_START_SECONDS = Gauge(
+    "app_cold_start_seconds",
+    "Seconds from process start until warm-up completed (slowest worker)",
+    multiprocess_mode="livemax"
+)
+READY = Gauge(
+    "app_ready",
+    "1 once warm-up has completed in every worker, 0 while any is warming up",
+    multiprocess_mode="livemin"
+)
+
+_warmers: List[Callable[[Session], None]] = []
+
+class Readiness:
+    """Mutable readiness state shared by the startup task and /ready"""
+
+    def __init__(self):
+        self.ready = False
+        self.cold_start_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+readiness = Readiness()
+
+def register_warmer(func: Callable[[Session], None]):
+    """Register a function that primes a cache or query path during warm-up"""
+    _warmers.append(func)
+    return func
+
+def warm_pool(engine, size: int):
+    """Open `size` pooled connections up front so first requests don't pay for connects"""
+    connections = []
+    try:
+        for _ in range(size):
+            connection = engine.connect()
+            connection.execute(text("SELECT 1"))
+            connections.append(connection)
+    finally:
+        for connection in connections:
+            connection.close()
+
+def warm_up(engine) -> bool:
+    """Run one warm-up attempt; returns True once the service is ready"""
+    pool_size = engine.pool.size() if hasattr(engine.pool, "size") else 1
+    try:
+        warm_pool(engine, pool_size)
+        with Session(bind=engine) as db:
+            for warmer in _warmers:
+                warmer(db)
+    except Exception as e:
+        # A failed attempt never clears readiness that was already reached
+        readiness.last_error = str(e)
+        logging.warning(f"Warm-up attempt failed: {e}")
+        return False
+
+    if not readiness.ready:
+        readiness.cold_start_seconds = time.monotonic() - PROCESS_STARTED_AT
+        COLD_START_SECONDS.set(readiness.cold_start_seconds)
+        logging.info(f"Service ready after {readiness.cold_start_seconds:.3f}s")
+    readiness.ready = True
+    readiness.last_error = None
+    READY.set(1)
+    return True
+
+async def warm_up_until_ready(engine):
+    """Retry warm-up in a worker thread until it succeeds"""
+    while not readiness.ready:
+        if await asyncio.to_thread(warm_up, engine):
+            return
+        await asyncio.sleep(WARMUP_RETRY_SECONDS)
@@ -7,6 +7,8 @@ from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 import os
 
+from service_common.startup import register_warmer
+
 from . import models, schemas
 from .database import get_db
 
@@ -17,6 +19,12 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+@register_warmer
+def warm_auth(db: Session):
+    """Load the bcrypt backend and compile the login lookup before the first request"""
+    pwd_context.dummy_verify()
+    db.query(models.User).filter(models.User.username == "").first()
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -0,0 +1,164 @@
+"""Bulk user import.
+
+Rows are validated individually, checked for email/username conflicts with a
+few set-based queries (plus duplicates within the batch), hashed across a
+process pool so bcrypt uses every core, and inserted in chunks of
+BULK_CHUNK_ROWS, one transaction each. Hashing of the next chunk overlaps the
+insert of the current one. Each chunk's `user_registered` events are written to
+the outbox in its transaction. Results are produced per row, in chunk order.
+"""
+import asyncio
+import csv
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import auth, models, outbox, schemas
+
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "50000"))
+BULK_CHUNK_ROWS = int(os.getenv("BULK_CHUNK_ROWS", "500"))
+BULK_HASH_WORKERS = int(os.getenv("BULK_HASH_WORKERS", str(os.cpu_count() or 1)))
+
+# Values per IN list in the conflict check
+CONFLICT_QUERY_VALUES = 5000
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+class BulkInputError(ValueError):
+    """The request body is not a list of users in a supported format"""
+
+def parse_rows(body: bytes, content_type: str) -> List[dict]:
+    """Raw user rows from a CSV body (with a header line) or a JSON list / {"users": [...]}"""
+    if content_type.split(";")[0].strip() == "text/csv":
+        try:
+            text = body.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise BulkInputError("CSV body must be UTF-8")
+        return [
+            {key: value for key, value in row.items() if value not in (None, "")}
+            for row in csv.DictReader(io.StringIO(text))
+        ]
+
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise BulkInputError("Body must be JSON or text/csv")
+    if isinstance(data, dict):
+        data = data.get("users")
+    if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        raise BulkInputError('Expected a list of users or {"users": [...]}')
+    return data
+
+def validate(rows: List[dict]) -> Tuple[List[Tuple[int, schemas.UserCreate]], List[dict]]:
+    """(valid (row, user) pairs, results for invalid rows)"""
+    valid, results = [], []
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, schemas.UserCreate.model_validate(row)))
+        except ValidationError as e:
+            detail = "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+                               for error in e.errors())
+            results.append({"row": index, "status": "invalid", "detail": detail})
+    return valid, results
+
+def existing_conflicts(db: Session, emails: Iterable[str], usernames: Iterable[str]) -> Tuple[Set[str], Set[str]]:
+    """Emails and usernames among the given ones that are already registered"""
+    emails, usernames = list(emails), list(usernames)
+    taken_emails, taken_usernames = set(), set()
+    for offset in range(0, max(len(emails), len(usernames)), CONFLICT_QUERY_VALUES):
+        email_chunk = emails[offset:offset + CONFLICT_QUERY_VALUES]
+        username_chunk = usernames[offset:offset + CONFLICT_QUERY_VALUES]
+        for email, username in db.query(models.User.email, models.User.username).filter(
+            or_(models.User.email.in_(email_chunk), models.User.username.in_(username_chunk))
+        ):
+            taken_emails.add(email)
+            taken_usernames.add(username)
+    return taken_emails & set(emails), taken_usernames & set(usernames)
+
+def remove_conflicts(db: Session, users: List[Tuple[int, schemas.UserCreate]]):
+    """Split rows into (insertable, conflict results): existing accounts and repeats within the batch"""
+    taken_emails, taken_usernames = existing_conflicts(
+        db, {user.email for _, user in users}, {user.username for _, user in users}
+    )
+    insertable, results = [], []
+    seen_emails, seen_usernames = set(), set()
+    for index, user in users:
+        if user.email in taken_emails or user.username in taken_usernames:
+            results.append({"row": index, "status": "conflict", "detail": "Email or username already registered"})
+        elif user.email in seen_emails or user.username in seen_usernames:
+            results.append({"row": index, "status": "conflict", "detail": "Email or username repeated in batch"})
+        else:
+            seen_emails.add(user.email)
+            seen_usernames.add(user.username)
+            insertable.append((index, user))
+    return insertable, results
+
+def _hash_many(passwords: List[str]) -> List[str]:
+    return [auth.get_password_hash(password) for password in passwords]
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawned rather than forked: the server process runs threads
+        _pool = ProcessPoolExecutor(BULK_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+async def hash_passwords(passwords: List[str]) -> List[str]:
+    """bcrypt hashes of `passwords`, computed on every worker of the process pool"""
+    if not passwords:
+        return []
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    size = -(-len(passwords) // BULK_HASH_WORKERS)
+    parts = await asyncio.gather(*(
+        loop.run_in_executor(pool, _hash_many, passwords[offset:offset + size])
+        for offset in range(0, len(passwords), size)
+    ))
+    return [hashed for part in parts for hashed in part]
+
+async def hash_chunk(users: List[Tuple[int, schemas.UserCreate]]) -> Dict[int, str]:
+    """Password hashes keyed by row index"""
+    hashes = await hash_passwords([user.password for _, user in users])
+    return {index: hashed for (index, _), hashed in zip(users, hashes)}
+
+def _insert(db: Session, users: List[Tuple[int, schemas.UserCreate]], hashes: Dict[int, str]) -> List[dict]:
+    rows = [
+        models.User(email=user.email, username=user.username, full_name=user.full_name, hashed_password=hashes[index])
+        for index, user in users
+    ]
+    db.add_all(rows)
+    db.flush()
+    for row in rows:
+        outbox.add(db, "user_registered", row.id, {"username": row.username})
+    # Read ids before commit expires the rows
+    results = [
+        {"row": index, "status": "created", "id": row.id, "username": row.username}
+        for (index, _), row in zip(users, rows)
+    ]
+    db.commit()
+    return results
+
+def insert_chunk(db: Session, users: List[Tuple[int, schemas.UserCreate]], hashes: Dict[int, str]) -> List[dict]:
+    """Insert one chunk in a transaction; rows taken concurrently since the first check become conflicts"""
+    try:
+        return _insert(db, users, hashes)
+    except IntegrityError:
+        db.rollback()
+    insertable, results = remove_conflicts(db, users)
+    if insertable:
+        results.extend(_insert(db, insertable, hashes))
+    return sorted(results, key=lambda result: result["row"])
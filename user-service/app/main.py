@@ -1,13 +1,20 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 from datetime import timedelta
 from prometheus_fastapi_instrumentator import Instrumentator
-import logging
+import asyncio
+import os
 
-from . import models, schemas, auth
-from .database import engine, get_db
+from service_common import startup
+from service_common.load_shedding import (
+    LOAD_SHED_LATENCY_TOLERANCE, LoadShedder, LoadSheddingMiddleware
+)
+
+from . import bulk, outbox, schemas, auth
+from .database import DB_MAX_OVERFLOW, DB_POOL_SIZE, SessionLocal, engine, get_db
 from .routers import users
 
 app = FastAPI(
@@ -16,6 +23,27 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Total in-flight requests admitted; beyond the connection pool they would only queue
+LOAD_SHED_MAX_CONCURRENCY = int(os.getenv("LOAD_SHED_MAX_CONCURRENCY", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+
+# Load shedding (added before CORS so rejections still carry CORS headers):
+# the share of the global concurrency cap each route class may use
+def classify_request(method: str, path: str):
+    if method == "POST" and path in ("/token", "/login"):
+        return "auth"
+    if not path.startswith("/users"):
+        return None
+    if method == "GET":
+        return "reads"
+    return "writes"
+
+load_shedder = LoadShedder(
+    {"auth": 1.0, "writes": 0.75, "reads": 0.5},
+    max_concurrency=LOAD_SHED_MAX_CONCURRENCY,
+    tolerance=LOAD_SHED_LATENCY_TOLERANCE
+)
+app.add_middleware(LoadSheddingMiddleware, shedder=load_shedder, classify=classify_request)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -30,12 +58,21 @@ Instrumentator().instrument(app).expose(app)
 
 @app.on_event("startup")
 async def startup_event():
-    """Create database tables when the application starts"""
-    try:
-        models.Base.metadata.create_all(bind=engine)
-        logging.info("Database tables created successfully")
-    except Exception as e:
-        logging.error(f"Error creating database tables: {e}")
+    """Warm the connection pool, bcrypt and the login query in the background.
+
+    Tables are created by the migration step (`alembic upgrade head`), not here.
+    """
+    app.state.warmup_task = asyncio.create_task(startup.warm_up_until_ready(engine))
+    app.state.relay_task = None
+    if outbox.OUTBOX_RELAY_ENABLED:
+        app.state.relay_task = asyncio.create_task(outbox.run_relay(SessionLocal))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.warmup_task.cancel()
+    if app.state.relay_task is not None:
+        app.state.relay_task.cancel()
+    bulk.shutdown_pool()
 
 # Include routers
 app.include_router(users.router)
@@ -52,6 +89,21 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/ready")
+def readiness_check(response: Response, db: Session = Depends(get_db)):
+    """Readiness probe: warm-up finished and the database answers"""
+    if not startup.readiness.ready:
+        response.status_code = 503
+        return {"status": "warming_up", "detail": startup.readiness.last_error}
+
+    try:
+        db.execute(text("SELECT 1"))
+    except Exception as e:
+        response.status_code = 503
+        return {"status": "unavailable", "detail": str(e)}
+
+    return {"status": "ready", "cold_start_seconds": startup.readiness.cold_start_seconds}
+
 @app.post("/token", response_model=schemas.Token)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
@@ -71,8 +123,9 @@ async def login(
         data={"sub": user.username}, expires_delta=access_token_expires
     )
 
-    # Send login event to analytics
-    await users.send_event_to_analytics("user_login", user.id)
+    outbox.add(db, "user_login", user.id)
+    db.commit()
+    outbox.notify()
 
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -94,7 +147,8 @@ async def login_json(
         data={"sub": user.username}, expires_delta=access_token_expires
     )
 
-    # Send login event to analytics
-    await users.send_event_to_analytics("user_login", user.id)
+    outbox.add(db, "user_login", user.id)
+    db.commit()
+    outbox.notify()
 
     return {"access_token": access_token, "token_type": "bearer"}
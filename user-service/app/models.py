@@ -1,9 +1,14 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, JSON, Index
 from sqlalchemy.sql import func
 from .database import Base
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_created_at", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True, nullable=False)
@@ -13,3 +18,43 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+# User search (app/search.py) compares lower(column): prefixes through btree indexes
+# (text_pattern_ops, so LIKE 'q%' can use them whatever the collation), substrings
+# through pg_trgm GIN indexes, which only exist on Postgres
+Index("ix_users_username_lower", func.lower(User.username).label("username_lower"),
+      postgresql_ops={"username_lower": "text_pattern_ops"})
+Index("ix_users_email_lower", func.lower(User.email).label("email_lower"),
+      postgresql_ops={"email_lower": "text_pattern_ops"})
+Index("ix_users_full_name_lower", func.lower(User.full_name).label("full_name_lower"),
+      postgresql_ops={"full_name_lower": "text_pattern_ops"})
+Index("ix_users_username_trgm", func.lower(User.username).label("username_lower"),
+      postgresql_using="gin", postgresql_ops={"username_lower": "gin_trgm_ops"}).ddl_if(dialect="postgresql")
+Index("ix_users_email_trgm", func.lower(User.email).label("email_lower"),
+      postgresql_using="gin", postgresql_ops={"email_lower": "gin_trgm_ops"}).ddl_if(dialect="postgresql")
+Index("ix_users_full_name_trgm", func.lower(User.full_name).label("full_name_lower"),
+      postgresql_using="gin", postgresql_ops={"full_name_lower": "gin_trgm_ops"}).ddl_if(dialect="postgresql")
+
+class OutboxEvent(Base):
+    """Analytics event written in the transaction of the change it describes (see app/outbox.py).
+
+    Timestamps are naive UTC.
+    """
+    __tablename__ = "outbox"
+    __table_args__ = (
+        # Pending rows (delivered_at IS NULL) in id order, and the retention cutoff
+        Index("ix_outbox_delivered_id", "delivered_at", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    event_type = Column(String, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    event_metadata = Column(JSON, nullable=False)
+    # Idempotency key for the analytics service, fixed across redeliveries
+    event_id = Column(String(32), nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String)
+    delivered_at = Column(DateTime)
+    failed_at = Column(DateTime)
@@ -0,0 +1,205 @@
+"""Transactional outbox for events sent to the analytics service.
+
+Handlers add an `outbox` row in the same transaction as the user change it
+describes, so a committed change always has its event, a rolled-back one never
+does, and nothing is sent on the request path. A relay (one per worker, or a
+dedicated `python -m app.outbox` process) claims pending rows in id order with
+`SELECT ... FOR UPDATE SKIP LOCKED`, so concurrent relays take disjoint batches,
+posts them to /analytics/events/batch and marks them delivered in the same
+transaction. Every row carries a fixed `event_id`, so a batch that is resent
+after a crash between the POST and the commit (or, on SQLite, which has no row
+locks, by two racing relays) is dropped by the analytics idempotency check.
+
+Undeliverable batches are retried with exponential backoff; events the analytics
+service refuses individually (422 with per-event errors) are marked failed and
+kept for inspection. Delivered rows are deleted after OUTBOX_RETENTION_HOURS.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import httpx
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+
+ANALYTICS_SERVICE_URL = os.getenv("ANALYTICS_SERVICE_URL", "http://localhost:8001")
+
+OUTBOX_RELAY_ENABLED = os.getenv("OUTBOX_RELAY_ENABLED", "true").lower() == "true"
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "1"))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "60"))
+OUTBOX_RETENTION_HOURS = float(os.getenv("OUTBOX_RETENTION_HOURS", "24"))
+OUTBOX_TIMEOUT_SECONDS = float(os.getenv("OUTBOX_TIMEOUT_SECONDS", "10"))
+
+# Delivered rows are pruned at most this often
+PRUNE_INTERVAL_SECONDS = 300
+
+DELIVERED = Counter("outbox_events_delivered_total", "Outbox events accepted by the analytics service")
+REJECTED = Counter("outbox_events_rejected_total", "Outbox events refused by the analytics service (kept as failed)")
+FAILED_BATCHES = Counter("outbox_delivery_failures_total", "Outbox batches that could not be delivered and will be retried")
+BATCH_SECONDS = Histogram("outbox_relay_batch_seconds", "Time to claim, send and mark one outbox batch")
+LAG_SECONDS = Gauge(
+    "outbox_relay_lag_seconds", "Age of the oldest undelivered outbox event", multiprocess_mode="livemax"
+)
+PENDING = Gauge("outbox_pending_events", "Undelivered outbox events", multiprocess_mode="livemax")
+
+_wakeup: Optional[asyncio.Event] = None
+_last_prune = 0.0
+
+def add(db: Session, event_type: str, user_id: int, metadata: Optional[dict] = None):
+    """Queue an event in the current transaction; it is sent after the transaction commits"""
+    db.add(models.OutboxEvent(
+        event_type=event_type,
+        user_id=user_id,
+        event_metadata=metadata or {},
+        event_id=uuid.uuid4().hex
+    ))
+
+def notify():
+    """Wake this process's relay after committing events, instead of waiting for the next poll"""
+    if _wakeup is not None:
+        _wakeup.set()
+
+def _pending(db: Session):
+    return db.query(models.OutboxEvent).filter(
+        models.OutboxEvent.delivered_at.is_(None),
+        models.OutboxEvent.failed_at.is_(None)
+    )
+
+def _rejected(response: httpx.Response, count: int) -> Dict[int, str]:
+    """Events refused individually in a 422 response: schema errors or request validation errors"""
+    try:
+        detail = response.json().get("detail")
+    except (ValueError, AttributeError):
+        return {}
+    rejected = {}
+    for item in detail if isinstance(detail, list) else []:
+        if not isinstance(item, dict):
+            continue
+        index = item.get("index")
+        location = item.get("loc") or []
+        if index is None and len(location) > 2 and location[:2] == ["body", "events"]:
+            index = location[2]
+        if isinstance(index, int) and 0 <= index < count:
+            rejected[index] = str(item.get("errors") or item.get("msg"))[:500]
+    return rejected
+
+def relay_once(db: Session, client: httpx.Client) -> int:
+    """Claim and send one batch of pending events; returns how many were delivered"""
+    started = time.perf_counter()
+    rows = _pending(db).filter(
+        models.OutboxEvent.available_at <= datetime.utcnow()
+    ).order_by(models.OutboxEvent.id).limit(OUTBOX_BATCH_SIZE).with_for_update(skip_locked=True).all()
+    if not rows:
+        db.rollback()
+        return 0
+
+    try:
+        response = client.post(
+            f"{ANALYTICS_SERVICE_URL}/analytics/events/batch",
+            json={"events": [
+                {
+                    "event_type": row.event_type,
+                    "user_id": row.user_id,
+                    "event_metadata": row.event_metadata,
+                    "event_id": row.event_id,
+                    # When it happened, not when delivery finally succeeded
+                    "created_at": row.created_at.isoformat()
+                }
+                for row in rows
+            ]},
+            timeout=OUTBOX_TIMEOUT_SECONDS
+        )
+        error = None if response.is_success else f"HTTP {response.status_code}: {response.text[:200]}"
+    except httpx.HTTPError as e:
+        response, error = None, f"{type(e).__name__}: {e}"
+
+    now = datetime.utcnow()
+    delivered = 0
+    rejected = _rejected(response, len(rows)) if response is not None and response.status_code == 422 else {}
+    if error is None:
+        for row in rows:
+            row.delivered_at = now
+        delivered = len(rows)
+    elif rejected:
+        # The rest of the batch stays pending and goes out with the next one
+        for index, reason in rejected.items():
+            rows[index].failed_at = now
+            rows[index].last_error = reason
+        REJECTED.inc(len(rejected))
+    else:
+        FAILED_BATCHES.inc()
+        logging.warning(f"Outbox delivery of {len(rows)} events failed: {error}")
+        for row in rows:
+            row.attempts += 1
+            row.last_error = error[:500]
+            backoff = min(OUTBOX_POLL_SECONDS * 2 ** row.attempts, OUTBOX_MAX_BACKOFF_SECONDS)
+            row.available_at = now + timedelta(seconds=backoff)
+    db.commit()
+
+    DELIVERED.inc(delivered)
+    BATCH_SECONDS.observe(time.perf_counter() - started)
+    return delivered
+
+def update_metrics(db: Session):
+    """Export the pending count and the age of the oldest undelivered event"""
+    oldest, pending = _pending(db).with_entities(
+        func.min(models.OutboxEvent.created_at), func.count(models.OutboxEvent.id)
+    ).one()
+    LAG_SECONDS.set((datetime.utcnow() - oldest).total_seconds() if oldest else 0)
+    PENDING.set(pending)
+
+def prune(db: Session) -> int:
+    """Delete rows delivered more than OUTBOX_RETENTION_HOURS ago"""
+    cutoff = datetime.utcnow() - timedelta(hours=OUTBOX_RETENTION_HOURS)
+    deleted = db.query(models.OutboxEvent).filter(
+        models.OutboxEvent.delivered_at < cutoff
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+def _relay_cycle(session_factory, client: httpx.Client) -> int:
+    global _last_prune
+    with session_factory() as db:
+        delivered = relay_once(db, client)
+        update_metrics(db)
+        if time.monotonic() - _last_prune >= PRUNE_INTERVAL_SECONDS:
+            _last_prune = time.monotonic()
+            prune(db)
+    return delivered
+
+async def run_relay(session_factory):
+    """Deliver pending events until cancelled, polling every OUTBOX_POLL_SECONDS when idle"""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    with httpx.Client() as client:
+        while True:
+            _wakeup.clear()
+            try:
+                delivered = await asyncio.to_thread(_relay_cycle, session_factory, client)
+            except Exception as e:
+                logging.warning(f"Outbox relay failed: {e}")
+                delivered = 0
+            # A full batch means more may be waiting
+            if delivered < OUTBOX_BATCH_SIZE:
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), OUTBOX_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+def main():
+    """Run a standalone relay (set OUTBOX_RELAY_ENABLED=false on the web workers)"""
+    from .database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_relay(SessionLocal))
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from collections import Counter
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
-import httpx
-import os
-
-from .. import models, schemas, auth
+from typing import List, Optional
+from datetime import datetime
+import asyncio
+import json
+import logging
+import time
+
+from .. import bulk, models, outbox, schemas, search, auth
 from ..database import get_db
 
 router = APIRouter(prefix="/users", tags=["users"])
 
-ANALYTICS_SERVICE_URL = os.getenv("ANALYTICS_SERVICE_URL", "http://localhost:8001")
-
-async def send_event_to_analytics(event_type: str, user_id: int, metadata: dict = None):
-    """Send event to analytics service"""
-    try:
-        async with httpx.AsyncClient() as client:
-            await client.post(
-                f"{ANALYTICS_SERVICE_URL}/analytics/events",
-                json={
-                    "event_type": event_type,
-                    "user_id": user_id,
-                    "metadata": metadata or {}
-                },
-                timeout=5.0
-            )
-    except Exception as e:
-        print(f"Failed to send event to analytics: {e}")
-
 @router.post("/", response_model=schemas.UserResponse, status_code=status.HTTP_201_CREATED)
 async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     """Register a new user"""
@@ -51,14 +38,84 @@ async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     )
 
     db.add(db_user)
+    db.flush()
+    # The event commits with the user; the outbox relay sends it
+    outbox.add(db, "user_registered", db_user.id, {"username": db_user.username})
     db.commit()
     db.refresh(db_user)
-
-    # Send event to analytics
-    await send_event_to_analytics("user_registered", db_user.id, {"username": db_user.username})
+    outbox.notify()
 
     return db_user
 
+@router.post("/bulk")
+async def create_users_bulk(
+    request: Request,
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Register many users from a JSON list or a CSV file (authenticated).
+
+    Streams one NDJSON result per row (`created`, `conflict` or `invalid`), then a
+    summary line with the counts and users/second.
+    """
+    try:
+        rows = bulk.parse_rows(await request.body(), request.headers.get("content-type", ""))
+    except bulk.BulkInputError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if len(rows) > bulk.BULK_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {bulk.BULK_MAX_ROWS} users per request"
+        )
+
+    async def results():
+        started = time.perf_counter()
+        counts = Counter()
+        pending = None
+        try:
+            valid, invalid = bulk.validate(rows)
+            insertable, conflicts = bulk.remove_conflicts(db, valid)
+            for result in sorted(invalid + conflicts, key=lambda result: result["row"]):
+                counts[result["status"]] += 1
+                yield json.dumps(result) + "\n"
+
+            chunks = [
+                insertable[offset:offset + bulk.BULK_CHUNK_ROWS]
+                for offset in range(0, len(insertable), bulk.BULK_CHUNK_ROWS)
+            ]
+            if chunks:
+                pending = asyncio.ensure_future(bulk.hash_chunk(chunks[0]))
+            for position, chunk in enumerate(chunks):
+                hashes = await pending
+                # Hash the next chunk while this one is inserted
+                pending = asyncio.ensure_future(bulk.hash_chunk(chunks[position + 1])) \
+                    if position + 1 < len(chunks) else None
+
+                chunk_results = bulk.insert_chunk(db, chunk, hashes)
+                outbox.notify()
+                for result in chunk_results:
+                    counts[result["status"]] += 1
+                    yield json.dumps(result) + "\n"
+        finally:
+            if pending is not None:
+                pending.cancel()
+            db.close()
+
+        seconds = time.perf_counter() - started
+        users_per_second = counts["created"] / seconds if seconds else 0.0
+        logging.info(f"Bulk import: {counts['created']} of {len(rows)} users in {seconds:.1f}s "
+                     f"({users_per_second:.0f} users/s)")
+        yield json.dumps({"summary": {
+            "rows": len(rows),
+            "created": counts["created"],
+            "conflicts": counts["conflict"],
+            "invalid": counts["invalid"],
+            "seconds": round(seconds, 3),
+            "users_per_second": round(users_per_second, 1),
+        }}) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 @router.get("/", response_model=List[schemas.UserResponse])
 async def get_users(
     skip: int = 0,
@@ -70,6 +127,36 @@ async def get_users(
     users = db.query(models.User).offset(skip).limit(limit).all()
     return users
 
+@router.get("/search", response_model=schemas.UserSearchResults)
+async def search_users(
+    q: Optional[str] = Query(None, min_length=1, max_length=100),
+    match: str = Query("contains", pattern="^(prefix|contains)$"),
+    field: Optional[List[str]] = Query(None, description="username, email and/or full_name (default: all)"),
+    is_active: Optional[bool] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: models.User = Depends(auth.get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Search users by username, email or full name, ordered by id (authenticated).
+
+    `match=prefix` finds values starting with `q`, `contains` (at least 3 characters)
+    values containing it, case-insensitively. Pass `next_cursor` back as `cursor` for
+    the next page.
+    """
+    unknown = set(field or []) - set(search.SEARCH_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown search fields: {', '.join(sorted(unknown))}")
+    try:
+        users, next_cursor = search.search_users(
+            db, q, match, field, is_active, created_after, created_before, cursor, limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"users": users, "next_cursor": next_cursor}
+
 @router.get("/me", response_model=schemas.UserResponse)
 async def get_current_user_profile(current_user: models.User = Depends(auth.get_current_active_user)):
     """Get current user profile"""
@@ -116,11 +203,10 @@ async def update_user(
     for field, value in update_data.items():
         setattr(db_user, field, value)
 
+    outbox.add(db, "profile_updated", db_user.id, {"fields": sorted(update_data)})
     db.commit()
     db.refresh(db_user)
-
-    # Send event to analytics
-    await send_event_to_analytics("profile_updated", db_user.id)
+    outbox.notify()
 
     return db_user
 
@@ -143,6 +229,8 @@ async def delete_user(
         raise HTTPException(status_code=404, detail="User not found")
 
     db.delete(db_user)
+    outbox.add(db, "user_deleted", user_id)
     db.commit()
+    outbox.notify()
 
     return None
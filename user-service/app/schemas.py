@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 class UserBase(BaseModel):
@@ -26,6 +26,11 @@ class UserResponse(UserBase):
     class Config:
         from_attributes = True
 
+class UserSearchResults(BaseModel):
+    users: List[UserResponse]
+    # Pass as `cursor` for the next page; None on the last page
+    next_cursor: Optional[int] = None
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -0,0 +1,87 @@
+"""User search by username, email or full name, with keyset pagination.
+
+Matching is case-insensitive on lower(column). Prefix matches use the btree
+indexes on lower(column): on Postgres as `LIKE 'q%'` (the indexes use
+text_pattern_ops), on SQLite, which only uses indexes for LIKE with
+case_sensitive_like, as the equivalent range `q <= lower(column) < q || U+10FFFF`.
+Substring matches are `LIKE '%q%'`, served by pg_trgm GIN indexes on Postgres;
+SQLite has no such index and scans. Trigrams need at least
+MIN_SUBSTRING_LENGTH characters to narrow anything down, so shorter substring
+queries are refused.
+
+Results are ordered by id and paged with `id > cursor`, so a page costs the
+same wherever it is and does not shift when users are added.
+"""
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, func, literal, or_
+from sqlalchemy.orm import Session
+
+from . import models
+
+SEARCH_FIELDS = {
+    "username": models.User.username,
+    "email": models.User.email,
+    "full_name": models.User.full_name,
+}
+
+MIN_SUBSTRING_LENGTH = 3
+
+# Above every character, so `q || MAX_CHAR` bounds the strings starting with q
+# (SQLite's BINARY collation compares code points)
+MAX_CHAR = "\U0010ffff"
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def match_criterion(db: Session, column, q: str, match: str):
+    """Case-insensitive prefix or substring match of `q` on `column`"""
+    lowered = func.lower(column)
+    if match == "prefix" and db.get_bind().dialect.name != "postgresql":
+        lowered_q = func.lower(literal(q))
+        return and_(lowered >= lowered_q, lowered < lowered_q.concat(MAX_CHAR))
+    pattern = f"{_escape_like(q)}%" if match == "prefix" else f"%{_escape_like(q)}%"
+    return lowered.like(func.lower(literal(pattern)), escape="\\")
+
+def search_users(
+    db: Session,
+    q: Optional[str] = None,
+    match: str = "contains",
+    fields: Optional[List[str]] = None,
+    is_active: Optional[bool] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    cursor: Optional[int] = None,
+    limit: int = 50
+) -> Tuple[List[models.User], Optional[int]]:
+    """Users matching `q` in any of `fields` (default: all) and the filters, by id.
+
+    Returns (users, cursor of the next page or None). Raises ValueError for a
+    substring query shorter than MIN_SUBSTRING_LENGTH.
+    """
+    query = db.query(models.User)
+    if q:
+        if match == "contains" and len(q) < MIN_SUBSTRING_LENGTH:
+            raise ValueError(f"substring search needs at least {MIN_SUBSTRING_LENGTH} characters")
+        query = query.filter(or_(*(
+            match_criterion(db, SEARCH_FIELDS[field], q, match) for field in fields or SEARCH_FIELDS
+        )))
+    if is_active is not None:
+        query = query.filter(models.User.is_active == is_active)
+    if created_after is not None:
+        query = query.filter(models.User.created_at >= created_after)
+    if created_before is not None:
+        query = query.filter(models.User.created_at < created_before)
+    if cursor is not None:
+        query = query.filter(models.User.id > cursor)
+
+    order = models.User.id
+    if q and match == "prefix" and db.get_bind().dialect.name != "postgresql":
+        # Without value statistics SQLite prefers walking the primary key in order, which reads
+        # the whole table for a rare prefix; `id + 0` makes it use the lower() indexes and sort
+        order = models.User.id + 0
+    users = query.order_by(order).limit(limit + 1).all()
+    if len(users) > limit:
+        return users[:limit], users[limit - 1].id
+    return users, None
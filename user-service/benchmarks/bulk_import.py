@@ -0,0 +1,84 @@
+"""Users/second through POST /users/ one at a time versus POST /users/bulk.
+
+Starts the service under gunicorn with one worker, registers users with
+sequential single-user requests, then imports a larger batch through the bulk
+endpoint and reads its summary line. bcrypt dominates both paths, so the bulk
+rate should grow with the number of cores (BULK_HASH_WORKERS).
+
+Usage (from user-service/):
+    python -m benchmarks.bulk_import [single_users] [bulk_users]
+    DATABASE_URL=postgresql://... python -m benchmarks.bulk_import
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+PORT = int(os.getenv("BENCH_PORT", "8104"))
+BASE_URL = f"http://127.0.0.1:{PORT}"
+ADMIN = {"username": "bulkadmin", "password": "bulkadmin123"}
+
+def wait_until_ready(timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{BASE_URL}/ready").status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("service did not become ready")
+
+def user(prefix: str, i: int) -> dict:
+    return {"username": f"{prefix}{i}", "email": f"{prefix}{i}@example.com", "password": "benchpass123"}
+
+def main():
+    single_users = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    bulk_users = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bulk_import.db")
+    env.setdefault("ANALYTICS_SERVICE_URL", "http://127.0.0.1:9")
+    env["PORT"] = str(PORT)
+    env["WEB_CONCURRENCY"] = "1"
+    subprocess.run(["alembic", "upgrade", "head"], env=env, check=True, capture_output=True)
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app.main:app", "-c", "gunicorn.conf.py"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready()
+        with httpx.Client(base_url=BASE_URL, timeout=None) as client:
+            client.post("/users/", json={**ADMIN, "email": "bulkadmin@example.com"}).raise_for_status()
+            token = client.post("/login", json=ADMIN).json()["access_token"]
+
+            started = time.perf_counter()
+            for i in range(single_users):
+                client.post("/users/", json=user("single", i)).raise_for_status()
+            single_rate = single_users / (time.perf_counter() - started)
+
+            started = time.perf_counter()
+            response = client.post(
+                "/users/bulk",
+                json={"users": [user("bulk", i) for i in range(bulk_users)]},
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            response.raise_for_status()
+            elapsed = time.perf_counter() - started
+            summary = json.loads(response.text.splitlines()[-1])["summary"]
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"{'path':>12} {'users':>7} {'users/s':>9}")
+    print(f"{'POST /users/':>12} {single_users:>7} {single_rate:>9.1f}")
+    print(f"{'bulk':>12} {summary['created']:>7} {summary['created'] / elapsed:>9.1f}"
+          f"  (server-reported {summary['users_per_second']:.1f}, {os.cpu_count()} cores)")
+
+if __name__ == "__main__":
+    main()
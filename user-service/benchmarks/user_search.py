@@ -0,0 +1,143 @@
+"""Latency of GET /users/search at millions of users.
+
+Seeds the users table with generated names and emails, starts the service under
+gunicorn with one worker and times each query shape: prefix and substring
+matches (rare and common terms, one field and all fields), a filter-only query,
+and the last page reached through the keyset cursor versus through `skip` on
+GET /users/. On SQLite substring matches scan the table (no trigram index);
+run against Postgres to measure the pg_trgm indexes.
+
+Usage (from user-service/):
+    python -m benchmarks.user_search [users] [repeats]
+    DATABASE_URL=postgresql://... python -m benchmarks.user_search 5000000
+"""
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+PORT = int(os.getenv("BENCH_PORT", "8105"))
+BASE_URL = f"http://127.0.0.1:{PORT}"
+ADMIN = {"username": "searchadmin", "password": "searchadmin123"}
+CHUNK = 50_000
+
+FIRST_NAMES = [
+    "Maria", "Mark", "James", "Anna", "Li", "Mohammed", "Sofia", "Lucas", "Emma", "Noah", "Olivia", "Liam",
+    "Yuki", "Chen", "Fatima", "Ivan", "Elena", "Pedro", "Aisha", "Tom", "Sara", "David", "Nina", "Omar",
+]
+LAST_NAMES = [
+    "Smith", "Garcia", "Martin", "Muller", "Rossi", "Kim", "Nguyen", "Silva", "Kowalski", "Jensen", "Novak",
+    "Dubois", "Tanaka", "Okafor", "Haddad", "Petrov", "Larsen", "Moreau", "Schmidt", "Costa", "Quinn", "Zhang",
+]
+DOMAINS = ["example.com", "mail.example", "corp.example", "uni.example"]
+
+def seed(url: str, users: int):
+    from sqlalchemy import create_engine, insert
+
+    from app import models
+
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1)
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        for offset in range(0, users, CHUNK):
+            rows = []
+            for i in range(offset + 1, min(offset + CHUNK, users) + 1):
+                first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                rows.append({
+                    "id": i,
+                    "username": f"{first.lower()}.{last.lower()}{i}",
+                    "email": f"{first.lower()}{i}@{rng.choice(DOMAINS)}",
+                    "full_name": f"{first} {last}",
+                    "hashed_password": "-",
+                    "is_active": rng.random() < 0.95,
+                    "created_at": start + timedelta(seconds=30 * i),
+                })
+            connection.execute(insert(models.User), rows)
+    if url.startswith("postgresql"):
+        with engine.connect() as connection:
+            connection.exec_driver_sql(f"SELECT setval('users_id_seq', {users})")
+            connection.commit()
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("VACUUM ANALYZE users")
+    else:
+        with engine.begin() as connection:
+            connection.exec_driver_sql("ANALYZE")
+    engine.dispose()
+
+def wait_until_ready(timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{BASE_URL}/ready").status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("service did not become ready")
+
+def cases(users: int):
+    middle = datetime(2024, 1, 1) + timedelta(seconds=15 * users)
+    return [
+        ("prefix, username, common", "/users/search", {"q": "mar", "match": "prefix", "field": "username"}),
+        ("prefix, all fields, common", "/users/search", {"q": "mar", "match": "prefix"}),
+        ("prefix, all fields, rare", "/users/search", {"q": "maria.smith12", "match": "prefix"}),
+        ("contains, username, rare", "/users/search", {"q": "smith1234", "field": "username"}),
+        ("contains, all fields, common", "/users/search", {"q": "smith"}),
+        ("contains, all fields, no match", "/users/search", {"q": "xqz"}),
+        ("filters only", "/users/search", {"is_active": "false", "created_after": middle.isoformat()}),
+        ("last page, keyset", "/users/search", {"cursor": users - 50}),
+        ("last page, skip", "/users/", {"skip": users - 50, "limit": 50}),
+    ]
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/user_search.db")
+    env.setdefault("ANALYTICS_SERVICE_URL", "http://127.0.0.1:9")
+    env["OUTBOX_RELAY_ENABLED"] = "false"
+    env["PORT"] = str(PORT)
+    env["WEB_CONCURRENCY"] = "1"
+    subprocess.run(["alembic", "upgrade", "head"], env=env, check=True, capture_output=True)
+    started = time.perf_counter()
+    seed(env["DATABASE_URL"], users)
+    print(f"Seeded {users:,} users in {time.perf_counter() - started:.0f}s")
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app.main:app", "-c", "gunicorn.conf.py"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready()
+        with httpx.Client(base_url=BASE_URL, timeout=None) as client:
+            client.post("/users/", json={**ADMIN, "email": "searchadmin@example.com"}).raise_for_status()
+            token = client.post("/login", json=ADMIN).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+
+            print(f"{'query':<32} {'results':>8} {'p50 ms':>9} {'p95 ms':>9}")
+            for name, path, params in cases(users):
+                latencies = []
+                for _ in range(repeats):
+                    begun = time.perf_counter()
+                    response = client.get(path, params=params, headers=headers)
+                    latencies.append((time.perf_counter() - begun) * 1000)
+                    response.raise_for_status()
+                body = response.json()
+                results = len(body["users"]) if isinstance(body, dict) else len(body)
+                latencies.sort()
+                p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                print(f"{name:<32} {results:>8} {statistics.median(latencies):>9.1f} {p95:>9.1f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    main()
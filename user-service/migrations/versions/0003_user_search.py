@@ -0,0 +1,57 @@
+"""Indexes for user search
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+
+Prefix searches use btree indexes on lower(column); substring searches use pg_trgm
+GIN indexes, created on Postgres only. On Postgres the indexes are built
+CONCURRENTLY so a large users table stays writable during the upgrade. Databases
+created by the old startup ``create_all`` from current models already have them.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_COLUMNS = ["username", "email", "full_name"]
+
+
+def upgrade() -> None:
+    postgres = op.get_bind().dialect.name == "postgresql"
+    if not postgres:
+        op.create_index("ix_users_created_at", "users", ["created_at"], if_not_exists=True)
+        for column in SEARCH_COLUMNS:
+            op.create_index(f"ix_users_{column}_lower", "users", [sa.text(f"lower({column})")], if_not_exists=True)
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_users_created_at", "users", ["created_at"], postgresql_concurrently=True, if_not_exists=True
+        )
+        for column in SEARCH_COLUMNS:
+            op.create_index(
+                f"ix_users_{column}_lower", "users", [sa.text(f"lower({column}) text_pattern_ops")],
+                postgresql_concurrently=True, if_not_exists=True
+            )
+            op.create_index(
+                f"ix_users_{column}_trgm", "users", [sa.text(f"lower({column}) gin_trgm_ops")],
+                postgresql_using="gin", postgresql_concurrently=True, if_not_exists=True
+            )
+
+
+def downgrade() -> None:
+    postgres = op.get_bind().dialect.name == "postgresql"
+    for column in SEARCH_COLUMNS:
+        if postgres:
+            op.drop_index(f"ix_users_{column}_trgm", table_name="users")
+        op.drop_index(f"ix_users_{column}_lower", table_name="users")
+    op.drop_index("ix_users_created_at", table_name="users")
@@ -4,6 +4,9 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
+from service_common import startup
+
+from app import outbox
 from app.main import app
 from app.database import Base, get_db
 
@@ -29,8 +32,11 @@ def db_session():
         Base.metadata.drop_all(bind=engine)
 
 @pytest.fixture
-def client(db_session):
+def client(db_session, monkeypatch):
     """Create a test client with the test database"""
+    # Tests drive the outbox relay directly (see test_outbox.py)
+    monkeypatch.setattr(outbox, "OUTBOX_RELAY_ENABLED", False)
+
     def override_get_db():
         try:
             yield db_session
@@ -41,3 +47,10 @@ def client(db_session):
     with TestClient(app) as test_client:
         yield test_client
     app.dependency_overrides.clear()
+
+@pytest.fixture
+def readiness(monkeypatch):
+    """Give each test its own readiness state"""
+    state = startup.Readiness()
+    monkeypatch.setattr(startup, "readiness", state)
+    return state
@@ -0,0 +1,19 @@
+from fastapi import status
+
+from app.main import load_shedder
+
+def test_overloaded_reads_do_not_block_login(client, monkeypatch):
+    """Test that reads are shed with 503 + Retry-After while login is still admitted"""
+    client.post(
+        "/users/",
+        json={"username": "testuser", "email": "test@example.com", "password": "testpass123"}
+    )
+    reads = load_shedder.limits["reads"]
+    monkeypatch.setattr(reads, "in_flight", int(reads.limit))
+
+    response = client.get("/users/")
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "1"
+
+    response = client.post("/login", json={"username": "testuser", "password": "testpass123"})
+    assert response.status_code == status.HTTP_200_OK
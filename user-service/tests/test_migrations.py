@@ -0,0 +1,34 @@
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine
+
+from app.database import Base
+
+def run_upgrade(url):
+    config = Config("alembic.ini")
+    config.set_main_option("sqlalchemy.url", url)
+    config.attributes["configure_logger"] = False
+    command.upgrade(config, "head")
+
+def test_migrations_match_models(tmp_path):
+    """Test that upgrading to head produces exactly the schema the models describe"""
+    url = f"sqlite:///{tmp_path / 'migrated.db'}"
+    run_upgrade(url)
+
+    engine = create_engine(url)
+    with engine.connect() as connection:
+        diff = compare_metadata(MigrationContext.configure(connection), Base.metadata)
+    engine.dispose()
+
+    assert diff == []
+
+def test_migrations_adopt_existing_schema(tmp_path):
+    """Test that databases created by the old startup create_all can be migrated"""
+    url = f"sqlite:///{tmp_path / 'legacy.db'}"
+    engine = create_engine(url)
+    Base.metadata.tables["users"].create(bind=engine)
+    engine.dispose()
+
+    run_upgrade(url)
@@ -0,0 +1,103 @@
+import json
+from datetime import datetime, timedelta
+
+import httpx
+from fastapi import status
+
+from app import models, outbox
+
+def analytics(handler):
+    """Client whose requests to the analytics service are answered by `handler`"""
+    requests = []
+
+    def respond(request):
+        requests.append(json.loads(request.content))
+        return handler(request)
+    return httpx.Client(transport=httpx.MockTransport(respond)), requests
+
+def pending(db_session):
+    return db_session.query(models.OutboxEvent).filter(models.OutboxEvent.delivered_at.is_(None)).all()
+
+def test_user_changes_write_outbox_events(client, db_session):
+    """Test registration, login, update and deletion queue events instead of sending them"""
+    user_id = client.post(
+        "/users/", json={"username": "outboxuser", "email": "outbox@example.com", "password": "outboxpass123"}
+    ).json()["id"]
+    token = client.post("/login", json={"username": "outboxuser", "password": "outboxpass123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    client.put(f"/users/{user_id}", json={"full_name": "Outbox User"}, headers=headers)
+    assert client.delete(f"/users/{user_id}", headers=headers).status_code == status.HTTP_204_NO_CONTENT
+
+    events = pending(db_session)
+    assert [event.event_type for event in events] == ["user_registered", "user_login", "profile_updated", "user_deleted"]
+    assert {event.user_id for event in events} == {user_id}
+    assert events[0].event_metadata == {"username": "outboxuser"}
+    assert events[2].event_metadata == {"fields": ["full_name"]}
+
+def test_failed_registration_writes_no_event(client, db_session):
+    """Test a rejected change leaves nothing in the outbox"""
+    user = {"username": "dupe", "email": "dupe@example.com", "password": "dupepass123"}
+    client.post("/users/", json=user)
+    assert client.post("/users/", json=user).status_code == status.HTTP_400_BAD_REQUEST
+    assert len(pending(db_session)) == 1
+
+def test_relay_delivers_batches(db_session, monkeypatch):
+    """Test the relay sends pending events in id-ordered batches and marks them delivered"""
+    monkeypatch.setattr(outbox, "OUTBOX_BATCH_SIZE", 2)
+    for user_id in range(3):
+        outbox.add(db_session, "user_registered", user_id, {"username": f"u{user_id}"})
+    db_session.commit()
+    http, requests = analytics(lambda request: httpx.Response(201, json={}))
+
+    assert outbox.relay_once(db_session, http) == 2
+    assert outbox.relay_once(db_session, http) == 1
+    assert outbox.relay_once(db_session, http) == 0
+
+    assert [[event["user_id"] for event in body["events"]] for body in requests] == [[0, 1], [2]]
+    assert requests[0]["events"][0]["event_metadata"] == {"username": "u0"}
+    # Sent with the time the event happened, which analytics sessionizes on
+    assert requests[0]["events"][0]["created_at"] == db_session.query(models.OutboxEvent).order_by(models.OutboxEvent.id).first().created_at.isoformat()
+    assert pending(db_session) == []
+
+    # Delivered rows are kept for the retention period only
+    db_session.query(models.OutboxEvent).update({"delivered_at": datetime.utcnow() - timedelta(days=2)})
+    db_session.commit()
+    assert outbox.prune(db_session) == 3
+
+def test_relay_retries_with_backoff_and_keeps_event_ids(db_session):
+    """Test an unreachable analytics service delays the batch and the retry reuses the event ids"""
+    outbox.add(db_session, "user_login", 7)
+    db_session.commit()
+
+    def unreachable(request):
+        raise httpx.ConnectError("connection refused")
+    down, _ = analytics(unreachable)
+    assert outbox.relay_once(db_session, down) == 0
+
+    event = pending(db_session)[0]
+    assert event.attempts == 1 and "ConnectError" in event.last_error
+    assert event.available_at > datetime.utcnow()
+    assert outbox.relay_once(db_session, down) == 0
+
+    event.available_at = datetime.utcnow()
+    db_session.commit()
+    up, requests = analytics(lambda request: httpx.Response(201, json={}))
+    assert outbox.relay_once(db_session, up) == 1
+    assert requests[0]["events"][0]["event_id"] == event.event_id
+
+def test_relay_sets_aside_rejected_events(db_session):
+    """Test events refused individually are marked failed while the rest are resent"""
+    for user_id in range(3):
+        outbox.add(db_session, "user_registered", user_id)
+    db_session.commit()
+    rejected, _ = analytics(lambda request: httpx.Response(422, json={"detail": [
+        {"index": 1, "event_type": "user_registered", "errors": ["event_metadata.username: required"]}
+    ]}))
+
+    assert outbox.relay_once(db_session, rejected) == 0
+    failed = db_session.query(models.OutboxEvent).filter(models.OutboxEvent.failed_at.isnot(None)).one()
+    assert failed.user_id == 1 and "username" in failed.last_error
+
+    accepted, requests = analytics(lambda request: httpx.Response(201, json={}))
+    assert outbox.relay_once(db_session, accepted) == 2
+    assert [event["user_id"] for event in requests[0]["events"]] == [0, 2]
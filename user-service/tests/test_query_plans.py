@@ -0,0 +1,41 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.query_plans import BUDGETS_PATH, budget_for, cases, check, measure
+
+# EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) output of the registration duplicate check
+EXPLAIN = [{"Plan": {
+    "Node Type": "Limit", "Actual Rows": 1, "Actual Loops": 1, "Shared Hit Blocks": 9, "Shared Read Blocks": 1,
+    "Plans": [{"Node Type": "Bitmap Heap Scan", "Relation Name": "users", "Actual Rows": 1, "Actual Loops": 1,
+               "Rows Removed by Index Recheck": 0, "Plans": [{"Node Type": "BitmapOr", "Plans": [
+                   {"Node Type": "Bitmap Index Scan", "Index Name": "ix_users_email"},
+                   {"Node Type": "Bitmap Index Scan", "Index Name": "ix_users_username"},
+               ]}]}],
+}}]
+
+def test_plan_measures_and_budgets():
+    measured = measure(EXPLAIN)
+    assert measured["seq_scans"] == [] and measured["rows"] == 1 and measured["buffers"] == 10
+    assert measured["shape"][1] == "  Bitmap Heap Scan on users"
+    assert measured["shape"][3] == "      Bitmap Index Scan using ix_users_email"
+
+    statement = {"sql": "SELECT 1", **measured}
+    assert check([statement], {"no_seq_scan": ["users"], "max_rows": 1, "max_buffers": 10}) == []
+    assert check([statement, statement], {"max_rows": 1, "max_buffers": None}) == ["rows 2 over budget 1"]
+
+    budgets = json.loads(BUDGETS_PATH.read_text())
+    assert set(budgets["cases"]) <= {case[0] for case in cases(1000)}
+    assert budget_for(budgets, "list_users_deep_offset")["max_rows"] == 550000
+    assert budget_for(budgets, "me") == budgets["default"]
+
+@pytest.mark.skipif(not os.getenv("PLAN_DATABASE_URL"), reason="needs an empty Postgres database in PLAN_DATABASE_URL")
+def test_endpoints_stay_within_plan_budgets(tmp_path):
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.query_plans", "--report", str(tmp_path / "report.txt")],
+        capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
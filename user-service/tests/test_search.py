@@ -0,0 +1,66 @@
+from datetime import datetime
+
+from fastapi import status
+
+from app import models
+
+PEOPLE = [
+    ("alice", "alice@example.com", "Alice Martin", True, datetime(2026, 1, 5)),
+    ("alicia", "alicia@corp.example", "Alicia Keyes", True, datetime(2026, 2, 5)),
+    ("bob_smith", "bob@example.com", "Robert Smith", False, datetime(2026, 3, 5)),
+    ("carol", "carol@smith.example", None, True, datetime(2026, 4, 5)),
+    ("bob%", "percent@example.com", "Bob Percent", True, datetime(2026, 5, 5)),
+]
+
+def signed_in(client, db_session):
+    """Seed PEOPLE and return headers of another, signed-in user"""
+    db_session.add_all([
+        models.User(username=username, email=email, full_name=full_name, is_active=active,
+                    created_at=created_at, hashed_password="-")
+        for username, email, full_name, active, created_at in PEOPLE
+    ])
+    db_session.commit()
+    client.post("/users/", json={"username": "searcher", "email": "searcher@example.com", "password": "searchpass1"})
+    token = client.post("/login", json={"username": "searcher", "password": "searchpass1"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+def usernames(response):
+    return [user["username"] for user in response.json()["users"]]
+
+def test_search_matches_prefix_and_substring(client, db_session):
+    headers = signed_in(client, db_session)
+
+    def search(**params):
+        return client.get("/users/search", params=params, headers=headers)
+
+    assert usernames(search(q="ALI", match="prefix")) == ["alice", "alicia"]
+    assert usernames(search(q="ali", match="prefix", field="username")) == ["alice", "alicia"]
+    assert usernames(search(q="smith")) == ["bob_smith", "carol"]
+    assert usernames(search(q="smith", field=["full_name"])) == ["bob_smith"]
+    assert usernames(search(q="corp.ex")) == ["alicia"]
+
+    # LIKE wildcards in the query match literally
+    assert usernames(search(q="bob%", match="prefix")) == ["bob%"]
+    assert usernames(search(q="b_s", match="prefix")) == []
+    assert usernames(search(q="ob%")) == ["bob%"]
+
+    assert usernames(search(is_active="false")) == ["bob_smith"]
+    window = {"created_after": "2026-02-01T00:00:00", "created_before": "2026-04-01T00:00:00"}
+    assert usernames(search(q="example", **window)) == ["alicia", "bob_smith"]
+
+    assert search(q="al").status_code == status.HTTP_400_BAD_REQUEST
+    assert search(q="alice", field="password").status_code == status.HTTP_400_BAD_REQUEST
+    assert client.get("/users/search", params={"q": "alice"}).status_code == status.HTTP_401_UNAUTHORIZED
+
+def test_search_pages_with_cursor(client, db_session):
+    headers = signed_in(client, db_session)
+
+    pages, cursor = [], None
+    while True:
+        params = {"q": "example", "limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/users/search", params=params, headers=headers).json()
+        pages.append([user["username"] for user in page["users"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert pages == [["alice", "alicia"], ["bob_smith", "carol"], ["bob%", "searcher"]]
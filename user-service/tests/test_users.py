@@ -1,6 +1,13 @@
+import json
+
 import pytest
 from fastapi import status
 
+from service_common import startup
+
+from app import bulk
+from tests.conftest import engine
+
 def test_create_user(client):
     """Test user registration"""
     response = client.post(
@@ -164,8 +171,71 @@ def test_delete_user(client):
 
     assert response.status_code == status.HTTP_204_NO_CONTENT
 
+def auth_headers(client):
+    client.post(
+        "/users/",
+        json={"username": "admin", "email": "admin@example.com", "password": "adminpass123"}
+    )
+    token = client.post("/login", json={"username": "admin", "password": "adminpass123"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+def test_bulk_create_users(client, monkeypatch):
+    """Test bulk import reports created, conflicting and invalid rows, then a summary"""
+    monkeypatch.setattr(bulk, "BULK_CHUNK_ROWS", 2)
+    headers = auth_headers(client)
+    users = [
+        {"username": f"bulk{i}", "email": f"bulk{i}@example.com", "password": "bulkpass123"} for i in range(3)
+    ] + [
+        {"username": "admin", "email": "other@example.com", "password": "bulkpass123"},
+        {"username": "bulk0", "email": "again@example.com", "password": "bulkpass123"},
+        {"username": "x", "email": "not-an-email", "password": "short"},
+    ]
+
+    response = client.post("/users/bulk", json={"users": users}, headers=headers)
+
+    assert response.status_code == status.HTTP_200_OK
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    results = {line["row"]: line for line in lines[:-1]}
+    assert [results[i]["status"] for i in range(6)] == ["created"] * 3 + ["conflict", "conflict", "invalid"]
+    assert lines[-1]["summary"]["created"] == 3
+    assert lines[-1]["summary"]["users_per_second"] > 0
+
+    login = client.post("/login", json={"username": "bulk2", "password": "bulkpass123"})
+    assert login.status_code == status.HTTP_200_OK
+
+def test_bulk_create_users_from_csv(client):
+    """Test bulk import accepts CSV with a header line"""
+    headers = {**auth_headers(client), "Content-Type": "text/csv"}
+    body = "username,email,password,full_name\ncsvuser,csv@example.com,csvpass123,CSV User\n"
+
+    response = client.post("/users/bulk", content=body, headers=headers)
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0]["status"] == "created"
+    assert lines[-1]["summary"]["rows"] == 1
+
+def test_bulk_create_users_rejects_bad_input(client):
+    """Test bulk import needs authentication and a list of users"""
+    assert client.post("/users/bulk", json=[]).status_code == status.HTTP_401_UNAUTHORIZED
+    response = client.post("/users/bulk", json={"user": {}}, headers=auth_headers(client))
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
 def test_health_check(client):
     """Test health check endpoint"""
     response = client.get("/health")
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == {"status": "healthy"}
+
+def test_readiness_before_warm_up(client, readiness):
+    """Test readiness probe fails until warm-up has completed"""
+    response = client.get("/ready")
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.json()["status"] == "warming_up"
+
+def test_readiness_after_warm_up(client, readiness):
+    """Test readiness probe succeeds once the pool, bcrypt and login query are warm"""
+    assert startup.warm_up(engine) is True
+
+    response = client.get("/ready")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["status"] == "ready"